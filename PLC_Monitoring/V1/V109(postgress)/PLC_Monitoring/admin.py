@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import PLC, PLC_Logs, PLC_Keys, Rolls, Roll_Breaks, ChartExcludedKeys
+from .models import PLC, PLC_Logs, PLC_Keys, Rolls, Roll_Breaks, ChartExcludedKeys, RollKeyAggregate, PLC_Rollups, Roll_Segments, PLC_Alerts
 import jdatetime
 
 
@@ -65,4 +65,36 @@ class PLCKeysAdmin(JalaliDateTimeMixin, admin.ModelAdmin):
 class ChartExcludedKeysAdmin(JalaliDateTimeMixin, admin.ModelAdmin):
     list_display = ('id', 'key', 'jalali_creation_datetime')
     search_fields = ('key',)
-    ordering = ('-CreationDateTime',)
\ No newline at end of file
+    ordering = ('-CreationDateTime',)
+
+
+@admin.register(RollKeyAggregate)
+class RollKeyAggregateAdmin(JalaliDateTimeMixin, admin.ModelAdmin):
+    list_display = ('id', 'roll', 'key', 'count', 'sum', 'min', 'max', 'last', 'jalali_last_update')
+    list_filter = ('key',)
+    search_fields = ('key', 'roll__roll_number')
+    ordering = ('-LastUpdate',)
+
+
+@admin.register(PLC_Rollups)
+class PLCRollupsAdmin(JalaliDateTimeMixin, admin.ModelAdmin):
+    list_display = ('id', 'plc', 'roll', 'resolution', 'bucket', 'key', 'count', 'min', 'max', 'last', 'jalali_last_update')
+    list_filter = ('resolution', 'plc', 'key')
+    search_fields = ('key', 'roll__roll_number')
+    ordering = ('-bucket',)
+
+
+@admin.register(Roll_Segments)
+class RollSegmentsAdmin(JalaliDateTimeMixin, admin.ModelAdmin):
+    list_display = ('id', 'plc', 'roll', 'is_running', 'started_at', 'ended_at', 'jalali_last_update')
+    list_filter = ('plc', 'is_running')
+    search_fields = ('roll__roll_number',)
+    ordering = ('-started_at',)
+
+
+@admin.register(PLC_Alerts)
+class PLCAlertsAdmin(JalaliDateTimeMixin, admin.ModelAdmin):
+    list_display = ('id', 'plc', 'roll', 'key', 'kind', 'threshold', 'value', 'peak', 'opened_at', 'closed_at', 'jalali_last_update')
+    list_filter = ('plc', 'kind', 'key')
+    search_fields = ('key', 'roll__roll_number')
+    ordering = ('-opened_at',)
@@ -0,0 +1,143 @@
+"""Server-side evaluation of the KeyAlertConfig thresholds on the ingestion path.
+
+The configs of the metadata registry are compiled once per registry version into a key -> Rule table,
+so checking a sample costs one dict lookup per key it carries. An alert opens after DEBOUNCE_SAMPLES
+consecutive samples past a threshold and closes after as many samples back inside it by the
+hysteresis band, so a value hovering at the threshold does not flap.
+"""
+from .models import NUMERIC_RE, PLC_Alerts
+from .metadata import registry
+
+HYSTERESIS = 0.02       # fraction of the threshold (or of max - min when both are set) a value must come back by
+DEBOUNCE_SAMPLES = 2    # consecutive samples needed to open or close an alert
+
+
+class Rule:
+    __slots__ = ('low', 'high', 'low_clear', 'high_clear')
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+        span = high - low if low is not None and high is not None and high > low else None
+        self.low_clear = low + (span if span is not None else abs(low)) * HYSTERESIS if low is not None else None
+        self.high_clear = high - (span if span is not None else abs(high)) * HYSTERESIS if high is not None else None
+
+    def state(self, value, open_kind):
+        """'max', 'min' or None for value, given the kind of the alert currently open"""
+        if self.high is not None and value > (self.high_clear if open_kind == 'max' else self.high):
+            return 'max'
+        if self.low is not None and value < (self.low_clear if open_kind == 'min' else self.low):
+            return 'min'
+        return None
+
+    def threshold(self, kind):
+        return self.high if kind == 'max' else self.low
+
+
+_compiled = (None, {})
+
+
+def current_rules():
+    """Rules of the current metadata snapshot, compiled once per snapshot"""
+    global _compiled
+    snapshot = registry.current()
+    if _compiled[0] is not snapshot:
+        rules = {}
+        for key, config in snapshot.alert_configs.items():
+            if config['min_value'] is not None or config['max_value'] is not None:
+                rules[key] = Rule(config['min_value'], config['max_value'])
+        _compiled = (snapshot, rules)
+    return _compiled[1]
+
+
+class KeyState:
+    __slots__ = ('alert', 'pending', 'count')
+
+    def __init__(self, alert=None):
+        self.alert = alert      # open PLC_Alerts row
+        self.pending = None     # state the samples are moving to
+        self.count = 0          # consecutive samples in the pending state
+
+
+class AlertTracker:
+    """Open alerts and debounce counters of one PLC line"""
+
+    def __init__(self, plc_id):
+        self.plc_id = plc_id
+        self.states = {}
+
+    def hydrate(self):
+        for alert in PLC_Alerts.objects.filter(plc_id=self.plc_id, closed_at__isnull=True).order_by('opened_at'):
+            self.states[alert.key] = KeyState(alert)
+        return self
+
+    def check(self, plc_log, data, now):
+        """Evaluate the numeric items of data and return the opened, updated or closed alerts"""
+        rules = current_rules()
+        touched = []
+        for key, value in data.items():
+            rule = rules.get(key)
+            state = self.states.get(key)
+            if (rule is None and state is None) or not NUMERIC_RE.match(value):
+                continue
+            if state is None:
+                state = self.states[key] = KeyState()
+            value = float(value)
+            alert = state.alert
+            current = alert.kind if alert is not None else None
+            target = rule.state(value, current) if rule is not None else None
+
+            if target == current:
+                state.pending = None
+                state.count = 0
+                if alert is not None and (value > alert.peak if alert.kind == 'max' else value < alert.peak):
+                    alert.peak = value
+                    alert.LastUpdate = now
+                    touched.append(alert)
+                continue
+
+            if state.pending == target:
+                state.count += 1
+            else:
+                state.pending = target
+                state.count = 1
+            if state.count < DEBOUNCE_SAMPLES:
+                continue
+
+            state.pending = None
+            state.count = 0
+            if alert is not None:
+                alert.close_value = value
+                alert.closed_at = plc_log.CreationDateTime
+                alert.LastUpdate = now
+                touched.append(alert)
+                state.alert = None
+            if target is not None:
+                state.alert = PLC_Alerts(plc_id=plc_log.plc_id, roll_id=plc_log.roll_id, key=key, kind=target,
+                                         threshold=rule.threshold(target), value=value, peak=value,
+                                         opened_at=plc_log.CreationDateTime, CreationDateTime=now, LastUpdate=now)
+                touched.append(state.alert)
+        return touched
+
+
+def alert_data(alert):
+    """Serialized alert for the live stream and the alerts API (plc and roll should be select_related)"""
+    config = registry.current().alert_configs.get(alert.key) or {}
+    return {
+        'id': alert.id,
+        'plc_id': alert.plc_id,
+        'plc_name': (alert.plc.name or alert.plc.device_id) if alert.plc else '',
+        'roll_number': alert.roll.roll_number if alert.roll else None,
+        'key': alert.key,
+        'fa_name': registry.current().translate(alert.key),
+        'kind': alert.kind,
+        'threshold': alert.threshold,
+        'value': alert.value,
+        'peak': alert.peak,
+        'close_value': alert.close_value,
+        'is_open': alert.closed_at is None,
+        'opened_at': alert.opened_at.timestamp(),
+        'closed_at': alert.closed_at.timestamp() if alert.closed_at else None,
+        'color': config.get('color_max' if alert.kind == 'max' else 'color_min'),
+        'alert_types': config.get('alert_types', {}),
+    }
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class PLC_MonitoringConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'PLC_Monitoring'
\ No newline at end of file
+    name = 'PLC_Monitoring'
+
+    def ready(self):
+        from .metadata import METADATA_MODELS, metadata_changed
+
+        for model in METADATA_MODELS:
+            post_save.connect(metadata_changed, sender=model, dispatch_uid=f'metadata_saved_{model.__name__}')
+            post_delete.connect(metadata_changed, sender=model, dispatch_uid=f'metadata_deleted_{model.__name__}')
@@ -0,0 +1,224 @@
+import numpy as np
+from django.db import connection
+from django.utils import timezone
+
+from .models import NUMERIC_PATTERN, ROLLUP_RESOLUTIONS, PLC_Logs, PLC_Keys, PLC_Rollups, Roll_Segments
+
+MIN_STOPPED_DURATION_MS = 300000  # 5 minutes in milliseconds
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+MIN_POINTS = 10                   # smallest accepted max_points
+
+
+def last_value_buckets(logs, interval, excluded_keys=()):
+    """Last numeric value of every key per interval-second bucket, computed in Postgres.
+
+    Reads the typed values of packed logs and json_data of the logs pack_log_values has not reached yet.
+    ``logs`` is a PLC_Logs queryset holding the filters; returns {key: [(bucket_ms, value), ...]}
+    with buckets in ascending order. Buckets are aligned to the epoch like int(ts // interval) * interval.
+    """
+    interval = int(interval)
+    subquery, params = (
+        logs.filter(CreationDateTime__isnull=False)
+        .order_by()
+        .values('id', 'CreationDateTime', 'key_ids', 'key_values', 'json_data')
+        .query.sql_with_params()
+    )
+    sql = f'''
+        SELECT DISTINCT ON (k.key, l.bucket) k.key, l.bucket, k.value
+        FROM (
+            SELECT s.*, floor(extract(epoch FROM s."CreationDateTime") / %s)::bigint * %s * 1000 AS bucket
+            FROM ({subquery}) s
+        ) l
+        CROSS JOIN LATERAL (
+            SELECT keys.key, typed.value
+            FROM unnest(l.key_ids, l.key_values) AS typed(key_id, value)
+            JOIN {connection.ops.quote_name(PLC_Keys._meta.db_table)} keys ON keys.id = typed.key_id
+            UNION ALL
+            SELECT raw.key, raw.value::double precision
+            FROM jsonb_each_text(CASE WHEN l.key_ids IS NULL AND jsonb_typeof(l.json_data) = 'object'
+                                      THEN l.json_data END) AS raw
+            WHERE raw.value ~ %s
+        ) k
+        WHERE NOT (k.key = ANY(%s::text[]))
+        ORDER BY k.key, l.bucket, l."CreationDateTime" DESC, l.id DESC
+    '''
+    series = {}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [interval, interval, *params, NUMERIC_PATTERN, list(excluded_keys)])
+        for key, bucket, value in cursor:
+            series.setdefault(key, []).append((bucket, value))
+    return series
+
+
+def rollup_resolution(interval):
+    """Coarsest rollup resolution whose buckets nest exactly inside interval-second buckets, or None"""
+    interval = int(interval)
+    fitting = [resolution for resolution in ROLLUP_RESOLUTIONS if resolution <= interval and interval % resolution == 0]
+    return fitting[-1] if fitting else None
+
+
+def rollup_last_buckets(rollups, interval, excluded_keys=()):
+    """Same result as last_value_buckets, read from a PLC_Rollups queryset of one resolution"""
+    interval = int(interval)
+    subquery, params = (
+        rollups.filter(last__isnull=False)
+        .order_by()
+        .values('id', 'bucket', 'key', 'last', 'last_at')
+        .query.sql_with_params()
+    )
+    sql = f'''
+        SELECT DISTINCT ON (r.key, r.x) r.key, r.x, r.last
+        FROM (
+            SELECT s.*, floor(extract(epoch FROM s.bucket) / %s)::bigint * %s * 1000 AS x
+            FROM ({subquery}) s
+        ) r
+        WHERE NOT (r.key = ANY(%s::text[]))
+        ORDER BY r.key, r.x, r.last_at DESC, r.id DESC
+    '''
+    series = {}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [interval, interval, *params, list(excluded_keys)])
+        for key, bucket, value in cursor:
+            series.setdefault(key, []).append((bucket, value))
+    return series
+
+
+def roll_buckets(roll_ids, interval, excluded_keys=()):
+    """Last numeric value per key and interval bucket over the running logs of the given rolls.
+
+    Reads the coarsest rollup that fits the interval; below one minute, and for rolls without rollups
+    (logged before ingestion wrote them and not backfilled since), it buckets the raw logs.
+    """
+    series = {}
+    raw_ids = set(roll_ids)
+    resolution = rollup_resolution(interval)
+    if resolution:
+        rollups = PLC_Rollups.objects.filter(resolution=resolution, roll_id__in=raw_ids)
+        rolled_up = set(rollups.order_by().values_list('roll_id', flat=True).distinct())
+        if rolled_up:
+            series = rollup_last_buckets(rollups, interval, excluded_keys)
+        raw_ids -= rolled_up
+    if raw_ids:
+        logs = PLC_Logs.for_rolls(raw_ids).filter(is_running=True)
+        for key, points in last_value_buckets(logs, interval, excluded_keys).items():
+            # a bucket both sources have (two rolls meeting in it) keeps the value of the raw logs
+            merged = dict(series.get(key, ()))
+            merged.update(points)
+            series[key] = sorted(merged.items())
+    return series
+
+
+def build_stopped_ranges(roll_ids, min_duration_ms=MIN_STOPPED_DURATION_MS):
+    """ApexCharts x/x2 ranges of stopped periods of the given rolls lasting at least min_duration_ms.
+
+    Adjacent stopped segments (a roll ending stopped and the next one starting stopped) form one range.
+    """
+    ranges = []
+    range_start = range_end = None
+    for roll_id, is_running, started_at, ended_at in Roll_Segments.for_rolls(roll_ids):
+        if is_running:
+            if range_start is not None:
+                ranges.append((range_start, int(started_at.timestamp() * 1000)))
+                range_start = None
+            continue
+        if range_start is None:
+            range_start = int(started_at.timestamp() * 1000)
+        range_end = int(ended_at.timestamp() * 1000) if ended_at else None
+    if range_start is not None:
+        ranges.append((range_start, range_end or int(timezone.now().timestamp() * 1000)))
+    return [{'x': start, 'x2': end} for start, end in ranges if end - start >= min_duration_ms]
+
+
+def _bucket_matrix(count, buckets):
+    """Split the points 1..count-2 into buckets of (nearly) equal size.
+
+    Returns (starts, sizes, index) where index is a buckets x max_size matrix of point indices; short
+    rows repeat their last index, which leaves min/max/argmax of a row unchanged.
+    """
+    edges = np.linspace(1, count - 1, buckets + 1).astype(np.int64)
+    starts, sizes = edges[:-1], np.diff(edges)
+    index = starts[:, None] + np.arange(sizes.max())[None, :]
+    return starts, sizes, np.minimum(index, (starts + sizes - 1)[:, None])
+
+
+def minmax_indices(y, max_points):
+    """Indices of the first, last and the min and max point of every bucket (min/max envelope)"""
+    count = len(y)
+    starts, sizes, index = _bucket_matrix(count, max(1, (max_points - 2) // 2))
+    values = y[index]
+    rows = np.arange(len(starts))
+    lows = index[rows, values.argmin(axis=1)]
+    highs = index[rows, values.argmax(axis=1)]
+    return np.unique(np.concatenate(([0], lows, highs, [count - 1])))
+
+
+def lttb_indices(x, y, max_points):
+    """Indices chosen by Largest-Triangle-Three-Buckets.
+
+    Bucket averages and the candidate matrices are computed up front; only the choice of the previous
+    point, which each bucket depends on, runs bucket by bucket.
+    """
+    count = len(y)
+    starts, sizes, index = _bucket_matrix(count, max_points - 2)
+    inner_x, inner_y = x[1:-1], y[1:-1]
+    average_x = np.add.reduceat(inner_x, starts - 1) / sizes
+    average_y = np.add.reduceat(inner_y, starts - 1) / sizes
+    # the point after a bucket is the next bucket's average, or the last point for the last bucket
+    next_x = np.append(average_x[1:], x[-1])
+    next_y = np.append(average_y[1:], y[-1])
+    candidate_x, candidate_y = x[index], y[index]
+
+    chosen = np.empty(len(starts) + 2, dtype=np.int64)
+    chosen[0], chosen[-1] = 0, count - 1
+    a = 0
+    for bucket in range(len(starts)):
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - next_x[bucket]) * (candidate_y[bucket] - ay) - (ax - candidate_x[bucket]) * (next_y[bucket] - ay))
+        a = chosen[bucket + 1] = index[bucket, area.argmax()]
+    return chosen
+
+
+def downsample(x, y, max_points, method='lttb'):
+    """Indices of at most max_points points of the series x/y (NumPy arrays) to draw"""
+    if len(y) <= max_points:
+        return np.arange(len(y))
+    if method == 'minmax':
+        return minmax_indices(y, max_points)
+    return lttb_indices(x, y, max_points)
+
+
+def build_chart_series(buckets, key_translations, key_order, max_points=None, method='lttb'):
+    """ApexCharts series list sorted by order_index, then name.
+
+    With max_points every series is downsampled to at most that many points and sent as parallel
+    x/y arrays instead of {x, y} dicts.
+    """
+    chart_series = []
+    for key, points in buckets.items():
+        if points:
+            series = {
+                'name': key,
+                'fa_name': key_translations.get(key, key),
+                'order_index': key_order.get(key, 9999),  # Unknown keys go to end
+            }
+            if max_points:
+                x, y = np.array(points, dtype=np.float64).T
+                keep = downsample(x, y, max_points, method)
+                series['x'] = x[keep].astype(np.int64).tolist()
+                series['y'] = y[keep].tolist()
+            else:
+                series['data'] = [{'x': ts, 'y': val} for ts, val in points]
+            chart_series.append(series)
+    chart_series.sort(key=lambda x: (x['order_index'], x['name']))
+    return chart_series
+
+
+def parse_downsampling(params):
+    """(max_points or None, method) from the max_points/downsample request parameters; ValueError if invalid"""
+    max_points = params.get('max_points')
+    method = params.get('downsample', 'lttb')
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(method)
+    if not max_points:
+        return None, method
+    return max(int(max_points), MIN_POINTS), method
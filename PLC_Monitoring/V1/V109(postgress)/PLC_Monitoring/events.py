@@ -0,0 +1,272 @@
+"""Change notifications for the live SSE streams.
+
+Writers call notify() inside their transaction and Postgres delivers the NOTIFY when it commits.
+Every web process runs one EventHub thread that LISTENs on a dedicated connection (or polls once a
+second on backends without LISTEN/NOTIFY), loads the changed rows once and fans the rendered SSE
+message out to all subscribers of the process. Threshold alerts ride on the logs stream as named
+"alert" events.
+"""
+import asyncio
+import json
+import queue
+import select
+import threading
+import time
+
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection, close_old_connections
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import *
+from .alerts import alert_data
+
+LOGS_CHANNEL = "plc_logs"
+SETTINGS_CHANNEL = "plc_settings"
+CHANNELS = [LOGS_CHANNEL, SETTINGS_CHANNEL]
+
+KEEPALIVE = 15          # seconds between SSE comments on an idle stream
+POLL_INTERVAL = 1       # seconds between change checks on backends without LISTEN/NOTIFY
+RETRY_INTERVAL = 5      # seconds before the listener reconnects
+SUBSCRIBER_QUEUE = 100  # messages kept for a slow client before the oldest are dropped
+NEW_LOGS_LIMIT = 50     # newest logs sent per notification, as the polling stream did
+
+
+def notify(events):
+    """Publish [(channel, payload), ...] with one query; a no-op without Postgres (the hub polls there)"""
+    if not events or connection.vendor != "postgresql":
+        return
+    sql = "SELECT " + ", ".join(["pg_notify(%s, %s)"] * len(events))
+    params = []
+    for channel, payload in events:
+        params += [channel, json.dumps(payload)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def log_data(log, is_update=None):
+    data = {
+        'id': log.id,
+        'plc_id': log.plc.id if log.plc else None,
+        'plc_device_id': log.plc.device_id if log.plc else 'نامشخص',
+        'plc_name': log.plc.name if log.plc else '',
+        'data': log.data,
+        'json_data': log.json_data,
+        'CreationDateTime': log.CreationDateTime.timestamp() if log.CreationDateTime else None,
+        'LastUpdate': log.LastUpdate.timestamp() if log.LastUpdate else None
+    }
+    if is_update is not None:
+        data['is_update'] = is_update
+    return data
+
+
+def plc_settings_data(plc):
+    return {
+        'id': plc.id,
+        'device_id': plc.device_id,
+        'name': plc.name,
+        'setting': plc.setting,
+        'LastUpdate': plc.LastUpdate.timestamp() if plc.LastUpdate else None
+    }
+
+
+def sse_message(data, event=None):
+    """One SSE message; a named event is ignored by clients that only listen to onmessage"""
+    message = f"data: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+    return f"event: {event}\n{message}" if event else message
+
+
+class Subscription:
+    """Message queue of one SSE client, fed from the hub thread"""
+
+    def __init__(self, channel, key=None, loop=None):
+        self.channel = channel
+        self.key = key
+        self.loop = loop
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE) if loop else queue.Queue(SUBSCRIBER_QUEUE)
+
+    def deliver(self, message):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.put, message)
+        else:
+            self.put(message)
+
+    def put(self, message):
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except (asyncio.QueueFull, queue.Full):
+                try:
+                    self.queue.get_nowait()
+                except (asyncio.QueueEmpty, queue.Empty):
+                    pass
+
+
+class EventHub:
+    """One change listener per process shared by every SSE client"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.thread = None
+        self.last_log_id = None
+        self.checked_at = None
+
+    def subscribe(self, channel, key=None, loop=None):
+        subscription = Subscription(channel, key, loop)
+        with self.lock:
+            self.subscribers.add(subscription)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="plc-event-hub", daemon=True)
+                self.thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def broadcast(self, channel, message, key=None):
+        with self.lock:
+            subscribers = [s for s in self.subscribers if s.channel == channel and (s.key is None or s.key == key)]
+        for subscription in subscribers:
+            subscription.deliver(message)
+
+    def wanted(self, channel):
+        with self.lock:
+            return {s.key for s in self.subscribers if s.channel == channel}
+
+    def run(self):
+        while True:
+            try:
+                close_old_connections()
+                if self.last_log_id is None:
+                    self.last_log_id = PLC_Logs.objects.order_by("-id").values_list("id", flat=True).first() or 0
+                    self.checked_at = timezone.now()
+                else:
+                    # catch up on what was written while the listener was down
+                    self.dispatch({LOGS_CHANNEL: [{"new": None}]})
+                if connection.vendor == "postgresql":
+                    self.listen()
+                else:
+                    self.poll()
+            except Exception as e:
+                print(f"Event hub error: {e}")
+            time.sleep(RETRY_INTERVAL)
+
+    def listen(self):
+        listener = connection.get_new_connection(connection.get_connection_params())
+        try:
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                for channel in CHANNELS:
+                    cursor.execute(f"LISTEN {channel}")
+            while True:
+                if select.select([listener], [], [], 60) == ([], [], []):
+                    continue
+                listener.poll()
+                events = {}
+                while listener.notifies:
+                    notification = listener.notifies.pop(0)
+                    events.setdefault(notification.channel, []).append(json.loads(notification.payload))
+                if events:
+                    self.dispatch(events)
+        finally:
+            listener.close()
+
+    def poll(self):
+        """Stand-in for LISTEN/NOTIFY: one change check per second for the whole process"""
+        while True:
+            time.sleep(POLL_INTERVAL)
+            if not self.wanted(LOGS_CHANNEL) and not self.wanted(SETTINGS_CHANNEL):
+                continue
+            close_old_connections()
+            checked_at = timezone.now()
+            events = {LOGS_CHANNEL: [{"new": None}]}
+            updated = list(
+                PLC_Logs.objects.filter(id__lte=self.last_log_id, LastUpdate__gt=self.checked_at)
+                .order_by("-LastUpdate").values_list("id", flat=True)[:20]
+            )
+            if updated:
+                events[LOGS_CHANNEL].append({"updated": updated})
+            alert_ids = list(PLC_Alerts.objects.filter(LastUpdate__gt=self.checked_at).values_list("id", flat=True))
+            if alert_ids:
+                events[LOGS_CHANNEL].append({"alerts": alert_ids})
+            plc_ids = list(PLC.objects.filter(LastUpdate__gt=self.checked_at).values_list("id", flat=True))
+            events[SETTINGS_CHANNEL] = [{"plc": plc_id} for plc_id in plc_ids]
+            self.checked_at = checked_at
+            self.dispatch(events)
+
+    def dispatch(self, events):
+        close_old_connections()
+        if events.get(LOGS_CHANNEL) and self.wanted(LOGS_CHANNEL):
+            self.publish_logs(events[LOGS_CHANNEL])
+        if events.get(SETTINGS_CHANNEL) and self.wanted(SETTINGS_CHANNEL):
+            self.publish_settings({payload["plc"] for payload in events[SETTINGS_CHANNEL]})
+
+    def publish_logs(self, payloads):
+        logs_data = []
+        if any("new" in payload for payload in payloads):
+            new_logs = list(
+                PLC_Logs.objects.filter(id__gt=self.last_log_id).select_related('plc').order_by('-id')[:NEW_LOGS_LIMIT]
+            )
+            if new_logs:
+                self.last_log_id = new_logs[0].id
+                logs_data += [log_data(log, False) for log in reversed(new_logs)]
+        updated_ids = {log_id for payload in payloads for log_id in payload.get("updated", [])}
+        if updated_ids:
+            updated_logs = PLC_Logs.objects.filter(id__in=updated_ids).select_related('plc').order_by('-LastUpdate')
+            logs_data += [log_data(log, True) for log in updated_logs]
+        if logs_data:
+            self.broadcast(LOGS_CHANNEL, sse_message(logs_data))
+        alert_ids = {alert_id for payload in payloads for alert_id in payload.get("alerts", [])}
+        if alert_ids:
+            alerts = PLC_Alerts.objects.filter(id__in=alert_ids).select_related('plc', 'roll').order_by('LastUpdate', 'id')
+            self.broadcast(LOGS_CHANNEL, sse_message([alert_data(alert) for alert in alerts], event="alert"))
+
+    def publish_settings(self, plc_ids):
+        plc_ids = {str(plc_id) for plc_id in plc_ids} & self.wanted(SETTINGS_CHANNEL)
+        for plc in PLC.objects.filter(id__in=plc_ids):
+            self.broadcast(SETTINGS_CHANNEL, sse_message(plc_settings_data(plc)), key=str(plc.id))
+
+
+hub = EventHub()
+
+
+def sse_response(request, channel, key=None, initial=None):
+    """Stream the hub's messages for channel (optionally only those for key) to one client.
+
+    Under ASGI the stream is an async generator and an idle client costs no thread; under WSGI
+    it falls back to a blocking generator on the request's worker thread.
+    """
+    if isinstance(request, ASGIRequest):
+        async def event_stream():
+            subscription = hub.subscribe(channel, key, asyncio.get_running_loop())
+            try:
+                if initial:
+                    yield initial
+                while True:
+                    try:
+                        yield await asyncio.wait_for(subscription.queue.get(), KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        yield ": keep-alive\n\n"
+            finally:
+                hub.unsubscribe(subscription)
+    else:
+        def event_stream():
+            subscription = hub.subscribe(channel, key)
+            try:
+                if initial:
+                    yield initial
+                while True:
+                    try:
+                        yield subscription.queue.get(timeout=KEEPALIVE)
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+            finally:
+                hub.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,257 @@
+import csv
+import math
+import zipfile
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+import jdatetime
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.utils import get_column_letter
+
+from .models import *
+
+CHUNK_SIZE = 2000           # rows fetched per server-side cursor round trip
+FILE_CHUNK_SIZE = 64 * 1024  # compressed bytes per streamed response chunk
+
+
+def export_keys(logs, rollups):
+    """Sorted json_data keys of the logs and rollups, collected in the database"""
+    subquery, params = logs.order_by().values('json_data').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'''SELECT DISTINCT k FROM ({subquery}) s, jsonb_object_keys(s.json_data) k
+                WHERE jsonb_typeof(s.json_data) = 'object' ''',
+            params,
+        )
+        keys = {row[0] for row in cursor}
+    keys.update(rollups.order_by().values_list('key', flat=True).distinct())
+    return sorted(keys)
+
+
+class Labels:
+    """PLC names and roll numbers of the exported rows, loaded once per id"""
+
+    def __init__(self):
+        self.plc_names = {
+            plc.id: plc.name or plc.device_id or 'نامشخص'
+            for plc in PLC.objects.all()
+        }
+        self.roll_numbers = {}
+
+    def plc_name(self, plc_id):
+        return self.plc_names.get(plc_id, 'نامشخص')
+
+    def roll_number(self, roll_id):
+        if not roll_id:
+            return '-'
+        if roll_id not in self.roll_numbers:
+            self.roll_numbers[roll_id] = Rolls.objects.filter(id=roll_id).values_list('roll_number', flat=True).first()
+        return self.roll_numbers[roll_id]
+
+
+def _ordered(open_groups):
+    return sorted(open_groups.values(), key=lambda group: group['timestamp'])
+
+
+def log_groups(logs, interval, labels):
+    """Merge time-ordered logs into (roll, interval) groups; a bucket is emitted once the next one starts"""
+    open_groups = {}
+    open_bucket = None
+    rows = logs.order_by('CreationDateTime').values_list('plc_id', 'roll_id', 'CreationDateTime', 'json_data')
+    for plc_id, roll_id, created, json_data in rows.iterator(chunk_size=CHUNK_SIZE):
+        if not created:
+            continue
+        ts = created.timestamp()
+        interval_ts = int(ts // interval) * interval
+        if interval_ts != open_bucket:
+            yield from _ordered(open_groups)
+            open_groups = {}
+            open_bucket = interval_ts
+
+        group = open_groups.get(roll_id or 0)
+        if group is None:
+            group = open_groups[roll_id or 0] = {
+                'plc_name': labels.plc_name(plc_id),
+                'roll_number': labels.roll_number(roll_id),
+                'timestamp': ts,
+                'data': {}
+            }
+        # Merge json_data (last value wins for each key)
+        if json_data:
+            group['data'].update(json_data)
+    yield from _ordered(open_groups)
+
+
+def rollup_groups(rollups, interval, labels):
+    """Same groups built from bucket-ordered rollups (first sample time, last value of each key)"""
+    open_groups = {}
+    open_bucket = None
+    last_seen = {}
+    rows = rollups.order_by('bucket').values_list(
+        'plc_id', 'roll_id', 'bucket', 'key', 'last_value', 'last_value_at', 'first_at'
+    )
+    for plc_id, roll_id, bucket, key, last_value, last_value_at, first_at in rows.iterator(chunk_size=CHUNK_SIZE):
+        interval_ts = int(bucket.timestamp() // interval) * interval
+        if interval_ts != open_bucket:
+            yield from _ordered(open_groups)
+            open_groups = {}
+            last_seen = {}
+            open_bucket = interval_ts
+
+        ts = first_at.timestamp()
+        group = open_groups.get(roll_id or 0)
+        if group is None:
+            group = open_groups[roll_id or 0] = {
+                'plc_name': labels.plc_name(plc_id),
+                'roll_number': labels.roll_number(roll_id),
+                'timestamp': ts,
+                'data': {}
+            }
+        elif ts < group['timestamp']:
+            group['timestamp'] = ts
+
+        seen_key = (roll_id, key)
+        if seen_key not in last_seen or last_value_at >= last_seen[seen_key]:
+            last_seen[seen_key] = last_value_at
+            group['data'][key] = last_value
+    yield from _ordered(open_groups)
+
+
+def export_rows(groups, keys):
+    """ردیف، دستگاه، شماره رول، زمان، [key values] for each group"""
+    for index, group in enumerate(groups, 1):
+        # زمان (Jalali)
+        dt_str = jdatetime.datetime.fromtimestamp(group['timestamp']).strftime('%Y/%m/%d %H:%M:%S')
+        data = group['data']
+        yield [index, group['plc_name'], group['roll_number'], dt_str] + [data.get(key, '') for key in keys]
+
+
+class _Sink:
+    """Unseekable write target of the streamed zip, holding the bytes written since the last take()"""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
+
+def _cell_xml(ref, value):
+    if value is None or value == '':
+        return ''
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+        return f'<c r="{ref}" t="n"><v>{value!r}</v></c>'
+    text = escape(ILLEGAL_CHARACTERS_RE.sub('', str(value)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def xlsx_template(headers):
+    """Bytes of a write-only workbook holding the styled header row of the export sheet"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("PLC Logs")
+    ws.sheet_view.rightToLeft = True
+
+    # Column widths must be set before the first row in write-only mode
+    for col, header in enumerate(headers, 1):
+        width = 20 if col == 4 else max(len(str(header)) + 2, 10)
+        ws.column_dimensions[get_column_letter(col)].width = min(width, 50)
+
+    header_font_white = Font(bold=True, size=11, color="FFFFFF")
+    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+    center_align = Alignment(horizontal='center', vertical='center')
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = header_font_white
+        cell.fill = header_fill
+        cell.alignment = center_align
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def xlsx_chunks(headers, rows):
+    """Stream rows as an XLSX file while they are produced.
+
+    openpyxl writes the header row, styles and the other parts once; the parts are copied into a zip
+    written to an unseekable sink, with the rows serialised into the sheet between its header row and
+    </sheetData>. Every FILE_CHUNK_SIZE bytes of compressed output is sent on, so the first bytes go
+    out before the rows are read to the end and memory stays flat for any range.
+    """
+    template = zipfile.ZipFile(BytesIO(xlsx_template(headers)))
+    columns = [get_column_letter(col) for col in range(1, len(headers) + 1)]
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as output:
+        for info in template.infolist():
+            if not info.filename.startswith('xl/worksheets/'):
+                output.writestr(info, template.read(info))
+                continue
+            head, tail = template.read(info).split(b'</sheetData>')
+            with output.open(info.filename, 'w', force_zip64=True) as sheet:
+                sheet.write(head)
+                for number, row in enumerate(rows, 2):
+                    cells = ''.join(_cell_xml(f'{column}{number}', value) for column, value in zip(columns, row))
+                    sheet.write(f'<row r="{number}">{cells}</row>'.encode())
+                    if sink.size >= FILE_CHUNK_SIZE:
+                        yield sink.take()
+                sheet.write(b'</sheetData>' + tail)
+    yield sink.take()
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_chunks(headers, rows):
+    """Stream rows as UTF-8 CSV (with BOM so Excel detects the encoding), one chunk per 500 rows"""
+    writer = csv.writer(_Echo())
+    buffer = ['\ufeff' + writer.writerow(headers)]
+    for row in rows:
+        buffer.append(writer.writerow(row))
+        if len(buffer) >= 500:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+async def _async_chunks(chunks):
+    # one worker thread keeps the server-side cursor on the same connection
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)()
+
+
+def response_chunks(request, chunks):
+    """Under ASGI a sync iterator would be read into memory before sending, so wrap it in an async one"""
+    if isinstance(request, ASGIRequest):
+        return _async_chunks(chunks)
+    return chunks
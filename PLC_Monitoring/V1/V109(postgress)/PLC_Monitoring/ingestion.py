@@ -0,0 +1,369 @@
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import *
+from .events import LOGS_CHANNEL, SETTINGS_CHANNEL, notify
+from .metadata import registry
+from .alerts import AlertTracker
+from .metrics import metrics
+
+
+class WriteBehind:
+    """Collects the final state of the rows produced by one or more ticks and writes them in one transaction.
+
+    flush_interval <= 0 flushes after every tick; a positive value micro-batches the ticks of that many
+    seconds into one bulk INSERT of PLC_Logs. When the transaction fails the buffered rows are lost and
+    on_rollback is called, so the owner can drop the in-memory state that refers to them.
+    """
+
+    def __init__(self, flush_interval=0, on_rollback=None):
+        self.flush_interval = flush_interval
+        self.on_rollback = on_rollback
+        self.last_flush = time.monotonic()
+        self.logs = []
+        self.breaks = []
+        self.rolls = {}           # id -> (roll, changed fields)
+        self.aggregates = {}      # id(aggregate) -> aggregate
+        self.rollups = {}         # id(rollup) -> rollup
+        self.segments = {}        # id(segment) -> segment
+        self.alerts = {}          # id(alert) -> alert
+        self.settings = {}        # plc id -> (plc, merged data)
+        self.touched_log = None   # stored log whose LastUpdate must be bumped
+
+    def add_log(self, plc_log):
+        self.logs.append(plc_log)
+
+    def add_break(self, roll_break):
+        self.breaks.append(roll_break)
+
+    def update_roll(self, roll, *fields):
+        self.rolls.setdefault(roll.pk, (roll, set()))[1].update(fields)
+
+    def update_aggregates(self, aggregates):
+        for aggregate in aggregates:
+            self.aggregates[id(aggregate)] = aggregate
+
+    def update_rollups(self, rollups):
+        for rollup in rollups:
+            self.rollups[id(rollup)] = rollup
+
+    def update_segments(self, segments):
+        for segment in segments:
+            self.segments[id(segment)] = segment
+
+    def update_alerts(self, alerts):
+        for alert in alerts:
+            self.alerts[id(alert)] = alert
+
+    def merge_setting(self, plc_obj, data):
+        if plc_obj.setting is None:
+            plc_obj.setting = {}
+        plc_obj.setting.update(data)
+        self.settings.setdefault(plc_obj.pk, (plc_obj, {}))[1].update(data)
+
+    def touch(self, plc_log, when):
+        plc_log.LastUpdate = when
+        if plc_log.pk:
+            self.touched_log = plc_log
+
+    def pending(self):
+        return bool(self.logs or self.breaks or self.rolls or self.aggregates or self.rollups or self.segments or self.alerts or self.settings or self.touched_log)
+
+    def due(self):
+        return self.pending() and (self.flush_interval <= 0 or time.monotonic() - self.last_flush >= self.flush_interval)
+
+    def flush_if_due(self):
+        if self.due():
+            self.flush()
+
+    def flush(self):
+        committed = False
+        try:
+            with transaction.atomic():
+                if self.logs:
+                    PLC_Logs.objects.bulk_create(self.logs)
+                if self.touched_log is not None:
+                    PLC_Logs.objects.filter(id=self.touched_log.id).update(LastUpdate=self.touched_log.LastUpdate)
+                if self.aggregates:
+                    RollKeyAggregate.save_all(self.aggregates.values())
+                if self.rollups:
+                    PLC_Rollups.save_all(self.rollups.values())
+                if self.segments:
+                    Roll_Segments.save_all(self.segments.values())
+                if self.alerts:
+                    PLC_Alerts.save_all(self.alerts.values())
+                for roll, fields in self.rolls.values():
+                    roll.save(update_fields=fields | {'LastUpdate'})
+                if self.breaks:
+                    Roll_Breaks.objects.bulk_create(self.breaks)
+                for plc_obj, data in self.settings.values():
+                    plc_obj.merge_setting(data)
+                # delivered to the live streams when the transaction commits
+                events = []
+                if self.logs:
+                    events.append((LOGS_CHANNEL, {"new": self.logs[-1].id}))
+                if self.touched_log is not None:
+                    events.append((LOGS_CHANNEL, {"updated": [self.touched_log.id]}))
+                if self.alerts:
+                    events.append((LOGS_CHANNEL, {"alerts": [alert.id for alert in self.alerts.values()]}))
+                events += [(SETTINGS_CHANNEL, {"plc": plc_id}) for plc_id in self.settings]
+                notify(events)
+            committed = True
+        finally:
+            self.logs = []
+            self.breaks = []
+            self.rolls = {}
+            self.aggregates = {}
+            self.rollups = {}
+            self.segments = {}
+            self.alerts = {}
+            self.settings = {}
+            self.touched_log = None
+            self.last_flush = time.monotonic()
+            if not committed and self.on_rollback is not None:
+                self.on_rollback()
+
+
+class PLCLine:
+    """Per-PLC ingestion state.
+
+    Hydrated once from the database when the line starts and kept authoritative in memory
+    afterwards, so dedup and change detection do not need any query. A failed flush resets the
+    line, and the next response hydrates it again from what was actually committed.
+    """
+
+    def __init__(self, plc, flush_interval=0):
+        self.plc_id = plc.id
+        self.device_id = plc.device_id
+        self.writer = WriteBehind(flush_interval, on_rollback=self.reset)
+        self.reset()
+
+    def reset(self):
+        """Forget the in-memory state; rows and pks of a rolled-back flush must not be reused"""
+        self.hydrated = False
+        self.plc_obj = None         # PLC row named by the "n" key of the responses
+        self.is_running = None
+        self.roll_obj = None
+        self.aggregates = {}        # RollKeyAggregate rows of roll_obj by key
+        self.rollups = {}           # resolution -> (bucket, PLC_Rollups rows by (plc id, roll id, key)) of the open bucket
+        self.last_response = None   # raw text of the last stored log
+        self.last_log = None
+        self.last_data = None       # parsed json_data of the last stored log
+        self.last_break = None      # "b" flag of the last stored log that had one
+        self.segment = None         # open Roll_Segments row
+        self.known_keys = {}        # key -> id of the keys already present in PLC_Keys
+        self.alerts = AlertTracker(self.plc_id)
+
+    def hydrate(self):
+        last_log = (
+            PLC_Logs.objects
+            .filter(plc_id=self.plc_id)
+            .select_related('roll')
+            .order_by("-CreationDateTime")
+            .first()
+        )
+        if last_log:
+            self.last_response = last_log.data
+            self.last_log = last_log
+            self.last_data = last_log.json_data
+            self.is_running = last_log.is_running
+            if last_log.roll is not None:
+                self.set_roll(last_log.roll)
+
+        last_break_data = (
+            PLC_Logs.objects
+            .filter(plc_id=self.plc_id, json_data__has_key="b")
+            .order_by("-CreationDateTime")
+            .values_list("json_data", flat=True)
+            .first()
+        )
+        if last_break_data:
+            self.last_break = int(last_break_data.get("b", 0))
+
+        self.segment = (
+            Roll_Segments.objects
+            .filter(plc_id=self.plc_id, ended_at__isnull=True)
+            .order_by("-started_at")
+            .first()
+        )
+        self.known_keys = dict(registry.current().key_ids)
+        self.alerts.hydrate()
+        self.hydrated = True
+        return self
+
+    def set_roll(self, roll):
+        self.roll_obj = roll
+        self.aggregates = RollKeyAggregate.for_roll(roll)
+
+    def switch_roll(self, roll_number, when):
+        """Roll of roll_number; a new roll is created at when, the time of the log that names it"""
+        if self.roll_obj is None or self.roll_obj.roll_number != roll_number:
+            roll, created = Rolls.objects.get_or_create(roll_number=roll_number, defaults={'CreationDateTime': when})
+            self.set_roll(roll)
+        return self.roll_obj
+
+    def track_segment(self, plc_log):
+        """Close the open segment and start a new one when the log changes roll or running state"""
+        if plc_log.roll_id is None:
+            return []
+        state = bool(plc_log.is_running)
+        segment = self.segment
+        if segment is not None and segment.roll_id == plc_log.roll_id and segment.is_running == state:
+            return []
+        now = timezone.now()
+        touched = []
+        if segment is not None:
+            segment.ended_at = plc_log.CreationDateTime
+            segment.LastUpdate = now
+            touched.append(segment)
+        self.segment = Roll_Segments(plc_id=plc_log.plc_id, roll_id=plc_log.roll_id, is_running=state,
+                                     started_at=plc_log.CreationDateTime, CreationDateTime=now, LastUpdate=now)
+        touched.append(self.segment)
+        return touched
+
+    def fold_rollups(self, plc_log):
+        """Fold a running log into the open bucket of every rollup resolution and return the touched rows"""
+        if not plc_log.is_running or not plc_log.json_data:
+            return []
+        touched = []
+        for resolution in ROLLUP_RESOLUTIONS:
+            bucket = PLC_Rollups.bucket_start(plc_log.CreationDateTime, resolution)
+            current = self.rollups.get(resolution)
+            if current is None or current[0] != bucket:
+                current = self.rollups[resolution] = (bucket, PLC_Rollups.for_bucket(resolution, bucket))
+            touched.extend(PLC_Rollups.fold(current[1], plc_log, resolution, bucket))
+        return touched
+
+
+def thermal_params(line):
+    """Query params for the thermal API: the running roll number of this line, if any"""
+    params = {}
+    if line.roll_obj is not None and line.is_running:
+        params['roll_number'] = line.roll_obj.roll_number
+    return params
+
+
+def handle_response(line, response):
+    """Parse one PLC response into the line's write buffer and flush it when due"""
+    result = "error"
+    try:
+        if not line.hydrated:
+            line.hydrate()
+        result = _store_response(line, response)
+    finally:
+        metrics.inc("plc_frames_total", plc=line.device_id, result=result)
+        if result == "stored":
+            metrics.set("plc_last_sample_timestamp_seconds", time.time(), plc=line.device_id)
+        if line.writer.due():
+            with metrics.timer("db", line.device_id):
+                line.writer.flush()
+
+
+def _store_response(line, response):
+    """Buffer one response; returns "stored", "duplicate" or "dropped" for the frame counters"""
+    with metrics.timer("parse", line.device_id):
+        if isinstance(response, bytes):
+            response = response.decode("utf-8", errors="ignore")
+        response = (response or "").strip("\x00\r\n ")
+        is_sample = response.startswith("n=")
+        data = dict(item.split("=", 1) for item in response.split(";") if "=" in item) if is_sample else None
+    # Save response to DB
+    if not response or "ERROR" in response:
+        return "dropped"
+    now = timezone.now()
+    writer = line.writer
+    with metrics.timer("dedup", line.device_id):
+        repeated = line.last_log is not None and response == line.last_response
+        # skip samples identical to the last stored one
+        duplicate = repeated or (is_sample and line.last_data and all(line.last_data.get(key) == value for key, value in data.items()))
+    if repeated:
+        writer.touch(line.last_log, now)
+    if duplicate:
+        return "duplicate"
+
+    if not is_sample:
+        plc_log = PLC_Logs(plc_id=line.plc_id, data=response, CreationDateTime=now, LastUpdate=now)
+        writer.add_log(plc_log)
+        line.last_response = response
+        line.last_log = plc_log
+        return "stored"
+
+    if line.plc_obj is None or line.plc_obj.device_id != data["n"]:
+        with metrics.timer("db", line.device_id):
+            line.plc_obj, created = PLC.objects.get_or_create(device_id=data["n"])
+    plc_obj = line.plc_obj
+
+    plc_log = PLC_Logs(plc=plc_obj,
+                       data=response,
+                       json_data=data,
+                       CreationDateTime=now,
+                       LastUpdate=now)
+    line.last_response = response
+    line.last_log = plc_log
+    line.last_data = data
+
+    # roll aggregation is timed in two parts and observed once
+    aggregation_started = time.perf_counter()
+    if "cr" in data:
+        roll_obj = line.switch_roll(int(data["cr"]), now)
+        writer.update_aggregates(RollKeyAggregate.fold(roll_obj, line.aggregates, data))
+        roll_obj.set_average_settings(line.aggregates.values())
+        writer.update_roll(roll_obj, 'plc_setting')
+    aggregation = time.perf_counter() - aggregation_started
+    if "ru" in data:
+        line.is_running = data["ru"] == "1"
+    if line.is_running is not None:
+        plc_log.is_running = line.is_running
+
+    # save new key in plc_keys table
+    missing_keys = data.keys() - line.known_keys.keys()
+    if missing_keys:
+        with metrics.timer("db", line.device_id):
+            existing_keys = dict(PLC_Keys.objects.filter(key__in=missing_keys).order_by("-id").values_list("key", "id"))
+            created_keys = PLC_Keys.objects.bulk_create([PLC_Keys(key=key,value=str(type(data[key]).__name__),CreationDateTime=now,LastUpdate=now)for key in missing_keys - existing_keys.keys()])
+            if created_keys:
+                registry.bump()
+        line.known_keys.update(existing_keys)
+        line.known_keys.update((plc_key.key, plc_key.id) for plc_key in created_keys)
+    plc_log.set_values(data, line.known_keys)
+
+    old_break = line.last_break
+    if "b" in data:
+        line.last_break = int(data["b"])
+
+    roll_obj = line.roll_obj
+    if roll_obj:
+        if roll_obj.plc_setting is None:
+            roll_obj.plc_setting = {}
+        roll_obj.plc_setting.update(data)
+        writer.update_roll(roll_obj, 'plc_setting')
+        plc_log.roll = roll_obj
+        if roll_obj.plc_id is None:
+            roll_obj.plc = plc_obj
+            writer.update_roll(roll_obj, 'plc')
+        if "me1" in data:
+            if not roll_obj.Printed_length > int(data["me1"]):
+                roll_obj.Printed_length = int(data["me1"])
+                writer.update_roll(roll_obj, 'Printed_length')
+        if "b" in data and data["b"] == "1":
+            new_break = int(data["b"])
+            if old_break != new_break and new_break == 1:
+                roll_obj.Paper_breaks += 1
+                writer.update_roll(roll_obj, 'Paper_breaks')
+                writer.add_break(Roll_Breaks(roll=roll_obj, CreationDateTime=now, LastUpdate=now))
+    else:
+        roll_number = (plc_obj.setting or {}).get("cr")
+        if roll_number is not None:
+            plc_log.roll = line.switch_roll(int(roll_number), now)
+
+    aggregation_started = time.perf_counter()
+    writer.update_alerts(line.alerts.check(plc_log, data, now))
+    writer.update_rollups(line.fold_rollups(plc_log))
+    writer.update_segments(line.track_segment(plc_log))
+    metrics.observe("plc_stage_seconds", aggregation + time.perf_counter() - aggregation_started,
+                    plc=line.device_id, stage="aggregation")
+    writer.add_log(plc_log)
+    writer.merge_setting(plc_obj, data)
+    return "stored"
@@ -0,0 +1,56 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+
+from PLC_Monitoring.models import PLC_Logs, PLC_Rollups
+
+
+class Command(BaseCommand):
+    help = ("Rebuild PLC_Rollups for whole UTC days from PLC_Logs. The ingestion worker keeps the open "
+            "buckets up to date, so by default today is left out; run with --until covering today only "
+            "while the worker is stopped. Can also be scheduled nightly with --days 1.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="First day to rebuild, YYYY-MM-DD (default: day of the oldest log)")
+        parser.add_argument("--until", help="Day after the last one to rebuild, YYYY-MM-DD (default: today)")
+        parser.add_argument("--days", type=int, help="Rebuild only the last N days before --until")
+        parser.add_argument("--plc", type=int, dest="plc_id", help="Only rebuild rollups of this PLC id")
+
+    def parse_day(self, value):
+        try:
+            day = datetime.strptime(value, "%Y-%m-%d").date()
+        except ValueError:
+            raise CommandError(f"Invalid date {value!r}, expected YYYY-MM-DD")
+        return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+    def handle(self, *args, **options):
+        if options["until"]:
+            until = self.parse_day(options["until"])
+        else:
+            until = datetime.combine(datetime.now(dt_timezone.utc).date(), time.min, tzinfo=dt_timezone.utc)
+
+        if options["days"]:
+            since = until - timedelta(days=options["days"])
+        elif options["since"]:
+            since = self.parse_day(options["since"])
+        else:
+            logs = PLC_Logs.objects.all()
+            if options["plc_id"]:
+                logs = logs.filter(plc_id=options["plc_id"])
+            oldest = logs.aggregate(oldest=Min("CreationDateTime"))["oldest"]
+            if oldest is None:
+                self.stdout.write("No logs to roll up")
+                return
+            since = datetime.combine(oldest.astimezone(dt_timezone.utc).date(), time.min, tzinfo=dt_timezone.utc)
+
+        # One day per transaction keeps the locks and the statement size small
+        total = 0
+        day = since
+        while day < until:
+            count = PLC_Rollups.rebuild(day, day + timedelta(days=1), options["plc_id"])
+            total += count
+            self.stdout.write(f"{day.date()}: {count} rollup rows")
+            day += timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} rollup rows from {since.date()} to {until.date()}"))
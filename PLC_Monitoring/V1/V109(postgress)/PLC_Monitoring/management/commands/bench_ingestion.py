@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from PLC_Monitoring.replay import Recording, run_benchmark
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the PLC ingestion path with a poll recording against a throwaway test database "
+            "(created from the migrations and dropped afterwards); reports samples/s, p50/p99 tick latency "
+            "and queries per tick.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("recording", help="Poll recording from record_plc_frames")
+        parser.add_argument("--lines", type=int, default=1, help="PLC lines fed in parallel with the same responses")
+        parser.add_argument("--speed", type=float, default=0,
+                            help="Pace the responses at this multiple of the recorded rate; 0 = as fast as possible")
+        parser.add_argument("--flush-interval", type=float, default=0, help="Write-behind flush interval of the lines")
+        parser.add_argument("--limit", type=int, help="Use only the first N responses")
+        parser.add_argument("--keepdb", action="store_true", help="Keep the test database for the next run")
+
+    def handle(self, *args, **options):
+        try:
+            recording = Recording.load(options["recording"])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        if recording.mode != "poll" or not recording.frames("response"):
+            raise CommandError("bench_ingestion needs a poll recording with responses")
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        try:
+            result = run_benchmark(recording, options["lines"], options["speed"], options["flush_interval"], options["limit"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+
+        self.stdout.write(f"ticks:            {result['ticks']} ({result['lines']} lines) in {result['seconds']:.2f}s")
+        self.stdout.write(f"samples/s:        {result['samples_per_second']:.1f}")
+        self.stdout.write(f"tick latency:     p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, max {result['max_ms']:.2f} ms")
+        self.stdout.write(f"queries per tick: {result['queries_per_tick']:.2f} (max {result['max_queries_per_tick']})")
+        stages = ", ".join(f"{stage} {ms:.3f}" for stage, ms in sorted(result["stages"].items(), key=lambda item: -item[1]))
+        self.stdout.write(f"ms per tick:      {stages}")
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from PLC_Monitoring.models import PLC
+from .record_plc_frames import parse_endpoint
+
+# endpoints and options of the former tcp_client_pm2/pm3/pm4.py scripts
+PRESETS = {
+    "pm2": {"address": "172.16.1.73:8001", "thermal_api_url": "http://192.168.2.22:6006/view/api/plc_data/",
+            "interval": 2, "payload_format": "t{rounded}.0"},
+    "pm3": {"address": "172.16.1.40:8000", "thermal_api_url": "http://192.168.2.22:6002/view/api/plc_data/",
+            "interval": 1, "payload_format": "t{rounded}.0"},
+    "pm4": {"address": "172.16.1.40:8000", "thermal_api_url": "http://192.168.2.22:6002/view/api/plc_data/",
+            "interval": 1, "payload_format": "t{value:.2f}"},
+}
+OPTIONS = ("thermal_api_url", "interval", "timeout", "flush_interval", "payload_format")
+
+
+class Command(BaseCommand):
+    help = ("Create or update the PLC row of a line polled by plc_poller.py: its ip_address and "
+            "setting[\"poller\"]. Run once per line after deploying the poller; explicit options override the preset.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("device_id", help='Device id the PLC reports in its "n" key')
+        parser.add_argument("--preset", choices=sorted(PRESETS), help="Values of a former tcp_client_<preset>.py script")
+        parser.add_argument("--address", help="host:port of the PLC")
+        parser.add_argument("--thermal-api-url", help="Thermal API the temperature sent to the PLC is read from")
+        parser.add_argument("--interval", type=float, help="Seconds between polls")
+        parser.add_argument("--timeout", type=float, help="Seconds to wait for the thermal API and the PLC")
+        parser.add_argument("--flush-interval", type=float, help="Seconds of ticks batched per DB write")
+        parser.add_argument("--payload-format",
+                            help='str.format of the value sent to the PLC, e.g. "t{rounded}.0" or "t{value:.2f}"')
+        parser.add_argument("--disable", action="store_true", help="Keep the row but stop polling it")
+
+    def handle(self, *args, **options):
+        values = dict(PRESETS.get(options["preset"]) or {})
+        values.update((name, options[name]) for name in ("address", *OPTIONS) if options[name] is not None)
+
+        if values.get("address"):
+            parse_endpoint(values["address"])
+        if values.get("payload_format"):
+            try:
+                values["payload_format"].format(value=21.5, rounded=22)
+            except (KeyError, IndexError, ValueError) as e:
+                raise CommandError(f"Invalid --payload-format: {e!r}")
+
+        plc, created = PLC.objects.get_or_create(device_id=options["device_id"])
+        if values.get("address"):
+            plc.ip_address = values["address"]
+            plc.save(update_fields=["ip_address", "LastUpdate"])
+        poller = dict((plc.setting or {}).get("poller") or {})
+        poller.update((name, values[name]) for name in OPTIONS if name in values)
+        poller["enabled"] = not options["disable"]
+        plc.merge_setting({"poller": poller})
+
+        if not plc.ip_address or not poller.get("thermal_api_url"):
+            self.stdout.write(self.style.WARNING(f"{plc.device_id} is not polled until --address and --thermal-api-url are set"))
+        self.stdout.write(self.style.SUCCESS(f"{'Created' if created else 'Updated'} {plc.device_id}: {plc.ip_address} {poller}"))
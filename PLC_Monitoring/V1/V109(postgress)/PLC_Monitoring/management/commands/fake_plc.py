@@ -0,0 +1,42 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from PLC_Monitoring.replay import Recording, serve_recording, push_recording
+from .record_plc_frames import parse_endpoint
+
+
+class Command(BaseCommand):
+    help = ("Replay a frame recording as a fake PLC: a poll recording is served on --listen for plc_poller.py "
+            "(point the PLC's ip_address there), a push recording of binary register frames is sent to the "
+            "V2 tcp_server.py (port 2000) at --target.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("recording", help="Recording file from record_plc_frames")
+        parser.add_argument("--listen", default="127.0.0.1:8000", help="host:port to serve a poll recording on")
+        parser.add_argument("--target", default="127.0.0.1:2000",
+                            help="host:port of the V2 binary-frame tcp_server.py for a push recording")
+        parser.add_argument("--speed", type=float, default=1.0,
+                            help="Playback speed multiplier; 0 answers/sends frames back to back")
+
+    def handle(self, *args, **options):
+        try:
+            recording = Recording.load(options["recording"])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        if options["speed"] < 0:
+            raise CommandError("--speed must not be negative")
+
+        try:
+            if recording.mode == "push":
+                host, port = parse_endpoint(options["target"])
+                sent = asyncio.run(push_recording(recording, host, port, options["speed"]))
+                self.stdout.write(self.style.SUCCESS(f"Sent {sent} frames to {host}:{port}"))
+            else:
+                host, port = parse_endpoint(options["listen"])
+                self.stdout.write(f"Fake PLC on {host}:{port} at {options['speed']}x, Ctrl+C to stop")
+                asyncio.run(serve_recording(recording, host, port, options["speed"]))
+        except KeyboardInterrupt:
+            pass
+        except (ValueError, OSError) as e:
+            raise CommandError(str(e))
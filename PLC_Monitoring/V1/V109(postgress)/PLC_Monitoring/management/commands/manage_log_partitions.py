@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from PLC_Monitoring.partitions import MONTHS_AHEAD, is_partitioned, partitions, ensure_partitions, archive_partitions
+
+
+class Command(BaseCommand):
+    help = ("Create the future monthly partitions of PLC_Logs and, with --keep-months, archive older months "
+            "to gzip'ed CSV files and drop them. Meant to run daily; the poller also creates partitions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ahead", type=int, default=MONTHS_AHEAD, help="Months to create after the current one")
+        parser.add_argument("--keep-months", type=int, help="Months of logs to keep, counting the current one")
+        parser.add_argument("--archive-dir", default=settings.PLC_LOGS_ARCHIVE_DIR, help="Where archived months are written")
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            raise CommandError("PLC_Logs is not partitioned (Postgres only, see migration 0020)")
+        if options["keep_months"] is not None and options["keep_months"] < 1:
+            raise CommandError("--keep-months must be at least 1")
+
+        for name in ensure_partitions(options["ahead"]):
+            self.stdout.write(f"Created {name}")
+        if options["keep_months"]:
+            for path in archive_partitions(options["keep_months"], options["archive_dir"]):
+                self.stdout.write(f"Archived {path}")
+
+        for name, upper in partitions():
+            self.stdout.write(f"{name}: until {upper.isoformat() if upper else '-'}")
+        self.stdout.write(self.style.SUCCESS("Partitions up to date"))
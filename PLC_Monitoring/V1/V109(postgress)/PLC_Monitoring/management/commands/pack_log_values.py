@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from PLC_Monitoring.models import PLC_Logs
+
+
+class Command(BaseCommand):
+    help = ("Fill PLC_Logs.key_ids/key_values from json_data for logs written before typed values existed. "
+            "Run it before rebuild_roll_aggregates on an upgraded database; it can be re-run safely.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=20000, help="Log ids per UPDATE statement")
+
+    def handle(self, *args, **options):
+        bounds = PLC_Logs.objects.filter(key_ids__isnull=True).aggregate(first=Min("id"), last=Max("id"))
+        if bounds["first"] is None:
+            self.stdout.write("All logs are already packed")
+            return
+
+        total = 0
+        start = bounds["first"]
+        while start <= bounds["last"]:
+            end = start + options["batch"]
+            total += PLC_Logs.pack_values(start, end)
+            self.stdout.write(f"ids {start}-{end - 1}: {total} logs packed")
+            start = end
+
+        self.stdout.write(self.style.SUCCESS(f"Packed {total} logs"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from PLC_Monitoring.models import Rolls, RollKeyAggregate
+
+
+class Command(BaseCommand):
+    help = "Rebuild RollKeyAggregate rows from PLC_Logs history and refresh Rolls.plc_setting"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--roll", type=int, action="append", dest="roll_numbers",
+                            help="Only rebuild the given roll number (can be repeated)")
+        parser.add_argument("--plc", type=int, dest="plc_id", help="Only rebuild rolls of this PLC id")
+
+    def handle(self, *args, **options):
+        rolls = Rolls.objects.all().order_by("CreationDateTime")
+        if options["roll_numbers"]:
+            rolls = rolls.filter(roll_number__in=options["roll_numbers"])
+        if options["plc_id"]:
+            rolls = rolls.filter(plc_id=options["plc_id"])
+
+        total = 0
+        for roll in rolls.iterator():
+            key_count = RollKeyAggregate.rebuild(roll)
+            roll.avg_final_data()
+            total += 1
+            self.stdout.write(f"roll {roll.roll_number or roll.id}: {key_count} keys")
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt aggregates for {total} rolls"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from PLC_Monitoring.models import PLC, Roll_Segments
+
+
+class Command(BaseCommand):
+    help = "Rebuild Roll_Segments (run/stop periods) from PLC_Logs history; stop the ingestion worker of the PLC first"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--plc", type=int, dest="plc_id", help="Only rebuild segments of this PLC id")
+
+    def handle(self, *args, **options):
+        plcs = PLC.objects.all().order_by("id")
+        if options["plc_id"]:
+            plcs = plcs.filter(id=options["plc_id"])
+
+        total = 0
+        for plc in plcs:
+            count = Roll_Segments.rebuild(plc.id)
+            total += count
+            self.stdout.write(f"{plc.device_id}: {count} segments")
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} segments"))
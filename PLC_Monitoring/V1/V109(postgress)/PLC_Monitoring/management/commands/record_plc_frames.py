@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from PLC_Monitoring.models import PLC_Logs
+from PLC_Monitoring.replay import Recording, record_proxy
+
+
+def parse_endpoint(value):
+    host, _, port = value.rpartition(":")
+    if not port.isdigit():
+        raise CommandError(f"Invalid endpoint {value!r}, expected host:port")
+    return host or "0.0.0.0", int(port)
+
+
+class Command(BaseCommand):
+    help = ("Record raw PLC traffic to a frame file for fake_plc and bench_ingestion: either as a TCP proxy "
+            "in front of a PLC (--mode poll) or of the V2 tcp_server.py (--mode push), stopped with Ctrl+C, or "
+            "from the raw responses already stored in PLC_Logs (--from-logs).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Recording file to write")
+        parser.add_argument("--listen", help="host:port the proxy listens on")
+        parser.add_argument("--upstream", help="host:port of the PLC (poll) or of the V2 tcp_server.py, e.g. 127.0.0.1:2000 (push)")
+        parser.add_argument("--mode", choices=["poll", "push"], default="poll")
+        parser.add_argument("--from-logs", action="store_true", help="Export stored PLC_Logs responses instead")
+        parser.add_argument("--plc", type=int, dest="plc_id", help="With --from-logs: only this PLC id")
+        parser.add_argument("--since", help="With --from-logs: first day, YYYY-MM-DD")
+        parser.add_argument("--limit", type=int, help="With --from-logs: at most this many responses")
+
+    def handle(self, *args, **options):
+        if options["from_logs"]:
+            logs = PLC_Logs.objects.filter(data__startswith="n=")
+            if options["plc_id"]:
+                logs = logs.filter(plc_id=options["plc_id"])
+            if options["since"]:
+                try:
+                    since = datetime.strptime(options["since"], "%Y-%m-%d")
+                except ValueError:
+                    raise CommandError(f"Invalid date {options['since']!r}, expected YYYY-MM-DD")
+                logs = logs.filter(CreationDateTime__gte=timezone.make_aware(since))
+            if options["limit"]:
+                ids = logs.order_by("CreationDateTime", "id").values_list("id", flat=True)[:options["limit"]]
+                logs = PLC_Logs.objects.filter(id__in=list(ids))
+            recording = Recording.from_logs(logs)
+            recording.save(options["output"])
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(recording.frames('response'))} responses to {options['output']}"))
+            return
+
+        if not options["listen"] or not options["upstream"]:
+            raise CommandError("--listen and --upstream are required unless --from-logs is given")
+        listen = parse_endpoint(options["listen"])
+        upstream = parse_endpoint(options["upstream"])
+        recording = Recording(options["mode"])
+        self.stdout.write(f"Recording {listen[0]}:{listen[1]} -> {upstream[0]}:{upstream[1]}, Ctrl+C to stop")
+        try:
+            asyncio.run(record_proxy(*listen, *upstream, recording))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            recording.save(options["output"])
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(recording.records)} chunks to {options['output']}"))
@@ -0,0 +1,110 @@
+"""Shared, versioned cache of the key metadata (PLC_Keys, ChartExcludedKeys, KeyAlertConfig).
+
+Every process keeps one snapshot in memory. Saving or deleting one of those rows calls registry.bump()
+from the post_save/post_delete signals connected in apps.py, in the same transaction as the change;
+bulk writes send no signals and call it themselves. bump() increments the row in Metadata_Version;
+readers compare that counter with the version of their snapshot at most once per CHECK_INTERVAL and
+reload everything on a mismatch.
+"""
+import threading
+import time
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import PLC_Keys, ChartExcludedKeys, KeyAlertConfig, Metadata_Version
+
+VERSION_NAME = "keys"
+CHECK_INTERVAL = 2      # seconds a snapshot is trusted before the version row is read again
+DEFAULT_ORDER = 9999    # sort position of keys without an order_index
+
+
+def alert_config_data(config):
+    return {
+        'min_value': config.min_value,
+        'max_value': config.max_value,
+        'color_max': config.color_max,
+        'color_min': config.color_min,
+        'alert_types': config.alert_types or {}
+    }
+
+
+class Snapshot:
+    """Metadata as of one version; shared by all threads, so treat it as read-only"""
+
+    def __init__(self, version):
+        self.version = version
+        self.keys = list(PLC_Keys.objects.order_by('id').values())
+        self.translations = {}      # key -> fa_name or name or key
+        self.order = {}             # key -> order_index
+        self.key_ids = {}           # key -> oldest PLC_Keys id, the one the typed log values point at
+        for plc_key in self.keys:
+            key = plc_key['key']
+            self.translations[key] = plc_key['fa_name'] or plc_key['name'] or key
+            self.order[key] = plc_key['order_index'] if plc_key['order_index'] is not None else DEFAULT_ORDER
+            self.key_ids.setdefault(key, plc_key['id'])
+        self.excluded = frozenset(ChartExcludedKeys.objects.values_list('key', flat=True))
+        self.alert_configs = {config.key: alert_config_data(config) for config in KeyAlertConfig.objects.all()}
+
+    def translate(self, key):
+        return self.translations.get(key, key)
+
+    def keys_with_status(self):
+        """All keys with their display name and chart exclusion, for the settings panels"""
+        return [
+            {
+                'key': plc_key['key'],
+                'fa_name': self.translations[plc_key['key']],
+                'is_excluded': plc_key['key'] in self.excluded
+            }
+            for plc_key in self.keys
+        ]
+
+
+class MetadataRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.checked_at = 0
+
+    def stored_version(self):
+        return Metadata_Version.objects.filter(name=VERSION_NAME).values_list('version', flat=True).first() or 0
+
+    def current(self):
+        """The metadata snapshot, reloaded when another process (or this one) bumped the version"""
+        snapshot = self.snapshot
+        if snapshot is not None and time.monotonic() - self.checked_at < CHECK_INTERVAL:
+            return snapshot
+        with self.lock:
+            if self.snapshot is not None and time.monotonic() - self.checked_at < CHECK_INTERVAL:
+                return self.snapshot
+            version = self.stored_version()
+            if self.snapshot is None or self.snapshot.version != version:
+                self.snapshot = Snapshot(version)
+            self.checked_at = time.monotonic()
+            return self.snapshot
+
+    def bump(self):
+        """Mark the metadata as changed; call it in the writer's transaction"""
+        updated = Metadata_Version.objects.filter(name=VERSION_NAME).update(
+            version=F('version') + 1, LastUpdate=timezone.now()
+        )
+        if not updated:
+            Metadata_Version.objects.get_or_create(name=VERSION_NAME, defaults={'version': 1})
+        transaction.on_commit(self.invalidate)
+        self.invalidate()
+
+    def invalidate(self):
+        with self.lock:
+            self.snapshot = None
+
+
+registry = MetadataRegistry()
+
+METADATA_MODELS = (PLC_Keys, ChartExcludedKeys, KeyAlertConfig)
+
+
+def metadata_changed(sender, **kwargs):
+    """post_save/post_delete receiver of METADATA_MODELS"""
+    registry.bump()
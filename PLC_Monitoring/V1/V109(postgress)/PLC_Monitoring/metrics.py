@@ -0,0 +1,148 @@
+"""In-process metrics of the PLC poller, served in the Prometheus text format.
+
+The poller times every stage of a tick (thermal API fetch, PLC socket round-trip, parse, dedup,
+roll aggregation and DB writes) into per-PLC histograms and counts the frames by outcome, so a slow
+line shows which stage the time goes to. serve_metrics() exposes them on a small local HTTP server:
+
+    curl http://127.0.0.1:9108/metrics
+"""
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+STAGES = ("thermal", "socket", "parse", "dedup", "aggregation", "db")
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)  # seconds
+
+# name -> (type, help)
+FAMILIES = {
+    "plc_stage_seconds": ("histogram", "Time spent in one stage of a poller tick"),
+    "plc_frames_total": ("counter", "PLC frames by outcome: stored, duplicate, dropped or error"),
+    "plc_errors_total": ("counter", "Failed ticks by the stage that raised"),
+    "plc_lag_seconds": ("gauge", "How far the last tick of the line ran past its polling interval"),
+    "plc_last_sample_timestamp_seconds": ("gauge", "Unix time of the last stored sample of the line"),
+}
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+class Metrics:
+    """Thread-safe metric store; the ingestion runs in a worker thread, the HTTP server in the event loop"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {name: {} for name in FAMILIES}   # name -> {((label, value), ...): number or Histogram}
+
+    def observe(self, name, value, **labels):
+        key = tuple(labels.items())
+        with self.lock:
+            histogram = self.values[name].get(key)
+            if histogram is None:
+                histogram = self.values[name][key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(labels.items())
+        with self.lock:
+            self.values[name][key] = self.values[name].get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[name][tuple(labels.items())] = value
+
+    @contextmanager
+    def timer(self, stage, plc):
+        """Observe the wall time of the block as plc_stage_seconds{plc, stage}"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("plc_stage_seconds", time.perf_counter() - started, plc=plc, stage=stage)
+
+    def stage_totals(self, plc=None):
+        """stage -> (count, seconds) summed over the PLCs (or of one PLC)"""
+        totals = {}
+        with self.lock:
+            for key, histogram in self.values["plc_stage_seconds"].items():
+                labels = dict(key)
+                if plc is not None and labels["plc"] != plc:
+                    continue
+                count, seconds = totals.get(labels["stage"], (0, 0.0))
+                totals[labels["stage"]] = (count + histogram.count, seconds + histogram.sum)
+        return totals
+
+    def reset(self):
+        with self.lock:
+            self.values = {name: {} for name in FAMILIES}
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (kind, help_text) in FAMILIES.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(self.values[name].items()):
+                    if kind != "histogram":
+                        lines.append(f"{name}{_labels(key)} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, value.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(key, le=bound)} {cumulative}")
+                    lines.append(f"{name}_bucket{_labels(key, le='+Inf')} {value.count}")
+                    lines.append(f"{name}_sum{_labels(key)} {value.sum}")
+                    lines.append(f"{name}_count{_labels(key)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+async def serve_metrics(host, port):
+    """Start the HTTP server answering GET /metrics and return it"""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+                status, body = "200 OK", metrics.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PLC_Monitoring', '0013_alter_chartexcludedkeys_creationdatetime_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollKeyAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=100)),
+                ('count', models.IntegerField(default=0)),
+                ('sum', models.FloatField(default=0)),
+                ('min', models.FloatField(blank=True, null=True)),
+                ('max', models.FloatField(blank=True, null=True)),
+                ('last', models.FloatField(blank=True, null=True)),
+                ('CreationDateTime', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='زمان ساخت')),
+                ('LastUpdate', models.DateTimeField(blank=True, null=True, verbose_name='آخرین آپدیت')),
+                ('roll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='key_aggregates', to='PLC_Monitoring.rolls')),
+            ],
+            options={
+                'unique_together': {('roll', 'key')},
+            },
+        ),
+    ]
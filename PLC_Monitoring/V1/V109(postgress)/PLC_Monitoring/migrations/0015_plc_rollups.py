@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PLC_Monitoring', '0014_rollkeyaggregate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PLC_Rollups',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.IntegerField()),
+                ('bucket', models.DateTimeField()),
+                ('key', models.CharField(max_length=100)),
+                ('count', models.IntegerField(default=0)),
+                ('sum', models.FloatField(default=0)),
+                ('min', models.FloatField(blank=True, null=True)),
+                ('max', models.FloatField(blank=True, null=True)),
+                ('last', models.FloatField(blank=True, null=True)),
+                ('last_at', models.DateTimeField(blank=True, null=True)),
+                ('last_value', models.TextField(blank=True, null=True)),
+                ('last_value_at', models.DateTimeField(blank=True, null=True)),
+                ('first_at', models.DateTimeField(blank=True, null=True)),
+                ('CreationDateTime', models.DateTimeField(blank=True, null=True, verbose_name='زمان ساخت')),
+                ('LastUpdate', models.DateTimeField(blank=True, null=True, verbose_name='آخرین آپدیت')),
+                ('plc', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='PLC_Monitoring.plc')),
+                ('roll', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='PLC_Monitoring.rolls')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resolution', 'roll', 'bucket'], name='PLC_Monitor_resolut_a80438_idx'), models.Index(fields=['resolution', 'bucket', 'plc'], name='PLC_Monitor_resolut_e0799f_idx')],
+                'unique_together': {('plc', 'roll', 'resolution', 'bucket', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:54
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PLC_Monitoring', '0015_plc_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plc_logs',
+            name='key_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, null=True, size=None),
+        ),
+        migrations.AddField(
+            model_name='plc_logs',
+            name='key_values',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, null=True, size=None),
+        ),
+    ]
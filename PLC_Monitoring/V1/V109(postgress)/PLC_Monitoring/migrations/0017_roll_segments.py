@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PLC_Monitoring', '0016_plc_logs_typed_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Roll_Segments',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_running', models.BooleanField(default=False)),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField(blank=True, null=True)),
+                ('CreationDateTime', models.DateTimeField(blank=True, null=True, verbose_name='زمان ساخت')),
+                ('LastUpdate', models.DateTimeField(blank=True, null=True, verbose_name='آخرین آپدیت')),
+                ('plc', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='PLC_Monitoring.plc')),
+                ('roll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='PLC_Monitoring.rolls')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['roll', 'started_at'], name='PLC_Monitor_roll_id_04e4c1_idx'), models.Index(fields=['is_running', 'started_at'], name='PLC_Monitor_is_runn_8ae54b_idx'), models.Index(fields=['plc', 'started_at'], name='PLC_Monitor_plc_id_a5ff42_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PLC_Monitoring', '0017_roll_segments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Metadata_Version',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+                ('LastUpdate', models.DateTimeField(blank=True, null=True, verbose_name='آخرین آپدیت')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PLC_Monitoring', '0018_metadata_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PLC_Alerts',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=100)),
+                ('kind', models.CharField(choices=[('max', 'حداکثر'), ('min', 'حداقل')], max_length=3)),
+                ('threshold', models.FloatField()),
+                ('value', models.FloatField()),
+                ('peak', models.FloatField()),
+                ('close_value', models.FloatField(blank=True, null=True)),
+                ('opened_at', models.DateTimeField()),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('CreationDateTime', models.DateTimeField(blank=True, null=True, verbose_name='زمان ساخت')),
+                ('LastUpdate', models.DateTimeField(blank=True, null=True, verbose_name='آخرین آپدیت')),
+                ('plc', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='PLC_Monitoring.plc')),
+                ('roll', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='alerts', to='PLC_Monitoring.rolls')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['plc', 'opened_at'], name='PLC_Monitor_plc_id_81eb6b_idx'), models.Index(fields=['closed_at', 'plc'], name='PLC_Monitor_closed__86139c_idx'), models.Index(fields=['LastUpdate'], name='PLC_Monitor_LastUpd_dd9f41_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+from django.db import migrations
+from django.utils import timezone
+
+TABLE = 'PLC_Monitoring_plc_logs'
+MONTHS_AHEAD = 3    # as partitions.MONTHS_AHEAD at the time of this migration
+
+
+def month_start(when, offset=0):
+    local = timezone.localtime(when)
+    month = local.year * 12 + local.month - 1 + offset
+    return timezone.make_aware(datetime(month // 12, month % 12 + 1, 1))
+
+
+def partition_logs(apps, schema_editor):
+    """Turn the plain PLC_Logs table into a partitioned one, keeping its rows in a legacy partition"""
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    quote = connection.ops.quote_name
+    table = quote(TABLE)
+    legacy = quote(f'{TABLE}_legacy')
+    sequence = quote(f'{TABLE}_id_seq')
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [table])
+        if cursor.fetchone() is not None:
+            return
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+        # the partition key must be NOT NULL and part of the primary key
+        cursor.execute(f'UPDATE {legacy} SET "CreationDateTime" = COALESCE("LastUpdate", now()) WHERE "CreationDateTime" IS NULL')
+        cursor.execute(f'ALTER TABLE {legacy} ALTER COLUMN "CreationDateTime" SET NOT NULL')
+        cursor.execute(f'SELECT COALESCE(max(id), 0) + 1, max("CreationDateTime") FROM {legacy}')
+        next_id, newest = cursor.fetchone()
+        cursor.execute(f'ALTER TABLE {legacy} ALTER COLUMN id DROP IDENTITY IF EXISTS')
+        cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p'", [legacy])
+        for (name,) in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE {legacy} DROP CONSTRAINT {quote(name)}')
+        cursor.execute(f'ALTER TABLE {legacy} ADD PRIMARY KEY (id, "CreationDateTime")')
+
+        cursor.execute(f'''
+            CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING INDEXES)
+            PARTITION BY RANGE ("CreationDateTime")
+        ''')
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [legacy],
+        )
+        for name, definition in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {quote(name + "_p")} {definition}')
+        cursor.execute(f'CREATE SEQUENCE {sequence} OWNED BY {table}.id')
+        cursor.execute('SELECT setval(%s, %s, false)', [sequence, next_id])
+        cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+
+        now = timezone.now()
+        month = month_start(max(newest or now, now), 1)
+        cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO (%s)', [month])
+        cursor.execute(f'CREATE TABLE {quote(TABLE + "_default")} PARTITION OF {table} DEFAULT')
+        # the following months; partitions.ensure_partitions() keeps creating them from here on
+        last = month_start(now, MONTHS_AHEAD + 1)
+        while month < last:
+            following = month_start(month, 1)
+            cursor.execute(
+                f'CREATE TABLE {quote(f"{TABLE}_p{timezone.localtime(month):%Y%m}")} PARTITION OF {table} '
+                'FOR VALUES FROM (%s) TO (%s)',
+                [month, following],
+            )
+            month = following
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PLC_Monitoring', '0019_plc_alerts'),
+    ]
+
+    operations = [
+        # Postgres only; the partitions stay in place when migrating back
+        migrations.RunPython(partition_logs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:09
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Coalesce, Now
+
+
+def fill_last_update(apps, schema_editor):
+    # rolls without LastUpdate would never show up in the change feed
+    Rolls = apps.get_model('PLC_Monitoring', 'Rolls')
+    Rolls.objects.filter(LastUpdate__isnull=True).update(LastUpdate=Coalesce(F('CreationDateTime'), Now()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PLC_Monitoring', '0020_partition_plc_logs'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_last_update, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='rolls',
+            index=models.Index(fields=['LastUpdate', 'id'], name='PLC_Monitor_LastUpd_f04acb_idx'),
+        ),
+    ]
@@ -1,5 +1,19 @@
-from django.db import models
+from django.db import models, transaction, connection
+from django.contrib.postgres.fields import ArrayField
 from django.utils import timezone
+from datetime import datetime, timedelta, timezone as dt_timezone
+import json
+import re
+
+# Values float() would accept in the old Python loops (plain decimal / exponent notation)
+NUMERIC_PATTERN = r'^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'
+NUMERIC_RE = re.compile(NUMERIC_PATTERN)
+
+# Rollup bucket sizes in seconds: 1 minute, 15 minutes, 1 hour, 1 day
+ROLLUP_RESOLUTIONS = [60, 900, 3600, 86400]
+
+# How much older than its roll row the first log of a roll may be
+ROLL_LOGS_MARGIN = timedelta(minutes=10)
 
 class PLC(models.Model):
     device_id = models.CharField(max_length=50,unique=True,db_index=True)
@@ -24,6 +38,27 @@ class PLC(models.Model):
         self.LastUpdate = timezone.now()
         super().save(*args, **kwargs)
 
+    def merge_setting(self, data):
+        """Merge data into setting with one UPDATE, keeping keys other writers added meanwhile"""
+        if self.setting is None:
+            self.setting = {}
+        self.setting.update(data)
+        self.LastUpdate = timezone.now()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'UPDATE "{self._meta.db_table}" '
+                    'SET "setting" = COALESCE("setting", \'{}\'::jsonb) || %s::jsonb, "LastUpdate" = %s '
+                    'WHERE "id" = %s',
+                    [json.dumps(data), self.LastUpdate, self.pk]
+                )
+        else:
+            PLC.objects.filter(pk=self.pk).update(setting=self.setting, LastUpdate=self.LastUpdate)
+
+
+# Keys whose roll value is the last sample instead of the average
+LAST_VALUE_KEYS = ["mi1"]
+
 
 class Rolls(models.Model):
     plc = models.ForeignKey(PLC,on_delete=models.CASCADE,related_name="rolls",db_index=True,null=True,blank=True)
@@ -35,6 +70,12 @@ class Rolls(models.Model):
     CreationDateTime = models.DateTimeField(verbose_name="زمان ساخت",null=True,blank=True,db_index=True)
     LastUpdate = models.DateTimeField(verbose_name="آخرین آپدیت",null=True,blank=True)
 
+    class Meta:
+        indexes = [
+            # change feed of roll_detail_api
+            models.Index(fields=['LastUpdate', 'id']),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.CreationDateTime:
             self.CreationDateTime = timezone.now()
@@ -42,52 +83,24 @@ class Rolls(models.Model):
         super().save(*args, **kwargs)
 
     def avg_final_data(self):
-        logs = PLC_Logs.objects.filter(roll=self).exclude(json_data__isnull=True).order_by('CreationDateTime')
-        if not logs.exists():
+        aggregates = RollKeyAggregate.objects.filter(roll=self)
+        if not aggregates:
             return
-        
-        last_value_keys = ["mi1"]
-        numeric_values = {}
-        last_values = {}
-        
-        for log in logs:
-            if not log.json_data:
-                continue
-            for key, value in log.json_data.items():
-                try:
-                    float(value)
-                except:
-                    continue
-
-                try:
-                    num_value = float(value)
-                    if num_value > 0:
-                        if key in last_value_keys:
-                            last_values[key] = num_value
-                        else:
-                            if key not in numeric_values:
-                                numeric_values[key] = []
-                            numeric_values[key].append(num_value)
-                except (ValueError, TypeError):
-                    continue
-        
-        if not numeric_values and not last_values:
-            return
-        
+
+        self.set_average_settings(aggregates)
+        self.save()
+
+    def set_average_settings(self, aggregates):
+        """Write the roll averages (last value for LAST_VALUE_KEYS) into plc_setting without saving"""
         if self.plc_setting is None:
             self.plc_setting = {}
-        
-        for key, values in numeric_values.items():
-            if values:
-                avg = sum(values) / len(values)
-                self.plc_setting[key] = str(int(avg))
-        
-        for key, value in last_values.items():
-            print(key,value)
-            self.plc_setting[key] = str(int(value))
-        
-        self.save()
-        
+
+        for aggregate in aggregates:
+            if aggregate.key in LAST_VALUE_KEYS:
+                self.plc_setting[aggregate.key] = str(int(aggregate.last))
+            else:
+                self.plc_setting[aggregate.key] = str(int(aggregate.sum / aggregate.count))
+
 
 class Roll_Breaks(models.Model):
     roll = models.ForeignKey(Rolls,on_delete=models.CASCADE,related_name="roll_breaks",db_index=True,null=True,blank=True)
@@ -107,6 +120,9 @@ class PLC_Logs(models.Model):
     is_running = models.BooleanField(default=False,null=True,blank=True)
     data = models.TextField()
     json_data = models.JSONField(null=True,blank=True)
+    # numeric json_data values as parallel arrays of PLC_Keys ids and floats
+    key_ids = ArrayField(models.IntegerField(),null=True,blank=True)
+    key_values = ArrayField(models.FloatField(),null=True,blank=True)
     CreationDateTime = models.DateTimeField(verbose_name="زمان ساخت",null=True,blank=True,db_index=True)
     LastUpdate = models.DateTimeField(verbose_name="آخرین آپدیت",null=True,blank=True)
 
@@ -116,6 +132,68 @@ class PLC_Logs(models.Model):
         self.LastUpdate = timezone.now()
         super().save(*args, **kwargs)
 
+    @classmethod
+    def for_rolls(cls, roll_ids):
+        """Logs of the given rolls, bounded in time so Postgres only reads the partitions of those months.
+
+        A roll's logs start when the roll row was created (up to ROLL_LOGS_MARGIN earlier for rolls created
+        before ingestion dated a new roll with the log that names it) and end with its last closed
+        Roll_Segments row.
+        """
+        roll_ids = set(roll_ids)
+        logs = cls.objects.filter(roll_id__in=roll_ids)
+        if not roll_ids:
+            return logs
+        created = Rolls.objects.filter(id__in=roll_ids).aggregate(
+            start=models.Min('CreationDateTime'),
+            undated=models.Count('id', filter=models.Q(CreationDateTime__isnull=True)),
+        )
+        if created['start'] is not None and not created['undated']:
+            logs = logs.filter(CreationDateTime__gte=created['start'] - ROLL_LOGS_MARGIN)
+        span = Roll_Segments.objects.filter(roll_id__in=roll_ids).aggregate(
+            rolls=models.Count('roll_id', distinct=True),
+            open=models.Count('id', filter=models.Q(ended_at__isnull=True)),
+            end=models.Max('ended_at'),
+        )
+        if span['rolls'] == len(roll_ids) and not span['open']:
+            logs = logs.filter(CreationDateTime__lte=span['end'])
+        return logs
+
+    def set_values(self, data, key_ids):
+        """Fill key_ids/key_values from the numeric items of data; key_ids maps key name -> PLC_Keys id"""
+        self.key_ids = []
+        self.key_values = []
+        for key, value in data.items():
+            if key in key_ids and isinstance(value, str) and NUMERIC_RE.match(value):
+                self.key_ids.append(key_ids[key])
+                self.key_values.append(float(value))
+
+    @staticmethod
+    def pack_values(start_id, end_id):
+        """Fill key_ids/key_values of not yet packed logs with start_id <= id < end_id, returns the row count"""
+        logs_table = connection.ops.quote_name(PLC_Logs._meta.db_table)
+        keys_table = connection.ops.quote_name(PLC_Keys._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                UPDATE {logs_table} l
+                SET key_ids = COALESCE(p.ids, '{{}}'), key_values = COALESCE(p.vals, '{{}}')
+                FROM (
+                    SELECT l2.id, packed.ids, packed.vals
+                    FROM {logs_table} l2
+                    LEFT JOIN LATERAL (
+                        SELECT array_agg(k.id ORDER BY k.id) AS ids,
+                               array_agg(kv.value::double precision ORDER BY k.id) AS vals
+                        FROM jsonb_each_text(l2.json_data) kv
+                        JOIN (SELECT key, min(id) AS id FROM {keys_table} GROUP BY key) k ON k.key = kv.key
+                        WHERE kv.value ~ %s
+                    ) packed ON true
+                    WHERE l2.id >= %s AND l2.id < %s AND l2.key_ids IS NULL
+                      AND jsonb_typeof(l2.json_data) = 'object'
+                ) p
+                WHERE l.id = p.id
+            ''', [NUMERIC_PATTERN, start_id, end_id])
+            return cursor.rowcount
+
 
 class PLC_Keys(models.Model):
     name = models.CharField(max_length=100,db_index=True,null=True,blank=True)
@@ -164,4 +242,490 @@ class KeyAlertConfig(models.Model):
         if not self.CreationDateTime:
             self.CreationDateTime = timezone.now()
         self.LastUpdate = timezone.now()
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+class RollKeyAggregate(models.Model):
+    """Running count/sum/min/max/last of positive numeric samples per roll and key"""
+    roll = models.ForeignKey(Rolls,on_delete=models.CASCADE,related_name="key_aggregates",db_index=True)
+    key = models.CharField(max_length=100,db_index=True)
+    count = models.IntegerField(default=0)
+    sum = models.FloatField(default=0)
+    min = models.FloatField(null=True,blank=True)
+    max = models.FloatField(null=True,blank=True)
+    last = models.FloatField(null=True,blank=True)
+    CreationDateTime = models.DateTimeField(verbose_name="زمان ساخت",null=True,blank=True,db_index=True)
+    LastUpdate = models.DateTimeField(verbose_name="آخرین آپدیت",null=True,blank=True)
+
+    class Meta:
+        unique_together = ('roll', 'key')
+
+    def save(self, *args, **kwargs):
+        if not self.CreationDateTime:
+            self.CreationDateTime = timezone.now()
+        self.LastUpdate = timezone.now()
+        super().save(*args, **kwargs)
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.last = value
+
+    @staticmethod
+    def numeric_items(json_data):
+        """Yield (key, value) for every positive numeric value in a log's json_data"""
+        for key, value in (json_data or {}).items():
+            try:
+                num_value = float(value)
+            except (ValueError, TypeError):
+                continue
+            if num_value > 0:
+                yield key, num_value
+
+    @classmethod
+    def for_roll(cls, roll):
+        aggregates = {aggregate.key: aggregate for aggregate in cls.objects.filter(roll=roll)}
+        for aggregate in aggregates.values():
+            aggregate.stored = (aggregate.count, aggregate.sum)
+        return aggregates
+
+    @classmethod
+    def fold(cls, roll, aggregates, json_data):
+        """Fold one log into the aggregates dict in memory and return the touched rows"""
+        now = timezone.now()
+        touched = []
+        for key, value in cls.numeric_items(json_data):
+            aggregate = aggregates.get(key)
+            if aggregate is None:
+                aggregate = aggregates[key] = cls(roll=roll, key=key, CreationDateTime=now)
+            aggregate.add(value)
+            aggregate.LastUpdate = now
+            touched.append(aggregate)
+        return touched
+
+    @classmethod
+    def save_all(cls, aggregates):
+        """Add what the aggregates gained since they were loaded to their rows with one upsert.
+
+        Rolls are shared by roll number, so several lines may fold into the same rows: counts and sums
+        are added and min/max merged in the database instead of overwritten, and the objects get the
+        stored totals back.
+        """
+        changes = {}     # (roll id, key) -> [count, sum, min, max, last, LastUpdate, objects]
+        for aggregate in aggregates:
+            stored_count, stored_sum = getattr(aggregate, 'stored', (0, 0))
+            change = changes.get((aggregate.roll_id, aggregate.key))
+            if change is None:
+                change = changes[(aggregate.roll_id, aggregate.key)] = [0, 0, None, None, None, None, []]
+            change[0] += aggregate.count - stored_count
+            change[1] += aggregate.sum - stored_sum
+            change[2] = aggregate.min if change[2] is None else min(change[2], aggregate.min)
+            change[3] = aggregate.max if change[3] is None else max(change[3], aggregate.max)
+            if change[5] is None or aggregate.LastUpdate >= change[5]:
+                change[4], change[5] = aggregate.last, aggregate.LastUpdate
+            change[6].append(aggregate)
+        if not changes:
+            return
+
+        table = connection.ops.quote_name(cls._meta.db_table)
+        params = []
+        for (roll_id, key), (count, total, minimum, maximum, last, updated, objects) in changes.items():
+            created = min(aggregate.CreationDateTime or updated for aggregate in objects)
+            params += [roll_id, key, count, total, minimum, maximum, last, created, updated]
+        rows = ', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(changes))
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                INSERT INTO {table} AS a (roll_id, key, count, sum, min, max, last, "CreationDateTime", "LastUpdate")
+                VALUES {rows}
+                ON CONFLICT (roll_id, key) DO UPDATE SET
+                    count = a.count + EXCLUDED.count, sum = a.sum + EXCLUDED.sum,
+                    min = LEAST(a.min, EXCLUDED.min), max = GREATEST(a.max, EXCLUDED.max),
+                    last = EXCLUDED.last, "LastUpdate" = EXCLUDED."LastUpdate"
+                RETURNING id, roll_id, key, count, sum, min, max, last
+            ''', params)
+            for pk, roll_id, key, count, total, minimum, maximum, last in cursor.fetchall():
+                for aggregate in changes[(roll_id, key)][6]:
+                    aggregate.pk = pk
+                    aggregate.count, aggregate.sum, aggregate.min, aggregate.max, aggregate.last = count, total, minimum, maximum, last
+                    aggregate.stored = (count, total)
+                    aggregate._state.adding = False
+
+    @classmethod
+    def rebuild(cls, roll):
+        """Recompute a roll's aggregates from its PLC_Logs history: the typed values of packed logs,
+        json_data of the logs pack_log_values has not reached yet"""
+        logs = PLC_Logs.for_rolls([roll.id]).order_by().values('id', 'CreationDateTime', 'key_ids', 'key_values', 'json_data')
+        subquery, params = logs.query.sql_with_params()
+        keys_table = connection.ops.quote_name(PLC_Keys._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                SELECT k.key, count(*), sum(k.value), min(k.value), max(k.value),
+                       (array_agg(k.value ORDER BY l."CreationDateTime" DESC, l.id DESC))[1]
+                FROM ({subquery}) l
+                CROSS JOIN LATERAL (
+                    SELECT keys.key, typed.value
+                    FROM unnest(l.key_ids, l.key_values) AS typed(key_id, value)
+                    JOIN {keys_table} keys ON keys.id = typed.key_id
+                    UNION ALL
+                    SELECT raw.key, raw.value::double precision
+                    FROM jsonb_each_text(CASE WHEN l.key_ids IS NULL AND jsonb_typeof(l.json_data) = 'object'
+                                              THEN l.json_data END) AS raw
+                    WHERE raw.value ~ %s
+                ) k
+                WHERE k.value > 0
+                GROUP BY k.key
+            ''', [*params, NUMERIC_PATTERN])
+            rows = cursor.fetchall()
+
+        now = timezone.now()
+        aggregates = {
+            key: cls(roll=roll, key=key, count=count, sum=total, min=minimum, max=maximum, last=last,
+                     CreationDateTime=now, LastUpdate=now)
+            for key, count, total, minimum, maximum, last in rows
+        }
+
+        with transaction.atomic():
+            cls.objects.filter(roll=roll).delete()
+            cls.objects.bulk_create(aggregates.values())
+        return len(aggregates)
+
+
+class PLC_Rollups(models.Model):
+    """count/sum/min/max/last of the running samples of one PLC, roll and key in a fixed time bucket"""
+    plc = models.ForeignKey(PLC,on_delete=models.CASCADE,related_name="rollups",null=True,blank=True)
+    roll = models.ForeignKey(Rolls,on_delete=models.CASCADE,related_name="rollups",null=True,blank=True)
+    resolution = models.IntegerField()  # bucket size in seconds, one of ROLLUP_RESOLUTIONS
+    bucket = models.DateTimeField()     # bucket start, aligned to the epoch
+    key = models.CharField(max_length=100)
+    count = models.IntegerField(default=0)  # numeric samples
+    sum = models.FloatField(default=0)
+    min = models.FloatField(null=True,blank=True)
+    max = models.FloatField(null=True,blank=True)
+    last = models.FloatField(null=True,blank=True)          # last numeric value
+    last_at = models.DateTimeField(null=True,blank=True)
+    last_value = models.TextField(null=True,blank=True)     # last raw value, numeric or not
+    last_value_at = models.DateTimeField(null=True,blank=True)
+    first_at = models.DateTimeField(null=True,blank=True)
+    CreationDateTime = models.DateTimeField(verbose_name="زمان ساخت",null=True,blank=True)
+    LastUpdate = models.DateTimeField(verbose_name="آخرین آپدیت",null=True,blank=True)
+
+    class Meta:
+        unique_together = ('plc', 'roll', 'resolution', 'bucket', 'key')
+        indexes = [
+            models.Index(fields=['resolution', 'roll', 'bucket']),
+            models.Index(fields=['resolution', 'bucket', 'plc']),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.CreationDateTime:
+            self.CreationDateTime = timezone.now()
+        self.LastUpdate = timezone.now()
+        super().save(*args, **kwargs)
+
+    def add(self, value, when):
+        if self.first_at is None:
+            self.first_at = when
+        self.last_value = value
+        self.last_value_at = when
+        if isinstance(value, str) and NUMERIC_RE.match(value):
+            num_value = float(value)
+            self.count += 1
+            self.sum += num_value
+            self.min = num_value if self.min is None else min(self.min, num_value)
+            self.max = num_value if self.max is None else max(self.max, num_value)
+            self.last = num_value
+            self.last_at = when
+
+    @staticmethod
+    def bucket_start(when, resolution):
+        return datetime.fromtimestamp(int(when.timestamp() // resolution) * resolution, tz=dt_timezone.utc)
+
+    @classmethod
+    def for_bucket(cls, resolution, bucket):
+        return {
+            (rollup.plc_id, rollup.roll_id, rollup.key): rollup
+            for rollup in cls.objects.filter(resolution=resolution, bucket=bucket)
+        }
+
+    @classmethod
+    def fold(cls, rollups, plc_log, resolution, bucket):
+        """Fold one log into the rollups dict of its bucket in memory and return the touched rows"""
+        now = timezone.now()
+        touched = []
+        for key, value in plc_log.json_data.items():
+            rollup = rollups.get((plc_log.plc_id, plc_log.roll_id, key))
+            if rollup is None:
+                rollup = rollups[(plc_log.plc_id, plc_log.roll_id, key)] = cls(plc_id=plc_log.plc_id, roll_id=plc_log.roll_id, resolution=resolution,
+                                            bucket=bucket, key=key, CreationDateTime=now)
+            rollup.add(value, plc_log.CreationDateTime)
+            rollup.LastUpdate = now
+            touched.append(rollup)
+        return touched
+
+    @classmethod
+    def save_all(cls, rollups):
+        """Persist rollups with one bulk UPDATE and one bulk INSERT"""
+        existing = [rollup for rollup in rollups if rollup.pk]
+        new = [rollup for rollup in rollups if not rollup.pk]
+        if existing:
+            cls.objects.bulk_update(existing, ['count', 'sum', 'min', 'max', 'last', 'last_at', 'last_value',
+                                               'last_value_at', 'first_at', 'LastUpdate'])
+        if new:
+            cls.objects.bulk_create(new)
+
+    @classmethod
+    def rebuild(cls, start, end, plc_id=None):
+        """Recompute every resolution for the running logs in [start, end) with set-based SQL.
+
+        start and end must be aligned to the coarsest resolution so no bucket is rebuilt from part of its logs.
+        The finest resolution is read from PLC_Logs, each coarser one from the previous resolution.
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        logs_table = connection.ops.quote_name(PLC_Logs._meta.db_table)
+        columns = ('plc_id, roll_id, resolution, bucket, key, count, sum, min, max, last, last_at, last_value, '
+                   'last_value_at, first_at, "CreationDateTime", "LastUpdate"')
+        plc_filter = 'AND plc_id = %s' if plc_id else ''
+        plc_params = [plc_id] if plc_id else []
+        finest = ROLLUP_RESOLUTIONS[0]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE bucket >= %s AND bucket < %s {plc_filter}',
+                [start, end, *plc_params],
+            )
+            cursor.execute(f'''
+                INSERT INTO {table} ({columns})
+                SELECT plc_id, roll_id, %s, to_timestamp(floor(extract(epoch FROM ts) / %s) * %s), key,
+                       count(num), coalesce(sum(num), 0), min(num), max(num),
+                       (array_agg(num ORDER BY ts DESC, id DESC) FILTER (WHERE num IS NOT NULL))[1],
+                       max(ts) FILTER (WHERE num IS NOT NULL),
+                       (array_agg(value ORDER BY ts DESC, id DESC))[1],
+                       max(ts), min(ts), now(), now()
+                FROM (
+                    SELECT l.id, l.plc_id, l.roll_id, l."CreationDateTime" AS ts, kv.key, kv.value,
+                           CASE WHEN kv.value ~ %s THEN kv.value::double precision END AS num
+                    FROM {logs_table} l
+                    CROSS JOIN LATERAL jsonb_each_text(l.json_data) kv
+                    WHERE l.is_running AND jsonb_typeof(l.json_data) = 'object'
+                      AND l."CreationDateTime" >= %s AND l."CreationDateTime" < %s {plc_filter}
+                ) s
+                GROUP BY 1, 2, 4, 5
+            ''', [finest, finest, finest, NUMERIC_PATTERN, start, end, *plc_params])
+            total = cursor.rowcount
+            for finer, resolution in zip(ROLLUP_RESOLUTIONS, ROLLUP_RESOLUTIONS[1:]):
+                cursor.execute(f'''
+                    INSERT INTO {table} ({columns})
+                    SELECT plc_id, roll_id, %s, to_timestamp(floor(extract(epoch FROM bucket) / %s) * %s), key,
+                           sum(count), sum(sum), min(min), max(max),
+                           (array_agg(last ORDER BY bucket DESC) FILTER (WHERE last IS NOT NULL))[1],
+                           max(last_at),
+                           (array_agg(last_value ORDER BY bucket DESC))[1],
+                           max(last_value_at), min(first_at), now(), now()
+                    FROM {table}
+                    WHERE resolution = %s AND bucket >= %s AND bucket < %s {plc_filter}
+                    GROUP BY 1, 2, 4, 5
+                ''', [resolution, resolution, resolution, finer, start, end, *plc_params])
+                total += cursor.rowcount
+        return total
+
+
+class Roll_Segments(models.Model):
+    """Consecutive run of logs of one PLC and roll in the same is_running state.
+
+    A segment ends when the next log of the PLC changes state or roll; ended_at is null while it is open.
+    """
+    plc = models.ForeignKey(PLC,on_delete=models.CASCADE,related_name="segments",null=True,blank=True)
+    roll = models.ForeignKey(Rolls,on_delete=models.CASCADE,related_name="segments")
+    is_running = models.BooleanField(default=False)
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField(null=True,blank=True)
+    CreationDateTime = models.DateTimeField(verbose_name="زمان ساخت",null=True,blank=True)
+    LastUpdate = models.DateTimeField(verbose_name="آخرین آپدیت",null=True,blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['roll', 'started_at']),
+            models.Index(fields=['is_running', 'started_at']),
+            models.Index(fields=['plc', 'started_at']),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.CreationDateTime:
+            self.CreationDateTime = timezone.now()
+        self.LastUpdate = timezone.now()
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def save_all(cls, segments):
+        existing = [segment for segment in segments if segment.pk]
+        new = [segment for segment in segments if not segment.pk]
+        if existing:
+            cls.objects.bulk_update(existing, ['ended_at', 'LastUpdate'])
+        if new:
+            cls.objects.bulk_create(new)
+
+    @classmethod
+    def rebuild(cls, plc_id):
+        """Recompute the segments of one PLC from its PLC_Logs history (gaps and islands over the log stream)"""
+        table = connection.ops.quote_name(cls._meta.db_table)
+        logs_table = connection.ops.quote_name(PLC_Logs._meta.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE plc_id = %s', [plc_id])
+            cursor.execute(f'''
+                INSERT INTO {table} (plc_id, roll_id, is_running, started_at, ended_at, "CreationDateTime", "LastUpdate")
+                SELECT %s, roll_id, state, started_at,
+                       lead(started_at) OVER (ORDER BY started_at, first_id), now(), now()
+                FROM (
+                    SELECT roll_id, state, min(ts) AS started_at, min(id) AS first_id
+                    FROM (
+                        SELECT *, count(*) FILTER (WHERE changed) OVER (ORDER BY ts, id) AS island
+                        FROM (
+                            SELECT id, roll_id, "CreationDateTime" AS ts, COALESCE(is_running, false) AS state,
+                                   (lag(roll_id) OVER w, lag(COALESCE(is_running, false)) OVER w)
+                                       IS DISTINCT FROM (roll_id, COALESCE(is_running, false)) AS changed
+                            FROM {logs_table}
+                            WHERE plc_id = %s AND roll_id IS NOT NULL AND "CreationDateTime" IS NOT NULL
+                            WINDOW w AS (ORDER BY "CreationDateTime", id)
+                        ) marked
+                    ) islands
+                    GROUP BY island, roll_id, state
+                ) segments
+            ''', [plc_id, plc_id])
+            return cursor.rowcount
+
+    @classmethod
+    def for_rolls(cls, roll_ids):
+        """(roll_id, is_running, started_at, ended_at) of the segments of the given rolls, by started_at.
+
+        Rolls without stored segments (logged before ingestion recorded them and not rebuilt since) get
+        theirs computed from PLC_Logs as rebuild() does; their last segment ends at its last log.
+        """
+        roll_ids = set(roll_ids)
+        stored = cls.objects.filter(roll_id__in=roll_ids).order_by()
+        segments = list(stored.values_list('roll_id', 'is_running', 'started_at', 'ended_at'))
+        missing = roll_ids - {roll_id for roll_id, is_running, started_at, ended_at in segments}
+        if missing:
+            logs = (
+                PLC_Logs.for_rolls(missing)
+                .filter(CreationDateTime__isnull=False)
+                .order_by()
+                .values('id', 'plc_id', 'roll_id', 'CreationDateTime', 'is_running')
+            )
+            subquery, params = logs.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'''
+                    SELECT roll_id, state, started_at,
+                           COALESCE(lead(started_at) OVER (PARTITION BY plc_id ORDER BY started_at, first_id), last_at)
+                    FROM (
+                        SELECT plc_id, roll_id, state, min(ts) AS started_at, max(ts) AS last_at, min(id) AS first_id
+                        FROM (
+                            SELECT *, count(*) FILTER (WHERE changed) OVER (PARTITION BY plc_id ORDER BY ts, id) AS island
+                            FROM (
+                                SELECT id, plc_id, roll_id, "CreationDateTime" AS ts, COALESCE(is_running, false) AS state,
+                                       (lag(roll_id) OVER w, lag(COALESCE(is_running, false)) OVER w)
+                                           IS DISTINCT FROM (roll_id, COALESCE(is_running, false)) AS changed
+                                FROM ({subquery}) l
+                                WINDOW w AS (PARTITION BY plc_id ORDER BY "CreationDateTime", id)
+                            ) marked
+                        ) islands
+                        GROUP BY plc_id, island, roll_id, state
+                    ) segments
+                ''', params)
+                segments.extend(cursor.fetchall())
+        segments.sort(key=lambda segment: segment[2])
+        return segments
+
+    @classmethod
+    def downtime(cls, start, end, plc_id=None, shift_hours=24, shift_start=0):
+        """Stopped seconds and segment count per shift in [start, end) with one query.
+
+        Shifts are shift_hours long and the first one of a day starts at shift_start o'clock local time
+        (24 and 0 give calendar days). A segment is clipped to the range and split at the shift boundaries
+        it crosses, so each shift gets its own part of the stop; it is counted in the shift it starts in.
+        An open segment runs until now.
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        plc_filter = 'AND plc_id = %(plc_id)s' if plc_id else ''
+        sql = f'''
+            SELECT shift,
+                   sum(extract(epoch FROM LEAST(stop_end, (shift + make_interval(hours => %(hours)s)) AT TIME ZONE %(tz)s)
+                                          - GREATEST(stop_start, shift AT TIME ZONE %(tz)s))),
+                   count(*) FILTER (WHERE stop_start >= shift AT TIME ZONE %(tz)s)
+            FROM (
+                SELECT stop_start, stop_end,
+                       generate_series(
+                           date_trunc('day', local - make_interval(hours => %(first)s)) + make_interval(hours => %(first)s)
+                           + make_interval(hours => (floor(extract(hour FROM local - make_interval(hours => %(first)s)) / %(hours)s) * %(hours)s)::int),
+                           stop_end AT TIME ZONE %(tz)s,
+                           make_interval(hours => %(hours)s)
+                       ) AS shift
+                FROM (
+                    SELECT stop_start, stop_end, stop_start AT TIME ZONE %(tz)s AS local
+                    FROM (
+                        SELECT GREATEST(started_at, %(start)s) AS stop_start, LEAST(COALESCE(ended_at, now()), %(end)s) AS stop_end
+                        FROM {table}
+                        WHERE is_running = false AND started_at < %(end)s AND (ended_at IS NULL OR ended_at > %(start)s) {plc_filter}
+                    ) clipped
+                    WHERE stop_end > stop_start
+                ) s
+            ) parts
+            WHERE shift AT TIME ZONE %(tz)s < stop_end
+            GROUP BY shift
+            ORDER BY shift
+        '''
+        params = {'start': start, 'end': end, 'hours': shift_hours, 'first': shift_start,
+                  'tz': timezone.get_current_timezone_name(), 'plc_id': plc_id}
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(shift, float(seconds), count) for shift, seconds, count in cursor]
+
+
+class PLC_Alerts(models.Model):
+    """Threshold alert of one key on one PLC, open from opened_at until the value is back in range (closed_at)"""
+    KIND_CHOICES = [('max', 'حداکثر'), ('min', 'حداقل')]
+    plc = models.ForeignKey(PLC,on_delete=models.CASCADE,related_name="alerts",null=True,blank=True)
+    roll = models.ForeignKey(Rolls,on_delete=models.SET_NULL,related_name="alerts",null=True,blank=True)
+    key = models.CharField(max_length=100,db_index=True)
+    kind = models.CharField(max_length=3,choices=KIND_CHOICES)
+    threshold = models.FloatField()
+    value = models.FloatField()                             # value that opened the alert
+    peak = models.FloatField()                              # furthest value past the threshold while open
+    close_value = models.FloatField(null=True,blank=True)
+    opened_at = models.DateTimeField()
+    closed_at = models.DateTimeField(null=True,blank=True)
+    CreationDateTime = models.DateTimeField(verbose_name="زمان ساخت",null=True,blank=True)
+    LastUpdate = models.DateTimeField(verbose_name="آخرین آپدیت",null=True,blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['plc', 'opened_at']),
+            models.Index(fields=['closed_at', 'plc']),
+            models.Index(fields=['LastUpdate']),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.CreationDateTime:
+            self.CreationDateTime = timezone.now()
+        self.LastUpdate = timezone.now()
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def save_all(cls, alerts):
+        existing = [alert for alert in alerts if alert.pk]
+        new = [alert for alert in alerts if not alert.pk]
+        if existing:
+            cls.objects.bulk_update(existing, ['peak', 'close_value', 'closed_at', 'LastUpdate'])
+        if new:
+            cls.objects.bulk_create(new)
+
+
+class Metadata_Version(models.Model):
+    """Change counter of the key metadata (PLC_Keys, ChartExcludedKeys, KeyAlertConfig) read by the metadata registry"""
+    name = models.CharField(max_length=50,unique=True)
+    version = models.BigIntegerField(default=0)
+    LastUpdate = models.DateTimeField(verbose_name="آخرین آپدیت",null=True,blank=True)
+
+    def save(self, *args, **kwargs):
+        self.LastUpdate = timezone.now()
+        super().save(*args, **kwargs)
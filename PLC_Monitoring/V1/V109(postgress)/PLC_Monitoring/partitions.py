@@ -0,0 +1,185 @@
+"""Monthly range partitions of PLC_Logs on CreationDateTime (Postgres only).
+
+Migration 0020 turns PLC_Logs into a partitioned table: the existing rows stay in one "legacy" partition
+that ends at the start of next month, and every later month gets its own partition, created ahead of
+time by ensure_partitions() (called by the poller and the manage_log_partitions command). A default
+partition catches rows outside the created range, so an insert never fails.
+
+Retention detaches whole months older than the kept range, archives each one to a gzip'ed CSV file
+(restorable with COPY ... FROM) and drops it; months still inside the legacy partition are archived
+and deleted row by row. Month bounds are in the local TIME_ZONE.
+
+Postgres prunes partitions for queries with CreationDateTime bounds. Queries by roll get those bounds
+from PLC_Logs.for_rolls().
+"""
+import gzip
+import os
+import re
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import PLC_Logs
+
+MONTHS_AHEAD = 3    # future months kept created
+BOUND_RE = re.compile(r"TO \('([^']+)'\)")
+
+
+def _table():
+    return PLC_Logs._meta.db_table
+
+
+def month_start(when, offset=0):
+    """Local start of the month of when, moved by offset months"""
+    local = timezone.localtime(when)
+    month = local.year * 12 + local.month - 1 + offset
+    return timezone.make_aware(datetime(month // 12, month % 12 + 1, 1))
+
+
+def partition_name(month):
+    return f"{_table()}_p{month:%Y%m}"
+
+
+def is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+            [connection.ops.quote_name(_table())],
+        )
+        return cursor.fetchone() is not None
+
+
+def partitions():
+    """[(name, upper bound or None for the default partition)] of the attached partitions"""
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+        ''', [connection.ops.quote_name(_table())])
+        rows = cursor.fetchall()
+    result = []
+    for name, bound in rows:
+        match = BOUND_RE.search(bound)
+        result.append((name, datetime.fromisoformat(match.group(1)) if match else None))
+    return sorted(result, key=lambda item: (item[1] is None, item[1]))
+
+
+def ensure_partitions(months_ahead=MONTHS_AHEAD):
+    """Create the monthly partitions up to months_ahead months after the current one, returns their names"""
+    if not is_partitioned():
+        return []
+    existing = partitions()
+    uppers = [upper for name, upper in existing if upper is not None]
+    month = max(uppers) if uppers else month_start(timezone.now())
+    last = month_start(timezone.now(), months_ahead + 1)
+    created = []
+    quote = connection.ops.quote_name
+    while month < last:
+        following = month_start(month, 1)
+        name = partition_name(timezone.localtime(month))
+        # rows already in the default partition for this month move with the attach
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'CREATE TABLE {quote(name)} (LIKE {quote(_table())} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+            cursor.execute(
+                f'''INSERT INTO {quote(name)} SELECT * FROM {quote(_table() + "_default")}
+                    WHERE "CreationDateTime" >= %s AND "CreationDateTime" < %s''',
+                [month, following],
+            )
+            cursor.execute(
+                f'''DELETE FROM {quote(_table() + "_default")}
+                    WHERE "CreationDateTime" >= %s AND "CreationDateTime" < %s''',
+                [month, following],
+            )
+            cursor.execute(
+                f'ALTER TABLE {quote(_table())} ATTACH PARTITION {quote(name)} FOR VALUES FROM (%s) TO (%s)',
+                [month, following],
+            )
+        created.append(name)
+        month = following
+    return created
+
+
+def archive_partitions(keep_months, archive_dir):
+    """Archive to archive_dir/<table>_pYYYYMM.csv.gz and remove every month before the kept ones (the
+    current month counts as one); returns the archive paths.
+
+    Monthly partitions are detached, copied out and dropped. Months still inside the legacy partition
+    are copied out and deleted from it row-wise.
+    """
+    if not is_partitioned():
+        return []
+    cutoff = month_start(timezone.now(), 1 - keep_months)
+    quote = connection.ops.quote_name
+    legacy = f"{_table()}_legacy"
+    os.makedirs(archive_dir, exist_ok=True)
+    archived = []
+    for name, upper in partitions():
+        if name == legacy:
+            archived += _archive_legacy_months(legacy, min(upper, cutoff), archive_dir)
+            if upper <= cutoff:
+                # every row of it is archived now
+                with connection.cursor() as cursor:
+                    cursor.execute(f'ALTER TABLE {quote(_table())} DETACH PARTITION {quote(name)}')
+                    cursor.execute(f'DROP TABLE {quote(name)}')
+            continue
+        if upper is None or upper > cutoff:
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {quote(_table())} DETACH PARTITION {quote(name)}')
+        archived.append(_archive(name, archive_dir))
+    # partitions detached by an earlier run that failed before dropping them
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            SELECT c.relname FROM pg_class c
+            WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace
+              AND c.relname LIKE %s AND NOT c.relispartition
+        ''', [f"{_table()}\\_p%"])
+        leftovers = [row[0] for row in cursor.fetchall()]
+    archived += [_archive(name, archive_dir) for name in leftovers]
+    return archived
+
+
+def _copy(sql, path):
+    partial = path + ".part"
+    with gzip.open(partial, "wb") as output, connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)", output)
+    os.replace(partial, path)
+
+
+def _archive(name, archive_dir):
+    quote = connection.ops.quote_name
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    _copy(f"SELECT * FROM {quote(name)}", path)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE {quote(name)}')
+    return path
+
+
+def _archive_legacy_months(legacy, cutoff, archive_dir):
+    """Copy out and delete the rows of the legacy partition before cutoff, one month per file"""
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT min("CreationDateTime") FROM {quote(legacy)}')
+        oldest = cursor.fetchone()[0]
+    paths = []
+    month = month_start(oldest) if oldest else cutoff
+    while month < cutoff:
+        following = month_start(month, 1)
+        path = os.path.join(archive_dir, f"{partition_name(timezone.localtime(month))}.csv.gz")
+        with transaction.atomic(), connection.cursor() as cursor:
+            rows = cursor.mogrify(
+                f'SELECT * FROM {quote(legacy)} WHERE "CreationDateTime" >= %s AND "CreationDateTime" < %s',
+                [month, following],
+            ).decode()
+            _copy(rows, path)
+            cursor.execute(
+                f'DELETE FROM {quote(legacy)} WHERE "CreationDateTime" >= %s AND "CreationDateTime" < %s',
+                [month, following],
+            )
+        paths.append(path)
+        month = following
+    return paths
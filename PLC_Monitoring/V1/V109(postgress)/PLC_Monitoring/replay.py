@@ -0,0 +1,267 @@
+"""Record and replay of raw PLC traffic, and the ingestion benchmark built on it.
+
+A recording is a JSON-lines file: one header line {"format": "plc-frames", "version": 1, "mode": ...}
+then one line per chunk {"t": seconds since start, "conn": connection number, "dir": "request" or
+"response", "data": bytes as latin-1 text}. latin-1 keeps any byte exact, so binary register frames
+survive while "n=...;k=v" responses stay readable.
+
+mode "poll": the PLC is the server and answers the poller's requests (plc_poller.py).
+mode "push": the PLC is the client and pushes binary register frames to us (the V2 tcp_server.py, port 2000).
+"""
+import asyncio
+import io
+import json
+import time
+from contextlib import redirect_stdout
+
+FORMAT = "plc-frames"
+VERSION = 1
+READ_SIZE = 1024  # as PLCConnection.exchange and tcp_server.py read
+BENCH_ROLL_OFFSET = 1000000  # roll numbers of benchmark line i are the recorded ones + i * BENCH_ROLL_OFFSET
+
+
+class Recording:
+    def __init__(self, mode="poll", records=None):
+        self.mode = mode
+        self.records = records or []
+
+    def add(self, t, conn, direction, data):
+        self.records.append({"t": round(t, 6), "conn": conn, "dir": direction, "data": data.decode("latin-1")})
+
+    def frames(self, direction):
+        """[(t, conn, bytes)] of one direction in recording order"""
+        return [(r["t"], r["conn"], r["data"].encode("latin-1")) for r in self.records if r["dir"] == direction]
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as output:
+            output.write(json.dumps({"format": FORMAT, "version": VERSION, "mode": self.mode}) + "\n")
+            for record in self.records:
+                output.write(json.dumps(record) + "\n")
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as source:
+            header = json.loads(source.readline())
+            if header.get("format") != FORMAT:
+                raise ValueError(f"{path} is not a PLC frame recording")
+            return cls(header.get("mode", "poll"), [json.loads(line) for line in source if line.strip()])
+
+    @classmethod
+    def from_logs(cls, logs):
+        """Poll recording of the raw responses stored in a PLC_Logs queryset, timed by CreationDateTime"""
+        recording = cls("poll")
+        start = None
+        for data, created in logs.order_by("CreationDateTime", "id").values_list("data", "CreationDateTime").iterator():
+            start = start or created
+            t = (created - start).total_seconds()
+            recording.add(t, 0, "request", b"")
+            recording.add(t, 0, "response", data.encode("utf-8"))
+        return recording
+
+
+async def record_proxy(listen_host, listen_port, upstream_host, upstream_port, recording):
+    """TCP proxy that forwards every connection to the upstream and records both directions.
+
+    Put it between plc_poller.py and a PLC (mode "poll") or between a PLC and tcp_server.py (mode "push").
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    connections = 0
+
+    async def pipe(reader, writer, conn, direction):
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                recording.add(loop.time() - started, conn, direction, data)
+                writer.write(data)
+                await writer.drain()
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle(client_reader, client_writer):
+        nonlocal connections
+        connections += 1
+        conn = connections
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(upstream_host, upstream_port)
+        except OSError as e:
+            print(f"Upstream {upstream_host}:{upstream_port} unreachable: {e}")
+            client_writer.close()
+            return
+        await asyncio.gather(
+            pipe(client_reader, upstream_writer, conn, "request"),
+            pipe(upstream_reader, client_writer, conn, "response"),
+        )
+
+    server = await asyncio.start_server(handle, listen_host, listen_port)
+    async with server:
+        await server.serve_forever()
+
+
+class ResponsePlayer:
+    """Recorded responses in playback order.
+
+    speed > 0 answers with the response that was current at (elapsed wall time * speed) of the recording,
+    the way a PLC holding that state would; speed 0 answers every request with the next response.
+    """
+
+    def __init__(self, recording, speed=1.0, loop=True):
+        self.responses = recording.frames("response")
+        if not self.responses:
+            raise ValueError("the recording has no responses")
+        self.speed = speed
+        self.loop = loop
+        self.position = 0
+        self.started = None
+
+    def next(self):
+        if self.speed > 0:
+            now = time.monotonic()
+            self.started = self.started or now
+            elapsed = (now - self.started) * self.speed
+            duration = self.responses[-1][0] or 1
+            if self.loop:
+                elapsed %= duration
+            while self.position + 1 < len(self.responses) and self.responses[self.position + 1][0] <= elapsed:
+                self.position += 1
+            return self.responses[self.position][2]
+        response = self.responses[self.position][2]
+        self.position += 1
+        if self.position == len(self.responses):
+            self.position = 0 if self.loop else self.position - 1
+        return response
+
+
+async def serve_recording(recording, host, port, speed=1.0):
+    """Fake PLC for plc_poller.py: answers each request on any connection from the recording"""
+    player = ResponsePlayer(recording, speed)
+
+    async def handle(reader, writer):
+        try:
+            while await reader.read(READ_SIZE):
+                writer.write(player.next())
+                await writer.drain()
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+async def push_recording(recording, host, port, speed=1.0):
+    """Fake PLC for tcp_server.py: replays every recorded connection and its frames at speed
+    (0 = as fast as possible), returns the number of frames sent"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    connections = {}
+    for t, conn, data in recording.frames("request"):
+        connections.setdefault(conn, []).append((t, data))
+    sent = 0
+    for frames in connections.values():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for t, data in frames:
+                if speed > 0:
+                    await asyncio.sleep(max(0, started + t / speed - loop.time()))
+                writer.write(data)
+                await writer.drain()
+                sent += 1
+            await reader.read(READ_SIZE)
+        finally:
+            writer.close()
+    return sent
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def line_frame(response, device_id, roll_offset):
+    """Copy of a recorded response as sent by another PLC: "n" set to device_id, "cr" moved by roll_offset"""
+    if not response.startswith(b"n="):
+        return response
+    items = []
+    for item in response.split(b";"):
+        key, _, value = item.partition(b"=")
+        if key == b"n":
+            item = b"n=" + device_id.encode()
+        elif key == b"cr" and roll_offset and value.strip().isdigit():
+            item = b"cr=%d" % (int(value) + roll_offset)
+        items.append(item)
+    return b";".join(items)
+
+
+def run_benchmark(recording, lines=1, speed=0, flush_interval=0, limit=None):
+    """Feed the recorded responses through the ingestion path (PLCLine + handle_response) of the current
+    database and return the throughput, tick latency and query statistics.
+
+    Each of the lines gets its own PLC row ("bench-<line>") and its own copy of the responses, naming
+    that row and rolls of its own (roll numbers moved by BENCH_ROLL_OFFSET per line).
+    """
+    from django.db import connection
+    from .models import PLC
+    from .ingestion import PLCLine, handle_response
+    from .metrics import metrics
+
+    responses = [data for t, conn, data in recording.frames("response")][:limit]
+    times = [t for t, conn, data in recording.frames("response")][:limit]
+    plc_lines = []
+    for index in range(lines):
+        plc = PLC.objects.create(device_id=f"bench-{index}")
+        frames = [line_frame(response, plc.device_id, index * BENCH_ROLL_OFFSET) for response in responses]
+        plc_lines.append((PLCLine(plc, flush_interval).hydrate(), frames))
+
+    queries = [0]
+
+    def count_queries(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    metrics.reset()
+    latencies = []
+    tick_queries = []
+    sink = io.StringIO()
+    started = time.perf_counter()
+    with connection.execute_wrapper(count_queries), redirect_stdout(sink):
+        for tick, t in enumerate(times):
+            if speed > 0:
+                time.sleep(max(0, started + t / speed - time.perf_counter()))
+            for line, frames in plc_lines:
+                frame = frames[tick]
+                before = queries[0]
+                tick_started = time.perf_counter()
+                handle_response(line, frame)
+                latencies.append(time.perf_counter() - tick_started)
+                tick_queries.append(queries[0] - before)
+            sink.seek(0)
+            sink.truncate()
+        for line, frames in plc_lines:
+            if line.writer.pending():
+                with metrics.timer("db", line.device_id):
+                    line.writer.flush()
+    elapsed = time.perf_counter() - started
+
+    ticks = len(latencies)
+    return {
+        "ticks": ticks,
+        "lines": lines,
+        "seconds": elapsed,
+        "samples_per_second": ticks / elapsed if elapsed else 0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies, default=0) * 1000,
+        "queries_per_tick": sum(tick_queries) / ticks if ticks else 0,
+        "max_queries_per_tick": max(tick_queries, default=0),
+        # stage -> mean ms per tick
+        "stages": {stage: seconds * 1000 / ticks for stage, (count, seconds) in metrics.stage_totals().items()} if ticks else {},
+    }
@@ -1,15 +1,13 @@
 from django import template
-from PLC_Monitoring.models import PLC_Keys
+from PLC_Monitoring.metadata import registry
 
 register = template.Library()
 
 @register.filter
 def get_key_name(key):
-    """Get fa_name or name from PLC_Keys by key, fallback to key itself"""
+    """Get fa_name or name from PLC_Keys by key, fallback to key itself (from the metadata registry, no query)"""
     try:
-        plc_key = PLC_Keys.objects.filter(key=key).first()
-        if plc_key:
-            return plc_key.fa_name or plc_key.name or key
+        return registry.current().translate(key)
     except:
         pass
     return key
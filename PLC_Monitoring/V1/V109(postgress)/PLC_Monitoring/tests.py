@@ -1,3 +1,627 @@
-from django.test import TestCase
+import asyncio
+import json
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from .charts import build_chart_series, build_stopped_ranges, downsample, parse_downsampling, roll_buckets
+from .events import LOGS_CHANNEL, SETTINGS_CHANNEL, EventHub, Subscription
+from .exports import FILE_CHUNK_SIZE, xlsx_chunks
+from .ingestion import PLCLine, handle_response
+from .metadata import registry
+from .metrics import metrics, serve_metrics
+from .replay import Recording, run_benchmark
+from .models import ChartExcludedKeys, KeyAlertConfig, PLC, PLC_Alerts, PLC_Keys, PLC_Logs, PLC_Rollups, RollKeyAggregate, Roll_Segments, Rolls
+
+
+class LineTestCase(TestCase):
+    """One PLC line; the key metadata cached by an earlier, rolled back test is dropped"""
+
+    def setUp(self):
+        registry.invalidate()
+        self.plc = PLC.objects.create(device_id="PM9")
+        self.line = PLCLine(self.plc).hydrate()
+
+
+class PollerTests(TestCase):
+
+    def test_configure_poller_line_preset_and_overrides(self):
+        from plc_poller import LineConfig
+
+        call_command("configure_poller_line", "PM4", "--preset", "pm4", "--interval", "0.5", stdout=StringIO())
+        config = LineConfig(PLC.objects.get(device_id="PM4"))
+        self.assertEqual((config.host, config.port, config.interval, config.enabled), ("172.16.1.40", 8000, 0.5, True))
+        self.assertEqual(config.payload(21.456), "t21.46")
+
+        call_command("configure_poller_line", "PM4", "--payload-format", "t{rounded}.0", "--disable", stdout=StringIO())
+        config = LineConfig(PLC.objects.get(device_id="PM4"))
+        self.assertEqual(config.payload(21.5), "t22.0")
+        self.assertEqual(config.thermal_api_url, "http://192.168.2.22:6002/view/api/plc_data/")
+        self.assertFalse(config.enabled)
+
+    def test_connection_is_reopened_once_when_the_plc_dropped_it(self):
+        from plc_poller import PLCConnection
+
+        async def exchange():
+            async def answer_once(reader, writer):
+                request = await reader.read(1024)
+                writer.write(b"n=PM4;echo=" + request)
+                await writer.drain()
+                writer.close()
+
+            server = await asyncio.start_server(answer_once, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            connection = PLCConnection("127.0.0.1", port, timeout=2)
+            try:
+                return [await connection.send("t21.0"), await connection.send("t22.0")]
+            finally:
+                await connection.close()
+                server.close()
+                await server.wait_closed()
+
+        self.assertEqual(asyncio.run(exchange()), [b"n=PM4;echo=t21.0", b"n=PM4;echo=t22.0"])
+
+
+class LastStateTests(LineTestCase):
+
+    def test_repeated_response_only_touches_the_last_log(self):
+        handle_response(self.line, b"n=PM9;cr=5;ru=1;sp=100")
+        first = PLC_Logs.objects.get(plc=self.plc)
+        handle_response(self.line, b"n=PM9;cr=5;ru=1;sp=100")
+        # a sample whose items all equal the last stored ones is not stored either
+        handle_response(self.line, b"n=PM9;sp=100")
+
+        self.assertEqual(PLC_Logs.objects.filter(plc=self.plc).count(), 1)
+        self.assertGreater(PLC_Logs.objects.get(plc=self.plc).LastUpdate, first.LastUpdate)
+
+    def test_restarted_line_continues_from_the_database(self):
+        handle_response(self.line, b"n=PM9;cr=5;ru=1;sp=100;b=1")
+        restarted = PLCLine(self.plc).hydrate()
+
+        self.assertEqual((restarted.roll_obj.roll_number, restarted.is_running, restarted.last_break), (5, True, 1))
+        handle_response(restarted, b"n=PM9;cr=5;ru=1;sp=100;b=1")
+        handle_response(restarted, b"n=PM9;cr=5;ru=1;sp=120;b=1")
+
+        self.assertEqual(PLC_Logs.objects.filter(plc=self.plc).count(), 2)
+        roll = Rolls.objects.get(roll_number=5)
+        self.assertEqual(roll.Paper_breaks, 1)
+        self.assertEqual(Roll_Segments.objects.filter(roll=roll).count(), 1)
+        self.assertEqual(RollKeyAggregate.objects.get(roll=roll, key="sp").count, 2)
+
+
+class WriteBehindTests(LineTestCase):
+
+    def test_ticks_are_written_together_at_the_flush(self):
+        line = PLCLine(self.plc, flush_interval=3600).hydrate()
+        for speed in (100, 110, 120):
+            handle_response(line, f"n=PM9;cr=5;ru=1;sp={speed}".encode())
+        self.assertFalse(PLC_Logs.objects.filter(plc=self.plc).exists())
+        self.assertTrue(line.writer.pending())
+
+        line.writer.flush()
+
+        self.assertFalse(line.writer.pending())
+        self.assertEqual(list(PLC_Logs.objects.filter(plc=self.plc).order_by("id").values_list("json_data__sp", flat=True)),
+                         ["100", "110", "120"])
+        self.plc.refresh_from_db()
+        self.assertEqual(self.plc.setting["sp"], "120")
+        self.assertEqual(Rolls.objects.get(roll_number=5).plc_setting["sp"], "120")
+
+
+class FailedFlushTests(LineTestCase):
+
+    def test_line_is_hydrated_again_after_a_failed_flush(self):
+        handle_response(self.line, b"n=PM9;cr=7;ru=1;sp=100")
+
+        # the stop sample opens a new segment in the flush that fails
+        with mock.patch.object(Roll_Segments, "save_all", side_effect=DatabaseError("lost connection")):
+            with self.assertRaises(DatabaseError):
+                handle_response(self.line, b"n=PM9;cr=7;ru=0;sp=110")
+        self.assertFalse(self.line.hydrated)
+        self.assertEqual(PLC_Logs.objects.filter(plc=self.plc).count(), 1)
+
+        handle_response(self.line, b"n=PM9;cr=7;ru=0;sp=120")
+        handle_response(self.line, b"n=PM9;cr=7;ru=1;sp=130")
+
+        self.assertEqual(PLC_Logs.objects.filter(plc=self.plc).count(), 3)
+        aggregate = RollKeyAggregate.objects.get(roll__roll_number=7, key="sp")
+        self.assertEqual((aggregate.count, aggregate.sum, aggregate.last), (3, 350, 130))
+        segments = list(Roll_Segments.objects.filter(plc=self.plc).order_by("started_at").values_list("is_running", "ended_at"))
+        self.assertEqual([is_running for is_running, ended_at in segments], [True, False, True])
+        self.assertTrue(all(ended_at is not None for is_running, ended_at in segments[:2]))
+        self.assertIsNone(segments[2][1])
+
+
+class RollLogsTests(LineTestCase):
+
+    def test_first_log_of_a_roll_is_not_older_than_the_roll(self):
+        handle_response(self.line, b"n=PM9;cr=5;ru=1;sp=100")
+        handle_response(self.line, b"n=PM9;cr=5;ru=1;sp=200")
+        roll = Rolls.objects.get(roll_number=5)
+        first = PLC_Logs.objects.filter(roll=roll).order_by("CreationDateTime").first()
+        self.assertLessEqual(roll.CreationDateTime, first.CreationDateTime)
+        self.assertEqual(PLC_Logs.for_rolls([roll.id]).count(), 2)
+
+    def test_rolls_created_after_their_first_log_keep_it(self):
+        handle_response(self.line, b"n=PM9;cr=5;ru=1;sp=100")
+        handle_response(self.line, b"n=PM9;cr=5;ru=1;sp=200")
+        roll = Rolls.objects.get(roll_number=5)
+        first = PLC_Logs.objects.filter(roll=roll).order_by("CreationDateTime").first()
+        Rolls.objects.filter(id=roll.id).update(CreationDateTime=first.CreationDateTime + timedelta(milliseconds=5))
+
+        self.assertEqual(PLC_Logs.for_rolls([roll.id]).count(), 2)
+        RollKeyAggregate.rebuild(roll)
+        self.assertEqual(RollKeyAggregate.objects.get(roll=roll, key="sp").count, 2)
+
+
+class RebuildAggregatesTests(LineTestCase):
+    def test_unpacked_logs_are_read_from_json_data(self):
+        for speed in (100, 200, 300):
+            handle_response(self.line, f"n=PM9;cr=5;ru=1;sp={speed};note=x".encode())
+        roll = Rolls.objects.get(roll_number=5)
+        expected = {a.key: (a.count, a.sum, a.min, a.max, a.last) for a in RollKeyAggregate.objects.filter(roll=roll)}
+        # the first log as written before the typed values existed
+        first = PLC_Logs.objects.filter(roll=roll).order_by("CreationDateTime").first()
+        PLC_Logs.objects.filter(id=first.id).update(key_ids=None, key_values=None)
+
+        RollKeyAggregate.rebuild(roll)
+        rebuilt = {a.key: (a.count, a.sum, a.min, a.max, a.last) for a in RollKeyAggregate.objects.filter(roll=roll)}
+        self.assertEqual(rebuilt, expected)
+        self.assertEqual(rebuilt["sp"], (3, 600, 100, 300, 300))
+
+
+class SharedRollTests(LineTestCase):
+    def test_lines_on_the_same_roll_number_add_up(self):
+        other = PLCLine(PLC.objects.create(device_id="PM8")).hydrate()
+        handle_response(self.line, b"n=PM9;cr=5;ru=1;sp=100")
+        handle_response(other, b"n=PM8;cr=5;ru=1;sp=10")
+        handle_response(self.line, b"n=PM9;cr=5;ru=1;sp=300")
+        handle_response(other, b"n=PM8;cr=5;ru=1;sp=20")
+
+        aggregate = RollKeyAggregate.objects.get(roll__roll_number=5, key="sp")
+        self.assertEqual((aggregate.count, aggregate.sum, aggregate.min, aggregate.max, aggregate.last), (4, 430, 10, 300, 20))
+        self.assertEqual(other.aggregates["sp"].count, 4)
+
+    def test_switching_back_to_a_roll_within_one_flush(self):
+        line = PLCLine(self.plc, flush_interval=3600).hydrate()
+        for response in (b"n=PM9;cr=5;ru=1;sp=100", b"n=PM9;cr=6;ru=1;sp=200", b"n=PM9;cr=5;ru=1;sp=300"):
+            handle_response(line, response)
+        line.writer.flush()
+
+        aggregate = RollKeyAggregate.objects.get(roll__roll_number=5, key="sp")
+        self.assertEqual((aggregate.count, aggregate.sum, aggregate.last), (2, 400, 300))
+
+
+class MetadataSignalTests(TestCase):
+    """Saves and deletes outside the custom views (admin, shell) reload the metadata snapshot"""
+
+    def setUp(self):
+        registry.invalidate()
+
+    def test_saves_and_deletes_bump_the_version(self):
+        plc_key = PLC_Keys.objects.create(key="sp", fa_name="سرعت")
+        snapshot = registry.current()
+        self.assertEqual(snapshot.translate("sp"), "سرعت")
+
+        plc_key.fa_name = "سرعت خط"
+        plc_key.save()
+        self.assertEqual(registry.current().translate("sp"), "سرعت خط")
+
+        excluded = ChartExcludedKeys.objects.create(key="sp")
+        self.assertIn("sp", registry.current().excluded)
+        excluded.delete()
+        self.assertNotIn("sp", registry.current().excluded)
+
+        KeyAlertConfig.objects.create(key="sp", max_value=200)
+        self.assertEqual(registry.current().alert_configs["sp"]["max_value"], 200)
+        self.assertGreater(registry.current().version, snapshot.version)
+
+
+class RollupTests(LineTestCase):
+
+    def rollups(self):
+        return {
+            (r.resolution, r.bucket, r.key): (r.count, r.sum, r.min, r.max, r.last, r.last_value, r.first_at, r.last_at)
+            for r in PLC_Rollups.objects.filter(plc=self.plc)
+        }
+
+    def test_ingestion_folds_what_a_rebuild_computes(self):
+        for response in (b"n=PM9;cr=5;ru=1;sp=100;mode=a", b"n=PM9;cr=5;ru=1;sp=90;mode=b",
+                         b"n=PM9;cr=5;ru=0;sp=0", b"n=PM9;cr=5;ru=1;sp=120"):
+            handle_response(self.line, response)
+        folded = self.rollups()
+        daily = [value for (resolution, bucket, key), value in folded.items() if resolution == 86400 and key == "sp"]
+        self.assertEqual([value[:5] for value in daily], [(3, 310, 90, 120, 120)])
+
+        day = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        PLC_Rollups.rebuild(day - timedelta(days=1), day + timedelta(days=1), self.plc.id)
+        self.assertEqual(self.rollups(), folded)
+
+
+class ChartBucketTests(LineTestCase):
+
+    def test_last_value_of_each_bucket_below_one_minute(self):
+        for speed in (100, 110, 120, 130, 140):
+            handle_response(self.line, f"n=PM9;cr=5;ru=1;sp={speed};x=a".encode())
+        handle_response(self.line, b"n=PM9;cr=5;ru=0;sp=0")
+        roll = Rolls.objects.get(roll_number=5)
+        start = roll.CreationDateTime.replace(second=0, microsecond=0)
+        logs = PLC_Logs.objects.filter(roll=roll).order_by("id")
+        for log, seconds in zip(logs, (0, 10, 29, 31, 95, 96)):
+            PLC_Logs.objects.filter(id=log.id).update(CreationDateTime=start + timedelta(seconds=seconds))
+
+        base = int(start.timestamp()) * 1000
+        buckets = roll_buckets([roll.id], 30, excluded_keys=["cr", "ru"])
+        # stopped logs and non-numeric values are left out
+        self.assertEqual(buckets, {"sp": [(base, 120), (base + 30000, 130), (base + 90000, 140)]})
+
+
+class DowntimeTests(LineTestCase):
+
+    def test_stop_is_split_at_the_shift_boundary(self):
+        roll = Rolls.objects.create(plc=self.plc, roll_number=5)
+        local = lambda hour, minute=0: timezone.make_aware(datetime(2026, 1, 5, hour, minute))
+        for is_running, started_at, ended_at in [(True, local(6), local(13)), (False, local(13), local(15)),
+                                                 (True, local(15), local(16)), (False, local(16), local(16, 30))]:
+            Roll_Segments.objects.create(plc=self.plc, roll=roll, is_running=is_running, started_at=started_at, ended_at=ended_at)
+
+        shifts = Roll_Segments.downtime(local(0), local(23), self.plc.id, shift_hours=8, shift_start=6)
+
+        self.assertEqual(shifts, [(datetime(2026, 1, 5, 6), 3600.0, 1), (datetime(2026, 1, 5, 14), 5400.0, 1)])
+
+    def test_rebuild_matches_the_segments_recorded_at_ingestion(self):
+        for response in ("cr=5;ru=1;sp=100", "cr=5;ru=0;sp=0", "cr=5;ru=1;sp=90", "cr=6;ru=1;sp=110", "cr=6;ru=0;sp=0"):
+            handle_response(self.line, f"n=PM9;{response}".encode())
+        segments = lambda: list(Roll_Segments.objects.filter(plc=self.plc).order_by("started_at")
+                                .values_list("roll__roll_number", "is_running", "started_at", "ended_at"))
+        ingested = segments()
+
+        Roll_Segments.rebuild(self.plc.id)
+
+        self.assertEqual(len(ingested), 5)
+        self.assertEqual(segments(), ingested)
+
+
+class AlertTests(LineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        KeyAlertConfig.objects.create(key="t1", max_value=100)
+
+    def feed(self, line, *values):
+        for value in values:
+            handle_response(line, f"n=PM9;cr=5;ru=1;t1={value}".encode())
+
+    def test_alert_is_debounced_and_closes_past_the_hysteresis_band(self):
+        # a single sample past the threshold does not open an alert
+        self.feed(self.line, 101, 99, 105, 110, 120)
+        alert = PLC_Alerts.objects.get()
+        self.assertEqual((alert.kind, alert.threshold, alert.value, alert.peak, alert.closed_at), ("max", 100, 110, 120, None))
+        self.assertEqual(alert.opened_at, PLC_Logs.objects.get(json_data__t1="110").CreationDateTime)
+
+        # 99 is back under the threshold but not by the 2% band
+        self.feed(self.line, 99, 97, 96)
+        alert.refresh_from_db()
+        self.assertEqual((alert.close_value, alert.closed_at), (96, PLC_Logs.objects.get(json_data__t1="96").CreationDateTime))
+        self.assertEqual(PLC_Alerts.objects.count(), 1)
+
+    def test_restarted_line_closes_the_open_alert(self):
+        self.feed(self.line, 105, 110)
+        restarted = PLCLine(self.plc).hydrate()
+        self.feed(restarted, 90, 91)
+
+        alert = PLC_Alerts.objects.get()
+        self.assertEqual((alert.value, alert.close_value), (110, 91))
+
+
+class RollChangesTests(TestCase):
+
+    def setUp(self):
+        registry.invalidate()
+        self.changed = timezone.now() - timedelta(minutes=10)
+        self.rolls = [Rolls.objects.create(roll_number=number) for number in (1, 2, 3)]
+        for roll, seconds in zip(self.rolls, (0, 0, 1)):
+            self.touch(roll, seconds)
+
+    def touch(self, roll, seconds):
+        Rolls.objects.filter(id=roll.id).update(LastUpdate=self.changed + timedelta(seconds=seconds))
+
+    def page(self, cursor, **params):
+        return self.client.get(reverse("roll_detail_api"), {"cursor": cursor, **params})
+
+    def test_pages_follow_the_cursor_and_pick_up_later_changes(self):
+        first = self.page("", limit=1).json()
+        self.assertEqual(([roll["roll_number"] for roll in first["data"]], first["has_more"]), ([1], True))
+        self.assertIn("plc_keys", first)
+
+        cursor, numbers = first["next_cursor"], []
+        while True:
+            page = self.page(cursor, limit=1, keys_version=first["keys_version"]).json()
+            self.assertNotIn("plc_keys", page)
+            numbers += [roll["roll_number"] for roll in page["data"]]
+            cursor = page["next_cursor"]
+            if not page["has_more"]:
+                break
+        self.assertEqual(numbers, [2, 3])
+
+        self.touch(self.rolls[0], 2)
+        self.assertEqual([roll["roll_number"] for roll in self.page(cursor).json()["data"]], [1])
+
+    def test_unchanged_page_is_not_sent_again(self):
+        keys_version = str(registry.current().version)
+        etag = self.page("", keys_version=keys_version)["ETag"]
+
+        response = self.client.get(reverse("roll_detail_api"), {"cursor": "", "keys_version": keys_version},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.touch(self.rolls[0], 2)
+        response = self.client.get(reverse("roll_detail_api"), {"cursor": "", "keys_version": keys_version},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+# dispatch() would drop the test transaction's connection
+@mock.patch("PLC_Monitoring.events.close_old_connections")
+class LiveStreamTests(LineTestCase):
+
+    def subscribe(self, hub, channel, key=None):
+        # without the listener thread, dispatch() is called by the test
+        subscription = Subscription(channel, key)
+        hub.subscribers.add(subscription)
+        return subscription
+
+    def messages(self, subscription):
+        messages = []
+        while not subscription.queue.empty():
+            messages.append(subscription.queue.get_nowait())
+        return messages
+
+    def test_new_logs_and_settings_reach_their_subscribers(self, close_old_connections):
+        hub = EventHub()
+        hub.last_log_id = 0
+        logs = self.subscribe(hub, LOGS_CHANNEL)
+        this_plc = self.subscribe(hub, SETTINGS_CHANNEL, str(self.plc.id))
+        other_plc = self.subscribe(hub, SETTINGS_CHANNEL, str(self.plc.id + 1))
+        handle_response(self.line, b"n=PM9;cr=5;ru=1;sp=100")
+        handle_response(self.line, b"n=PM9;cr=5;ru=1;sp=110")
+
+        hub.dispatch({LOGS_CHANNEL: [{"new": None}], SETTINGS_CHANNEL: [{"plc": self.plc.id}]})
+
+        [message] = self.messages(logs)
+        self.assertEqual([log["json_data"]["sp"] for log in json.loads(message[len("data: "):])], ["100", "110"])
+        [message] = self.messages(this_plc)
+        self.assertEqual(json.loads(message[len("data: "):])["setting"]["sp"], "110")
+        self.assertEqual(self.messages(other_plc), [])
+
+    def test_slow_client_keeps_the_newest_messages(self, close_old_connections):
+        subscription = Subscription(LOGS_CHANNEL)
+        for index in range(150):
+            subscription.deliver(index)
+        self.assertEqual(self.messages(subscription), list(range(50, 150)))
+
+
+class NotifyTests(TransactionTestCase):
+
+    def test_flush_notifies_the_new_log_when_it_commits(self):
+        registry.invalidate()
+        listener = connection.get_new_connection(connection.get_connection_params())
+        listener.autocommit = True
+        try:
+            with listener.cursor() as cursor:
+                cursor.execute(f"LISTEN {LOGS_CHANNEL}")
+            plc = PLC.objects.create(device_id="PM9")
+            handle_response(PLCLine(plc).hydrate(), b"n=PM9;cr=5;ru=1;sp=100")
+
+            listener.poll()
+            payloads = [json.loads(notification.payload) for notification in listener.notifies]
+        finally:
+            listener.close()
+            registry.invalidate()
+        self.assertEqual(payloads, [{"new": PLC_Logs.objects.get().id}])
+
+
+def reference_lttb(x, y, max_points):
+    """Point by point LTTB over the same buckets as lttb_indices"""
+    edges = np.linspace(1, len(y) - 1, max_points - 1).astype(np.int64)
+    buckets = [range(start, end) for start, end in zip(edges[:-1], edges[1:])]
+    chosen = [0]
+    for number, bucket in enumerate(buckets):
+        if number + 1 < len(buckets):
+            following = buckets[number + 1]
+            next_x, next_y = np.mean(x[following.start:following.stop]), np.mean(y[following.start:following.stop])
+        else:
+            next_x, next_y = x[-1], y[-1]
+        a = chosen[-1]
+        areas = [abs((x[a] - next_x) * (y[i] - y[a]) - (x[a] - x[i]) * (next_y - y[a])) for i in bucket]
+        chosen.append(bucket[int(np.argmax(areas))])
+    return chosen + [len(y) - 1]
+
+
+class DownsampleTests(SimpleTestCase):
+
+    def setUp(self):
+        random = np.random.default_rng(7)
+        self.x = np.arange(1000, dtype=np.float64) * 1000
+        self.y = random.normal(100, 5, 1000)
+        self.y[437] = 400
+
+    def test_lttb_matches_the_point_by_point_algorithm(self):
+        keep = downsample(self.x, self.y, 50)
+
+        self.assertEqual(keep.tolist(), reference_lttb(self.x, self.y, 50))
+        self.assertIn(437, keep)
+
+    def test_minmax_keeps_the_envelope(self):
+        keep = downsample(self.x, self.y, 50, "minmax")
+
+        self.assertLessEqual(len(keep), 50)
+        self.assertEqual((keep[0], keep[-1]), (0, 999))
+        self.assertIn(int(self.y.argmin()), keep)
+        self.assertIn(437, keep)
+
+    def test_short_series_is_kept_whole(self):
+        self.assertEqual(downsample(self.x[:20], self.y[:20], 50).tolist(), list(range(20)))
+
+    def test_series_are_sent_as_parallel_arrays(self):
+        points = list(zip(self.x.astype(int).tolist(), self.y.tolist()))
+        [series] = build_chart_series({"sp": points}, {"sp": "سرعت"}, {}, max_points=50)
+
+        self.assertEqual((len(series["x"]), len(series["y"]), series["fa_name"]), (50, 50, "سرعت"))
+        self.assertNotIn("data", series)
+
+    def test_parse_downsampling(self):
+        self.assertEqual(parse_downsampling({}), (None, "lttb"))
+        self.assertEqual(parse_downsampling({"max_points": "3", "downsample": "minmax"}), (10, "minmax"))
+        with self.assertRaises(ValueError):
+            parse_downsampling({"downsample": "average"})
+
+
+class MetricsTests(LineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_frames_are_counted_by_outcome_and_stages_are_timed(self):
+        for response in (b"n=PM9;cr=5;ru=1;sp=100", b"n=PM9;cr=5;ru=1;sp=100", b"ERROR", b"n=PM9;cr=5;ru=1;sp=110"):
+            handle_response(self.line, response)
+
+        rendered = metrics.render()
+        self.assertIn('plc_frames_total{plc="PM9",result="stored"} 2\n', rendered)
+        self.assertIn('plc_frames_total{plc="PM9",result="duplicate"} 1\n', rendered)
+        self.assertIn('plc_frames_total{plc="PM9",result="dropped"} 1\n', rendered)
+        totals = metrics.stage_totals("PM9")
+        self.assertEqual((totals["parse"][0], totals["dedup"][0], totals["aggregation"][0]), (4, 3, 2))
+
+    def test_histogram_buckets_are_cumulative(self):
+        metrics.observe("plc_stage_seconds", 0.003, plc="PM9", stage="db")
+        metrics.observe("plc_stage_seconds", 0.2, plc="PM9", stage="db")
+
+        rendered = metrics.render()
+        for bound, count in (("0.0025", 0), ("0.005", 1), ("0.1", 1), ("0.25", 2), ("+Inf", 2)):
+            self.assertIn(f'plc_stage_seconds_bucket{{plc="PM9",stage="db",le="{bound}"}} {count}\n', rendered)
+        self.assertIn('plc_stage_seconds_count{plc="PM9",stage="db"} 2\n', rendered)
+
+    def test_metrics_are_served_over_http(self):
+        metrics.inc("plc_frames_total", plc="PM9", result="stored")
+
+        async def get(path):
+            server = await serve_metrics("127.0.0.1", 0)
+            try:
+                reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+                writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+                response = await asyncio.wait_for(reader.read(), 2)
+                writer.close()
+                return response
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        response = asyncio.run(get("/metrics"))
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK\r\n"))
+        self.assertIn(b'plc_frames_total{plc="PM9",result="stored"} 1\n', response)
+        self.assertTrue(asyncio.run(get("/admin")).startswith(b"HTTP/1.1 404"))
+
+
+class UnbackfilledRollTests(LineTestCase):
+    """Rolls logged before ingestion wrote segments and rollups read them from the raw logs"""
+
+    def log_roll(self, states):
+        for speed, is_running in enumerate(states, 100):
+            handle_response(self.line, f"n=PM9;cr=5;ru={int(is_running)};sp={speed}".encode())
+        roll = Rolls.objects.get(roll_number=5)
+        logs = PLC_Logs.objects.filter(roll=roll).order_by("CreationDateTime", "id")
+        return roll, list(logs.values_list("id", flat=True))
+
+    def test_stopped_ranges_without_segments(self):
+        roll, ids = self.log_roll([True, False, False, True])
+        start = roll.CreationDateTime
+        for id, minutes in zip(ids, (0, 1, 10, 11)):
+            PLC_Logs.objects.filter(id=id).update(CreationDateTime=start + timedelta(minutes=minutes))
+        Roll_Segments.objects.all().delete()
+
+        ranges = build_stopped_ranges([roll.id])
+        self.assertEqual(ranges, [{"x": int((start + timedelta(minutes=1)).timestamp() * 1000),
+                                   "x2": int((start + timedelta(minutes=11)).timestamp() * 1000)}])
+        Roll_Segments.rebuild(self.plc.id)
+        self.assertEqual(build_stopped_ranges([roll.id]), ranges)
+        self.assertEqual([segment[1] for segment in Roll_Segments.for_rolls([roll.id])], [True, False, True])
+
+    def test_roll_annotations_without_segments(self):
+        roll, ids = self.log_roll([False, True])
+        first_running = PLC_Logs.objects.get(id=ids[1]).CreationDateTime
+        Roll_Segments.objects.all().delete()
+
+        response = self.client.get(reverse("get_historical_chart_data"), {"plc": self.plc.id, "range": "1h"})
+        self.assertEqual(response.json()["roll_annotations"],
+                         [{"x": int(first_running.timestamp() * 1000), "label": "5"}])
+
+    def test_buckets_without_rollups(self):
+        roll, ids = self.log_roll([True, True, True])
+        expected = roll_buckets([roll.id], 60)
+        self.assertEqual(expected["sp"][-1][1], 102)
+
+        PLC_Rollups.objects.all().delete()
+        PLC_Logs.objects.filter(id=ids[0]).update(key_ids=None, key_values=None)
+        self.assertEqual(roll_buckets([roll.id], 60), expected)
+
+
+class XlsxExportTests(LineTestCase):
+
+    def test_first_chunk_is_sent_before_the_rows_are_read(self):
+        read = []
+
+        def rows():
+            for index in range(50000):
+                read.append(index)
+                yield [index + 1, "PM9", 5, "1405/07/25 10:00:00", f"{index * 7919 % 100003:x}", "", index * 0.5]
+
+        chunks = xlsx_chunks(["ردیف", "دستگاه", "شماره رول", "زمان", "a", "b", "c"], rows())
+        first = next(chunks)
+        self.assertGreaterEqual(len(first), FILE_CHUNK_SIZE)
+        self.assertLess(len(read), 50000)
+
+        sheet = load_workbook(BytesIO(first + b"".join(chunks)), read_only=True).active
+        values = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(len(values), 50001)
+        self.assertEqual(values[-1], (50000, "PM9", 5, "1405/07/25 10:00:00", f"{49999 * 7919 % 100003:x}", None, 24999.5))
+
+    def test_export_view_keeps_the_header_style_and_escapes_values(self):
+        handle_response(self.line, b"n=PM9;cr=5;ru=1;sp=100;note=a<b & c")
+        response = self.client.get(reverse("export_all_logs_xlsx"), {"plc": self.plc.id, "range": "1h"})
+        sheet = load_workbook(BytesIO(b"".join(response.streaming_content))).active
+
+        self.assertTrue(sheet.sheet_view.rightToLeft)
+        self.assertEqual(sheet["A1"].fill.start_color.rgb, "004472C4")
+        header = [cell.value for cell in sheet[1]]
+        row = dict(zip(header, [cell.value for cell in sheet[2]]))
+        self.assertEqual((row["ردیف"], row["شماره رول"], row["sp"], row["note"]), (1, 5, "100", "a<b & c"))
+
+
+class BenchmarkTests(LineTestCase):
+    def test_every_line_ingests_into_its_own_plc_and_rolls(self):
+        recording = Recording("poll")
+        for tick, response in enumerate([b"n=PM3;cr=41;ru=1;sp=100", b"n=PM3;cr=41;ru=1;sp=110", b"n=PM3;cr=42;ru=0;sp=0"]):
+            recording.add(tick, 0, "request", b"")
+            recording.add(tick, 0, "response", response)
+
+        result = run_benchmark(recording, lines=2)
+
+        self.assertEqual(result["ticks"], 6)
+        self.assertFalse(PLC.objects.filter(device_id__startswith="PM3").exists())
+        for index in range(2):
+            plc = PLC.objects.get(device_id=f"bench-{index}")
+            self.assertEqual(PLC_Logs.objects.filter(plc=plc).count(), 3)
+            rolls = sorted(PLC_Logs.objects.filter(plc=plc).values_list("roll__roll_number", flat=True).distinct())
+            self.assertEqual(rolls, [41 + index * 1000000, 42 + index * 1000000])
+            self.assertEqual(RollKeyAggregate.objects.get(roll__roll_number=41 + index * 1000000, key="sp").count, 2)
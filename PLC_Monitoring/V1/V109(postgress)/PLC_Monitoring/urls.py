@@ -32,8 +32,11 @@ urlpatterns = [
     path("api/historical-chart/", views.get_historical_chart_data, name="get_historical_chart_data"),
     # Export
     path("api/export/logs/", views.export_all_logs_xlsx, name="export_all_logs_xlsx"),
+    # Downtime
+    path("api/downtime/", views.get_downtime, name="get_downtime"),
     # Alert Configurations
     path("api/alert-config/", views.get_key_alert_config, name="get_key_alert_config"),
     path("api/alert-config/save/", views.save_key_alert_config, name="save_key_alert_config"),
     path("api/alert-configs/all/", views.get_all_alert_configs, name="get_all_alert_configs"),
+    path("api/alerts/", views.get_alerts, name="get_alerts"),
 ]
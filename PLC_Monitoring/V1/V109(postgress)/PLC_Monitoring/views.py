@@ -1,16 +1,22 @@
-from django.http import JsonResponse, StreamingHttpResponse, HttpResponse
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponse, HttpResponseNotModified
+from asgiref.sync import sync_to_async
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
 from django.db import transaction
+from django.db.models import Q
 from django.shortcuts import render
 from django.utils import timezone
-from datetime import timedelta
+from django.utils.http import parse_etags
+from datetime import datetime, timedelta, timezone as dt_timezone
 from .models import *
+from .charts import roll_buckets, build_chart_series, rollup_resolution, build_stopped_ranges, parse_downsampling
+from .exports import export_keys, Labels, log_groups, rollup_groups, export_rows, xlsx_chunks, csv_chunks, response_chunks
+from .events import LOGS_CHANNEL, SETTINGS_CHANNEL, notify, sse_response, sse_message, log_data, plc_settings_data
+from .metadata import registry, alert_config_data
+from .alerts import alert_data
 import json
-import time
 import jdatetime
-from io import BytesIO
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+from itertools import chain
 
 def dashboard(request):
     context = {
@@ -109,6 +115,7 @@ def update_plc(request):
         plc.description = description
         plc.Is_Known = is_known
         plc.save()
+        notify([(SETTINGS_CHANNEL, {'plc': plc.id})])
         
         return JsonResponse({
             'status': 'ok',
@@ -149,20 +156,20 @@ def delete_plc(request):
 
 def get_plc_keys(request):
     """Get all PLC keys"""
-    keys = PLC_Keys.objects.all()
+    keys = registry.current().keys
     
     data = []
     for key in keys:
         data.append({
-            'id': key.id,
-            'name': key.name,
-            'fa_name': key.fa_name,
-            'key': key.key,
-            'value': key.value,
-            'order_index': key.order_index,
-            'description': key.description,
-            'CreationDateTime': key.CreationDateTime.timestamp() if key.CreationDateTime else None,
-            'LastUpdate': key.LastUpdate.timestamp() if key.LastUpdate else None
+            'id': key['id'],
+            'name': key['name'],
+            'fa_name': key['fa_name'],
+            'key': key['key'],
+            'value': key['value'],
+            'order_index': key['order_index'],
+            'description': key['description'],
+            'CreationDateTime': key['CreationDateTime'].timestamp() if key['CreationDateTime'] else None,
+            'LastUpdate': key['LastUpdate'].timestamp() if key['LastUpdate'] else None
         })
     
     return JsonResponse({'status': 'ok', 'data': data})
@@ -267,79 +274,15 @@ def delete_plc_key(request):
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)})
 
-def sse_plc_logs(request):
-    """SSE endpoint for streaming PLC_Logs in real-time (new logs + updated logs)"""
-    def event_stream():
-        last_id = 0
-        last_update_time = timezone.now()
-        
-        while True:
-            logs_data = []
-            
-            # Get new logs
-            new_logs = PLC_Logs.objects.filter(id__gt=last_id).select_related('plc').order_by('-id')[:50]
-            if new_logs:
-                last_id = new_logs[0].id
-                for log in reversed(new_logs):
-                    logs_data.append({
-                        'id': log.id,
-                        'plc_id': log.plc.id if log.plc else None,
-                        'plc_device_id': log.plc.device_id if log.plc else 'نامشخص',
-                        'plc_name': log.plc.name if log.plc else '',
-                        'data': log.data,
-                        'json_data': log.json_data,
-                        'CreationDateTime': log.CreationDateTime.timestamp() if log.CreationDateTime else None,
-                        'LastUpdate': log.LastUpdate.timestamp() if log.LastUpdate else None,
-                        'is_update': False
-                    })
-            
-            # Get updated logs (LastUpdate changed since last check)
-            updated_logs = PLC_Logs.objects.filter(
-                id__lte=last_id,
-                LastUpdate__gt=last_update_time
-            ).select_related('plc').order_by('-LastUpdate')[:20]
-            
-            for log in updated_logs:
-                logs_data.append({
-                    'id': log.id,
-                    'plc_id': log.plc.id if log.plc else None,
-                    'plc_device_id': log.plc.device_id if log.plc else 'نامشخص',
-                    'plc_name': log.plc.name if log.plc else '',
-                    'data': log.data,
-                    'json_data': log.json_data,
-                    'CreationDateTime': log.CreationDateTime.timestamp() if log.CreationDateTime else None,
-                    'LastUpdate': log.LastUpdate.timestamp() if log.LastUpdate else None,
-                    'is_update': True
-                })
-            
-            last_update_time = timezone.now()
-            
-            if logs_data:
-                yield f"data: {json.dumps(logs_data, ensure_ascii=False, default=str)}\n\n"
-            
-            time.sleep(1)
-    
-    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
-    response['Cache-Control'] = 'no-cache'
-    response['X-Accel-Buffering'] = 'no'
-    return response
+async def sse_plc_logs(request):
+    """SSE endpoint for streaming PLC_Logs in real-time (new logs + updated logs), pushed by the event hub"""
+    return sse_response(request, LOGS_CHANNEL)
 
 def get_initial_logs(request):
     """Get initial PLC_Logs for table"""
     limit = int(request.GET.get('limit', 50))
     logs = PLC_Logs.objects.select_related('plc').order_by('-id')[:limit]
-    logs_data = []
-    for log in logs:
-        logs_data.append({
-            'id': log.id,
-            'plc_id': log.plc.id if log.plc else None,
-            'plc_device_id': log.plc.device_id if log.plc else 'نامشخص',
-            'plc_name': log.plc.name if log.plc else '',
-            'data': log.data,
-            'json_data': log.json_data,
-            'CreationDateTime': log.CreationDateTime.timestamp() if log.CreationDateTime else None,
-            'LastUpdate': log.LastUpdate.timestamp() if log.LastUpdate else None
-        })
+    logs_data = [log_data(log) for log in logs]
     return JsonResponse({'status': 'ok', 'data': logs_data})
 
 def live_settings(request):
@@ -375,21 +318,10 @@ def live_settings(request):
         search_query = ''
         paginator = None
     
-    # Get key translations for charts
-    key_translations = {}
-    plc_keys = PLC_Keys.objects.all()
-    for pk in plc_keys:
-        key_translations[pk.key] = pk.fa_name or pk.name or pk.key
-    
-    # Get excluded keys for settings panel
-    excluded_keys = set(ChartExcludedKeys.objects.values_list('key', flat=True))
-    keys_with_status = []
-    for pk in plc_keys:
-        keys_with_status.append({
-            'key': pk.key,
-            'fa_name': pk.fa_name or pk.name or pk.key,
-            'is_excluded': pk.key in excluded_keys
-        })
+    # Key translations for charts and excluded keys for the settings panel
+    metadata = registry.current()
+    key_translations = metadata.translations
+    keys_with_status = metadata.keys_with_status()
     
     return render(request, 'plc_monitoring/live_settings.html', {
         'plc': plc, 
@@ -408,6 +340,11 @@ def get_historical_chart_data(request):
     
     if not plc_id:
         return JsonResponse({'status': 'error', 'message': 'PLC ID required'})
+    try:
+        # optional max_points per series (lttb or minmax), sent as x/y arrays
+        max_points, method = parse_downsampling(request.GET)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'پارامترهای نامعتبر'})
     
     # Calculate time threshold based on range
     now = timezone.now()
@@ -421,14 +358,9 @@ def get_historical_chart_data(request):
     }
     threshold = time_thresholds.get(time_range, now - timedelta(hours=1))
     
-    # Get excluded keys
-    excluded_keys = set(ChartExcludedKeys.objects.values_list('key', flat=True))
-    
-    # Get key translations
-    key_translations = {}
-    plc_keys = PLC_Keys.objects.all()
-    for pk in plc_keys:
-        key_translations[pk.key] = pk.fa_name or pk.name or pk.key
+    # Excluded keys, translations and order
+    metadata = registry.current()
+    excluded_keys = metadata.excluded
     
     try:
         # Get rolls in time range
@@ -438,63 +370,24 @@ def get_historical_chart_data(request):
             CreationDateTime__gte=threshold
         ).order_by('CreationDateTime')
         
-        # Get all logs for these rolls
+        # Ids of these rolls
         roll_ids = list(rolls.values_list('id', flat=True))
-        logs = PLC_Logs.objects.filter(
-            roll_id__in=roll_ids,
-            is_running=True
-        ).order_by('CreationDateTime')
-        
-        # Collect all unique keys
-        all_keys = set()
-        for log in logs:
-            if log.json_data:
-                for key in log.json_data.keys():
-                    if key not in excluded_keys:
-                        all_keys.add(key)
-        
-        # Build raw data grouped by interval (last value in each interval)
-        # interval_data[key][interval_timestamp] = last_value
-        interval_data = {key: {} for key in all_keys}
         
-        for log in logs:
-            if not log.CreationDateTime or not log.json_data:
-                continue
-            # Round timestamp to interval
-            ts = log.CreationDateTime.timestamp()
-            interval_ts = int(ts // interval) * interval * 1000
-            for key in all_keys:
-                if key in log.json_data:
-                    try:
-                        value = float(log.json_data[key])
-                        interval_data[key][interval_ts] = value  # Last value wins
-                    except (ValueError, TypeError):
-                        pass
+        # Last value of each key per interval, from the rollups or bucketed in the database
+        buckets = roll_buckets(roll_ids, interval, excluded_keys)
         
-        # Get order_index for keys
-        key_order = {}
-        for pk in plc_keys:
-            key_order[pk.key] = pk.order_index if pk.order_index is not None else 9999
+        chart_series = build_chart_series(buckets, metadata.translations, metadata.order, max_points, method)
         
-        # Convert to series format
-        chart_series = []
-        for key, data in interval_data.items():
-            if data:
-                sorted_data = [{'x': ts, 'y': val} for ts, val in sorted(data.items())]
-                fa_name = key_translations.get(key, key)
-                order = key_order.get(key, 9999)  # Unknown keys go to end
-                chart_series.append({'name': key, 'fa_name': fa_name, 'data': sorted_data, 'order_index': order})
-        
-        # Sort by order_index, then by name for consistent ordering
-        chart_series.sort(key=lambda x: (x['order_index'], x['name']))
-        
-        # Build roll annotations (first log of each roll)
+        # Build roll annotations (first running log of each roll, where its first running segment starts)
+        first_logs = {}
+        for roll_id, is_running, started_at, ended_at in Roll_Segments.for_rolls(roll_ids):
+            if is_running:
+                first_logs.setdefault(roll_id, started_at)
         roll_annotations = []
         for roll in rolls:
-            first_log = PLC_Logs.objects.filter(roll=roll, is_running=True).order_by('CreationDateTime').first()
-            if first_log and first_log.CreationDateTime:
+            if roll.id in first_logs:
                 roll_annotations.append({
-                    'x': int(first_log.CreationDateTime.timestamp() * 1000),
+                    'x': int(first_logs[roll.id].timestamp() * 1000),
                     'label': f'{roll.roll_number or roll.id}'
                 })
         
@@ -509,34 +402,7 @@ def get_historical_chart_data(request):
                 })
         
         # Build stopped ranges (is_running=False periods, only if > 5 minutes)
-        stopped_ranges = []
-        all_logs = PLC_Logs.objects.filter(
-            roll_id__in=roll_ids
-        ).order_by('CreationDateTime').values('CreationDateTime', 'is_running')
-        
-        range_start = None
-        MIN_STOPPED_DURATION_MS = 300000  # 5 minutes in milliseconds
-        
-        for log in all_logs:
-            if not log['CreationDateTime']:
-                continue
-            dt = log['CreationDateTime']
-            if hasattr(dt, 'timestamp'):
-                ts_ms = int(dt.timestamp() * 1000)
-            else:
-                continue
-            if not log['is_running'] and range_start is None:
-                range_start = ts_ms
-            elif log['is_running'] and range_start is not None:
-                range_end = ts_ms
-                if range_end - range_start >= MIN_STOPPED_DURATION_MS:
-                    stopped_ranges.append({'x': range_start, 'x2': range_end})
-                range_start = None
-        # Handle case where last logs are is_running=False
-        if range_start is not None:
-            range_end = int(timezone.now().timestamp() * 1000)
-            if range_end - range_start >= MIN_STOPPED_DURATION_MS:
-                stopped_ranges.append({'x': range_start, 'x2': range_end})
+        stopped_ranges = build_stopped_ranges(roll_ids)
         
         return JsonResponse({
             'status': 'ok',
@@ -551,58 +417,23 @@ def get_historical_chart_data(request):
 
 def roll_detail(request, roll_id):
     """Roll detail page showing roll info and plc_setting"""
-    # Get dynamic excluded keys from database
-    excluded_keys = set(ChartExcludedKeys.objects.values_list('key', flat=True))
+    # Excluded keys, translations and order from the metadata registry
+    metadata = registry.current()
+    excluded_keys = metadata.excluded
     interval = int(request.GET.get('interval', 60))  # Default 60 seconds
+    try:
+        max_points, method = parse_downsampling(request.GET)
+    except ValueError:
+        max_points, method = None, 'lttb'
     
     try:
         roll = Rolls.objects.select_related('plc').get(id=roll_id)
-        logs = PLC_Logs.objects.filter(roll=roll).filter(is_running=True).order_by('CreationDateTime')
-        
-        # Collect all unique keys from json_data
-        all_keys = set()
-        for log in logs:
-            if log.json_data:
-                for key in log.json_data.keys():
-                    if key not in excluded_keys:
-                        all_keys.add(key)
-        
-        # Get key translations and order from PLC_Keys
-        key_translations = {}
-        key_order = {}
-        plc_keys = PLC_Keys.objects.filter(key__in=all_keys)
-        for pk in plc_keys:
-            key_translations[pk.key] = pk.fa_name or pk.name or pk.key
-            key_order[pk.key] = pk.order_index if pk.order_index is not None else 9999
         
-        # Build data grouped by interval (last value in each interval)
-        interval_data = {key: {} for key in all_keys}
-        
-        for log in logs:
-            if not log.CreationDateTime or not log.json_data:
-                continue
-            # Round timestamp to interval
-            ts = log.CreationDateTime.timestamp()
-            interval_ts = int(ts // interval) * interval * 1000
-            for key in all_keys:
-                if key in log.json_data:
-                    try:
-                        value = float(log.json_data[key])
-                        interval_data[key][interval_ts] = value  # Last value wins
-                    except (ValueError, TypeError):
-                        pass
+        # Last value of each key per interval, from the rollups or bucketed in the database
+        buckets = roll_buckets([roll.id], interval, excluded_keys)
         
         # Convert to list format for ApexCharts with fa_name
-        chart_series = []
-        for key, data in interval_data.items():
-            if data:
-                sorted_data = [{'x': ts, 'y': val} for ts, val in sorted(data.items())]
-                fa_name = key_translations.get(key, key)
-                order = key_order.get(key, 9999)
-                chart_series.append({'name': key, 'fa_name': fa_name, 'data': sorted_data, 'order_index': order})
-        
-        # Sort by order_index, then by name for consistent ordering
-        chart_series.sort(key=lambda x: (x['order_index'], x['name']))
+        chart_series = build_chart_series(buckets, metadata.translations, metadata.order, max_points, method)
         
         # Build roll breaks annotations
         break_annotations = []
@@ -615,31 +446,7 @@ def roll_detail(request, roll_id):
                 })
         
         # Build stopped ranges (is_running=False periods, only if > 5 minutes)
-        stopped_ranges = []
-        all_logs = PLC_Logs.objects.filter(roll=roll).order_by('CreationDateTime').values('CreationDateTime', 'is_running')
-        
-        range_start = None
-        MIN_STOPPED_DURATION_MS = 300000  # 5 minutes in milliseconds
-        
-        for log in all_logs:
-            if not log['CreationDateTime']:
-                continue
-            dt = log['CreationDateTime']
-            if hasattr(dt, 'timestamp'):
-                ts_ms = int(dt.timestamp() * 1000)
-            else:
-                continue
-            if not log['is_running'] and range_start is None:
-                range_start = ts_ms
-            elif log['is_running'] and range_start is not None:
-                range_end = ts_ms
-                if range_end - range_start >= MIN_STOPPED_DURATION_MS:
-                    stopped_ranges.append({'x': range_start, 'x2': range_end})
-                range_start = None
-        if range_start is not None:
-            range_end = int(timezone.now().timestamp() * 1000)
-            if range_end - range_start >= MIN_STOPPED_DURATION_MS:
-                stopped_ranges.append({'x': range_start, 'x2': range_end})
+        stopped_ranges = build_stopped_ranges([roll.id])
         
     except Rolls.DoesNotExist:
         roll = None
@@ -648,14 +455,7 @@ def roll_detail(request, roll_id):
         stopped_ranges = []
     
     # Get all PLC_Keys with excluded status for UI
-    all_plc_keys = PLC_Keys.objects.all()
-    keys_with_status = []
-    for pk in all_plc_keys:
-        keys_with_status.append({
-            'key': pk.key,
-            'fa_name': pk.fa_name or pk.name or pk.key,
-            'is_excluded': pk.key in excluded_keys
-        })
+    keys_with_status = metadata.keys_with_status()
     
     return render(request, 'plc_monitoring/roll_detail.html', {
         'roll': roll,
@@ -666,9 +466,81 @@ def roll_detail(request, roll_id):
         'current_interval': interval
     })
 
+ROLL_FEED_LIMIT = 100       # rolls per page of the change feed
+ROLL_FEED_MAX_LIMIT = 1000
+ROLL_FEED_LAG = timedelta(seconds=2)  # rolls changed more recently wait for the next poll, so a slower commit
+                                      # with an earlier LastUpdate is not skipped by the cursor
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_roll_cursor(last_update, roll_id):
+    return f"{(last_update - EPOCH) // timedelta(microseconds=1)}-{roll_id}"
+
+
+def decode_roll_cursor(cursor):
+    micros, roll_id = cursor.split("-")
+    return EPOCH + timedelta(microseconds=int(micros)), int(roll_id)
+
+
+def roll_changes(request):
+    """Rolls changed after the cursor, ordered by (LastUpdate, id); an empty cursor starts from the beginning.
+
+    The response carries next_cursor for the following call. plc_keys are only sent when keys_version
+    differs from the client's. An unchanged page gets 304 when the client sends its ETag (GET).
+    """
+    params = request.POST if request.method == "POST" else request.GET
+    cursor = params.get("cursor") or request.GET.get("cursor", "")
+    try:
+        after = decode_roll_cursor(cursor) if cursor else None
+        limit = min(max(int(params.get("limit", ROLL_FEED_LIMIT)), 1), ROLL_FEED_MAX_LIMIT)
+        roll_number = int(params["roll_from_request"]) if params.get("roll_from_request") else None
+    except (ValueError, TypeError):
+        return JsonResponse({'status': 'error', 'message': 'پارامترهای نامعتبر'}, status=400)
+
+    rolls = Rolls.objects.filter(LastUpdate__lt=timezone.now() - ROLL_FEED_LAG)
+    if roll_number is not None:
+        rolls = rolls.filter(roll_number__gte=roll_number)
+    if after:
+        rolls = rolls.filter(Q(LastUpdate__gt=after[0]) | Q(LastUpdate=after[0], id__gt=after[1]))
+    data = list(rolls.order_by("LastUpdate", "id").values(
+        "id",
+        "plc_id",
+        "plc_setting",
+        "roll_number",
+        "CreationDateTime",
+        "LastUpdate",
+        "Paper_breaks",
+        "Printed_length",
+        "Is_Deleted",
+    )[:limit + 1])
+    has_more = len(data) > limit
+    data = data[:limit]
+    next_cursor = encode_roll_cursor(data[-1]["LastUpdate"], data[-1]["id"]) if data else cursor
+
+    metadata = registry.current()
+    keys_version = str(metadata.version)
+    send_keys = params.get("keys_version") != keys_version
+    etag = '"%s"' % "-".join([cursor or "0", next_cursor or "0", str(limit), str(roll_number), keys_version, str(int(send_keys))])
+    if request.method == "GET" and etag in [tag.removeprefix("W/") for tag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))]:
+        response = HttpResponseNotModified()
+    else:
+        payload = {"status": 200, "data": data, "next_cursor": next_cursor, "has_more": has_more, "keys_version": keys_version}
+        if send_keys:
+            payload["plc_keys"] = metadata.keys
+        response = JsonResponse(payload)
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
 @csrf_exempt
+@gzip_page
 def roll_detail_api(request):
-    """ roll details api for lab system | POST """
+    """ roll details api for lab system | POST
+    With a cursor parameter (GET or POST) it is an incremental change feed, see roll_changes """
+    
+    if "cursor" in request.GET or "cursor" in request.POST:
+        return roll_changes(request)
     
     if request.method == "POST":
         roll_from_request = request.POST.get("roll_from_request") or request.GET.get("roll_from_request")
@@ -685,7 +557,7 @@ def roll_detail_api(request):
         # for x in rolls:
         #     x.avg_final_data()
 
-        plc_keys = list(PLC_Keys.objects.all().values())
+        plc_keys = registry.current().keys
         data = list(rolls.values(
             "plc_setting",
             "roll_number",
@@ -699,47 +571,17 @@ def roll_detail_api(request):
 def get_plc_settings(request):
     """Get all PLCs with their settings"""
     plcs = PLC.objects.all()
-    data = []
-    for plc in plcs:
-        data.append({
-            'id': plc.id,
-            'device_id': plc.device_id,
-            'name': plc.name,
-            'setting': plc.setting,
-            'LastUpdate': plc.LastUpdate.timestamp() if plc.LastUpdate else None
-        })
+    data = [plc_settings_data(plc) for plc in plcs]
     return JsonResponse({'status': 'ok', 'data': data})
 
-def sse_plc_settings(request):
-    """SSE endpoint for streaming PLC settings in real-time"""
+async def sse_plc_settings(request):
+    """SSE endpoint for streaming PLC settings in real-time, pushed by the event hub"""
     plc_id = request.GET.get('plc')
     
-    def event_stream():
-        last_update_time = None
-        
-        while True:
-            try:
-                plc = PLC.objects.get(id=plc_id)
-                
-                if plc.LastUpdate and (last_update_time is None or plc.LastUpdate > last_update_time):
-                    last_update_time = plc.LastUpdate
-                    data = {
-                        'id': plc.id,
-                        'device_id': plc.device_id,
-                        'name': plc.name,
-                        'setting': plc.setting,
-                        'LastUpdate': plc.LastUpdate.timestamp() if plc.LastUpdate else None
-                    }
-                    yield f"data: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
-            except PLC.DoesNotExist:
-                pass
-            
-            time.sleep(1)
-    
-    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
-    response['Cache-Control'] = 'no-cache'
-    response['X-Accel-Buffering'] = 'no'
-    return response
+    # Current state first, then every change
+    plc = await sync_to_async(PLC.objects.filter(id=plc_id).first)() if plc_id else None
+    initial = sse_message(plc_settings_data(plc)) if plc else None
+    return sse_response(request, SETTINGS_CHANNEL, key=plc_id, initial=initial)
 
 @csrf_exempt
 def toggle_chart_excluded_key(request):
@@ -806,6 +648,7 @@ def update_keys_order_bulk(request):
         with transaction.atomic():
             for key, order_index in orders.items():
                 PLC_Keys.objects.filter(key=key).update(order_index=order_index)
+            registry.bump()
         
         return JsonResponse({'status': 'ok', 'message': 'ترتیب بروزرسانی شد'})
     except Exception as e:
@@ -820,19 +663,12 @@ def get_key_alert_config(request):
         return JsonResponse({'status': 'error', 'message': 'کلید الزامی است'})
     
     try:
-        config = KeyAlertConfig.objects.get(key=key)
-        return JsonResponse({
-            'status': 'ok',
-            'data': {
-                'key': config.key,
-                'min_value': config.min_value,
-                'max_value': config.max_value,
-                'color_max': config.color_max,
-                'color_min': config.color_min,
-                'alert_types': config.alert_types or {}
-            }
-        })
-    except KeyAlertConfig.DoesNotExist:
+        config = registry.current().alert_configs.get(key)
+        if config is not None:
+            return JsonResponse({
+                'status': 'ok',
+                'data': {'key': key, **config}
+            })
         return JsonResponse({
             'status': 'ok',
             'data': {
@@ -891,14 +727,7 @@ def save_key_alert_config(request):
         return JsonResponse({
             'status': 'ok',
             'message': 'تنظیمات با موفقیت ذخیره شد',
-            'data': {
-                'key': config.key,
-                'min_value': config.min_value,
-                'max_value': config.max_value,
-                'color_max': config.color_max,
-                'color_min': config.color_min,
-                'alert_types': config.alert_types
-            }
+            'data': {'key': config.key, **alert_config_data(config)}
         })
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)})
@@ -908,25 +737,14 @@ def save_key_alert_config(request):
 def get_all_alert_configs(request):
     """Get all alert configurations"""
     try:
-        configs = KeyAlertConfig.objects.all()
-        data = {}
-        for config in configs:
-            data[config.key] = {
-                'min_value': config.min_value,
-                'max_value': config.max_value,
-                'color_max': config.color_max,
-                'color_min': config.color_min,
-                'alert_types': config.alert_types or {}
-            }
+        data = registry.current().alert_configs
         return JsonResponse({'status': 'ok', 'data': data})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)})
 
 
-def export_all_logs_xlsx(request):
-    """Export PLC_Logs with is_running=True to xlsx, filtered by PLC and time range"""
-    interval = int(request.GET.get('interval', 1))  # Default 1 second grouping
-    plc_id = request.GET.get('plc')
+def parse_time_range(request):
+    """(start, end) from from_date/to_date (Jalali YYYY/MM/DD, whole days) or a preset range, default 1h"""
     time_range = request.GET.get('range', '1h')
     from_date = request.GET.get('from_date')  # Jalali date: YYYY/MM/DD
     to_date = request.GET.get('to_date')      # Jalali date: YYYY/MM/DD
@@ -936,39 +754,48 @@ def export_all_logs_xlsx(request):
     
     if from_date and to_date:
         # Custom date range - convert Jalali to datetime
-        try:
-            # Parse Jalali dates
-            from_parts = from_date.split('/')
-            to_parts = to_date.split('/')
-            
-            # Start of day for from_date
-            jdt_from = jdatetime.datetime(
-                int(from_parts[0]), int(from_parts[1]), int(from_parts[2]),
-                0, 0, 0
-            )
-            # End of day for to_date
-            jdt_to = jdatetime.datetime(
-                int(to_parts[0]), int(to_parts[1]), int(to_parts[2]),
-                23, 59, 59
-            )
-            
-            # Convert to Gregorian datetime
-            threshold_start = jdt_from.togregorian()
-            threshold_end = jdt_to.togregorian()
-        except (ValueError, IndexError):
-            return HttpResponse('فرمت تاریخ نامعتبر است', content_type='text/plain; charset=utf-8')
-    else:
-        # Preset time ranges
-        time_thresholds = {
-            '1h': now - timedelta(hours=1),
-            '8h': now - timedelta(hours=8),
-            '24h': now - timedelta(hours=24),
-            'week': now - timedelta(days=7),
-            'month': now - timedelta(days=30),
-            'year': now - timedelta(days=365)
-        }
-        threshold_start = time_thresholds.get(time_range, now - timedelta(hours=1))
-        threshold_end = now
+        from_parts = from_date.split('/')
+        to_parts = to_date.split('/')
+        
+        # Start of day for from_date
+        jdt_from = jdatetime.datetime(
+            int(from_parts[0]), int(from_parts[1]), int(from_parts[2]),
+            0, 0, 0
+        )
+        # End of day for to_date
+        jdt_to = jdatetime.datetime(
+            int(to_parts[0]), int(to_parts[1]), int(to_parts[2]),
+            23, 59, 59
+        )
+        
+        # Convert to Gregorian datetime
+        return jdt_from.togregorian(), jdt_to.togregorian()
+    
+    # Preset time ranges
+    time_thresholds = {
+        '1h': now - timedelta(hours=1),
+        '8h': now - timedelta(hours=8),
+        '24h': now - timedelta(hours=24),
+        'week': now - timedelta(days=7),
+        'month': now - timedelta(days=30),
+        'year': now - timedelta(days=365)
+    }
+    return time_thresholds.get(time_range, now - timedelta(hours=1)), now
+
+
+def export_all_logs_xlsx(request):
+    """Export PLC_Logs with is_running=True to xlsx (or csv with format=csv), filtered by PLC and time range.
+
+    Rows are streamed from server-side cursors, so memory use does not grow with the range.
+    """
+    interval = int(request.GET.get('interval', 1))  # Default 1 second grouping
+    export_format = request.GET.get('format', 'xlsx')
+    plc_id = request.GET.get('plc')
+    
+    try:
+        threshold_start, threshold_end = parse_time_range(request)
+    except (ValueError, IndexError):
+        return HttpResponse('فرمت تاریخ نامعتبر است', content_type='text/plain; charset=utf-8')
     
     # Build query
     logs_query = PLC_Logs.objects.filter(
@@ -978,127 +805,111 @@ def export_all_logs_xlsx(request):
     )
     if plc_id:
         logs_query = logs_query.filter(plc_id=plc_id)
-    logs = logs_query.select_related('plc', 'roll').order_by('CreationDateTime')
     
-    if not logs.exists():
+    # Whole interval buckets inside the range are read from the rollups, only the partial edges from PLC_Logs
+    rollups = PLC_Rollups.objects.none()
+    first_bucket = last_bucket = None
+    resolution = rollup_resolution(interval)
+    if resolution:
+        if timezone.is_naive(threshold_start):
+            threshold_start = timezone.make_aware(threshold_start)
+            threshold_end = timezone.make_aware(threshold_end)
+        first_ts = -(-int(threshold_start.timestamp()) // interval) * interval
+        last_ts = int(threshold_end.timestamp()) // interval * interval
+        if first_ts < last_ts:
+            first_bucket = datetime.fromtimestamp(first_ts, tz=dt_timezone.utc)
+            last_bucket = datetime.fromtimestamp(last_ts, tz=dt_timezone.utc)
+            logs_query = logs_query.exclude(CreationDateTime__gte=first_bucket, CreationDateTime__lt=last_bucket)
+            rollups = PLC_Rollups.objects.filter(
+                resolution=resolution,
+                bucket__gte=first_bucket,
+                bucket__lt=last_bucket
+            )
+            if plc_id:
+                rollups = rollups.filter(plc_id=plc_id)
+    
+    if not logs_query.exists() and not rollups.exists():
         return HttpResponse('داده‌ای برای خروجی وجود ندارد', content_type='text/plain; charset=utf-8')
     
-    # Get key translations from PLC_Keys (key -> fa_name)
-    key_map = {}
-    for pk in PLC_Keys.objects.all():
-        key_map[pk.key] = pk.fa_name or pk.name or pk.key
+    # Key translations (key -> fa_name)
+    key_map = registry.current().translations
     
     # Collect all unique keys from json_data
-    all_keys = set()
-    for log in logs:
-        if log.json_data:
-            all_keys.update(log.json_data.keys())
-    all_keys = sorted(list(all_keys))
-    
-    # Group logs by roll and time interval, merge json_data
-    grouped_data = {}
-    
-    for log in logs:
-        if not log.CreationDateTime:
-            continue
-        
-        roll_id = log.roll_id if log.roll else 0
-        ts = log.CreationDateTime.timestamp()
-        interval_ts = int(ts // interval) * interval
-        group_key = (roll_id, interval_ts)
-        
-        if group_key not in grouped_data:
-            plc_name = 'نامشخص'
-            if log.plc:
-                plc_name = log.plc.name or log.plc.device_id or 'نامشخص'
-            grouped_data[group_key] = {
-                'plc_name': plc_name,
-                'roll_number': log.roll.roll_number if log.roll else '-',
-                'timestamp': ts,
-                'data': {}
-            }
-        
-        # Merge json_data (last value wins for each key)
-        if log.json_data:
-            grouped_data[group_key]['data'].update(log.json_data)
-    
-    # Create Excel workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "PLC Logs"
-    ws.sheet_view.rightToLeft = True
-    
-    # Styles
-    header_font = Font(bold=True, size=11)
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font_white = Font(bold=True, size=11, color="FFFFFF")
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    center_align = Alignment(horizontal='center', vertical='center')
+    all_keys = export_keys(logs_query, rollups)
     
     # Headers: ردیف، دستگاه، شماره رول، زمان، [all keys with fa_name]
     headers = ['ردیف', 'دستگاه', 'شماره رول', 'زمان']
     headers.extend([key_map.get(k, k) for k in all_keys])
     
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font_white
-        cell.fill = header_fill
-        cell.border = thin_border
-        cell.alignment = center_align
-    
-    # Data rows (sorted by timestamp)
-    sorted_groups = sorted(grouped_data.items(), key=lambda x: x[1]['timestamp'])
-    
-    for row_idx, (group_key, group_info) in enumerate(sorted_groups, 2):
-        # ردیف
-        ws.cell(row=row_idx, column=1, value=row_idx - 1).border = thin_border
-        # دستگاه
-        ws.cell(row=row_idx, column=2, value=group_info['plc_name']).border = thin_border
-        # شماره رول
-        ws.cell(row=row_idx, column=3, value=group_info['roll_number']).border = thin_border
-        # زمان (Jalali)
-        ts = group_info['timestamp']
-        if ts:
-            dt = jdatetime.datetime.fromtimestamp(ts)
-            dt_str = dt.strftime('%Y/%m/%d %H:%M:%S')
-        else:
-            dt_str = ''
-        ws.cell(row=row_idx, column=4, value=dt_str).border = thin_border
-        
-        # Key values
-        for col_idx, key in enumerate(all_keys, 5):
-            value = group_info['data'].get(key, '')
-            cell = ws.cell(row=row_idx, column=col_idx, value=value)
-            cell.border = thin_border
-    
-    # Auto-adjust column widths
-    for col in ws.columns:
-        max_length = 0
-        col_letter = col[0].column_letter
-        for cell in col:
-            try:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            except:
-                pass
-        ws.column_dimensions[col_letter].width = min(max_length + 2, 50)
-    
-    # Save to BytesIO
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
+    # Groups of the leading raw edge, the rollup buckets and the trailing raw edge, in time order
+    labels = Labels()
+    if first_bucket is not None:
+        groups = chain(
+            log_groups(logs_query.filter(CreationDateTime__lt=first_bucket), interval, labels),
+            rollup_groups(rollups, interval, labels),
+            log_groups(logs_query.filter(CreationDateTime__gte=last_bucket), interval, labels),
+        )
+    else:
+        groups = log_groups(logs_query, interval, labels)
+    rows = export_rows(groups, all_keys)
     
     # Create response with Jalali filename
     jalali_now = jdatetime.datetime.now()
-    filename = f"plc_logs_{jalali_now.strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response = HttpResponse(
-        output.read(),
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+    if export_format == 'csv':
+        filename = f"plc_logs_{jalali_now.strftime('%Y%m%d_%H%M%S')}.csv"
+        response = StreamingHttpResponse(
+            response_chunks(request, csv_chunks(headers, rows)),
+            content_type='text/csv; charset=utf-8'
+        )
+    else:
+        filename = f"plc_logs_{jalali_now.strftime('%Y%m%d_%H%M%S')}.xlsx"
+        response = StreamingHttpResponse(
+            response_chunks(request, xlsx_chunks(headers, rows)),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
     response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    return response
\ No newline at end of file
+    return response
+
+
+def get_downtime(request):
+    """Stopped time per day (or per shift with shift_hours/shift_start) from the run/stop segments"""
+    plc_id = request.GET.get('plc')
+    try:
+        start, end = parse_time_range(request)
+        shift_hours = int(request.GET.get('shift_hours', 24))
+        shift_start = int(request.GET.get('shift_start', 0))
+    except (ValueError, IndexError):
+        return JsonResponse({'status': 'error', 'message': 'پارامترهای نامعتبر'})
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+        end = timezone.make_aware(end)
+    if not 1 <= shift_hours <= 24 or 24 % shift_hours or not 0 <= shift_start < 24:
+        return JsonResponse({'status': 'error', 'message': 'پارامترهای نامعتبر'})
+    
+    try:
+        data = []
+        for shift, seconds, count in Roll_Segments.downtime(start, end, plc_id, shift_hours, shift_start):
+            data.append({
+                'start': jdatetime.datetime.fromgregorian(datetime=shift).strftime('%Y/%m/%d %H:%M'),
+                'stopped_seconds': round(seconds),
+                'stops': count
+            })
+        return JsonResponse({'status': 'ok', 'data': data})
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)})
+
+
+def get_alerts(request):
+    """Threshold alerts raised by ingestion, newest first (open=1 for only the open ones)"""
+    plc_id = request.GET.get('plc')
+    try:
+        limit = min(int(request.GET.get('limit', 50)), 500)
+    except ValueError:
+        limit = 50
+    
+    alerts = PLC_Alerts.objects.select_related('plc', 'roll').order_by('-opened_at', '-id')
+    if plc_id:
+        alerts = alerts.filter(plc_id=plc_id)
+    if request.GET.get('open') == '1':
+        alerts = alerts.filter(closed_at__isnull=True)
+    return JsonResponse({'status': 'ok', 'data': [alert_data(alert) for alert in alerts[:limit]]})
@@ -159,6 +159,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Archived PLC_Logs partitions (manage_log_partitions --keep-months)
+PLC_LOGS_ARCHIVE_DIR = os.path.join(BASE_DIR, "archive", "plc_logs")
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,217 @@
+import os, asyncio
+import requests
+import django
+
+# Django setup
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+django.setup()
+
+from asgiref.sync import sync_to_async
+from PLC_Monitoring.models import PLC
+from PLC_Monitoring.ingestion import PLCLine, handle_response, thermal_params
+from PLC_Monitoring.partitions import ensure_partitions
+from PLC_Monitoring.metrics import metrics, serve_metrics
+
+# Poller Configuration
+# Every PLC row with an ip_address ("host" or "host:port") is polled. Per-line options live in
+# PLC.setting["poller"], e.g. {"thermal_api_url": "http://192.168.2.22:6002/view/api/plc_data/",
+# "interval": 1, "timeout": 2, "flush_interval": 0, "payload_format": "t{rounded}.0", "enabled": true}
+# Set them up with "python manage.py configure_poller_line <device_id> --preset pm3" (or the options
+# of that command); the presets carry the values of the former tcp_client_pm2/pm3/pm4.py scripts.
+DEFAULT_PORT = 8000
+TIMEOUT = 2           # seconds
+INTERVAL = 1          # seconds between sends
+PAYLOAD_FORMAT = "t{rounded}.0"  # str.format of the thermal value sent to the PLC: {value} float, {rounded} int
+FLUSH_INTERVAL = 0    # seconds of ticks batched per DB write (0 = write every tick)
+RELOAD_INTERVAL = 30  # seconds between PLC table re-reads
+PARTITION_INTERVAL = 3600  # seconds between checks for the future PLC_Logs partitions
+BACKOFF_MIN = 1       # seconds
+BACKOFF_MAX = 30      # seconds
+METRICS_HOST = "127.0.0.1"  # Prometheus text metrics on http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_PORT = 9108         # 0 = no metrics endpoint
+VERBOSE = False       # print every payload sent and response received
+
+
+class LineConfig:
+    """Endpoint and polling options of one PLC row"""
+
+    def __init__(self, plc):
+        poller = (plc.setting or {}).get("poller") or {}
+        host, _, port = plc.ip_address.strip().partition(":")
+        self.plc = plc
+        self.host = host
+        self.port = int(port) if port else int(poller.get("port", DEFAULT_PORT))
+        self.thermal_api_url = poller.get("thermal_api_url")
+        self.interval = float(poller.get("interval", INTERVAL))
+        self.timeout = float(poller.get("timeout", TIMEOUT))
+        self.flush_interval = float(poller.get("flush_interval", FLUSH_INTERVAL))
+        self.payload_format = poller.get("payload_format", PAYLOAD_FORMAT)
+        self.enabled = poller.get("enabled", True) and bool(host)
+
+    def key(self):
+        return (self.host, self.port, self.thermal_api_url, self.interval, self.timeout, self.flush_interval,
+                self.payload_format)
+
+    def payload(self, value):
+        value = float(value)
+        return self.payload_format.format(value=value, rounded=int(value + 0.5))
+
+
+class PLCConnection:
+    """Persistent TCP connection to one PLC with reconnect and exponential backoff"""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.backoff = BACKOFF_MIN
+        self.retry_at = 0
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        if loop.time() < self.retry_at:
+            raise ConnectionError(f"waiting {self.retry_at - loop.time():.0f}s before reconnecting")
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            self.retry_at = loop.time() + self.backoff
+            self.backoff = min(self.backoff * 2, BACKOFF_MAX)
+            raise
+        self.backoff = BACKOFF_MIN
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def exchange(self, payload):
+        self.writer.write(payload.encode())
+        await self.writer.drain()
+        response = await asyncio.wait_for(self.reader.read(1024), self.timeout)
+        if not response:
+            raise ConnectionResetError("connection closed by PLC")
+        return response
+
+    async def send(self, payload):
+        """Send payload to PLC and return response, reconnecting once if the PLC dropped the socket"""
+        for attempt in range(2):
+            reused = self.writer is not None
+            if not reused:
+                await self.connect()
+            try:
+                return await self.exchange(payload)
+            except (OSError, asyncio.TimeoutError):
+                await self.close()
+                if not reused or attempt:
+                    raise
+
+
+def fetch_thermal(url, params, timeout):
+    response = requests.get(url, params=params, timeout=timeout)
+    return response.json()["temperature"]
+
+
+async def poll_line(config):
+    line = PLCLine(config.plc, config.flush_interval)
+    connection = PLCConnection(config.host, config.port, config.timeout)
+    loop = asyncio.get_running_loop()
+    print(f"[{line.device_id}] polling {config.host}:{config.port} every {config.interval}s")
+    try:
+        await sync_to_async(line.hydrate)()
+        while True:
+            started = loop.time()
+            stage = "thermal"
+            try:
+                with metrics.timer("thermal", line.device_id):
+                    params = thermal_params(line)
+                    value = await asyncio.to_thread(fetch_thermal, config.thermal_api_url, params, config.timeout)
+                    payload = config.payload(value)
+
+                stage = "socket"
+                with metrics.timer("socket", line.device_id):
+                    response = await connection.send(payload)
+                if VERBOSE:
+                    print(f"[{line.device_id}] Sent: {payload} | Received: {response}")
+
+                stage = "ingest"
+                await sync_to_async(handle_response)(line, response)
+            except Exception as e:
+                metrics.inc("plc_errors_total", plc=line.device_id, stage=stage)
+                print(f"[{line.device_id}] Worker error: {e}")
+
+            elapsed = loop.time() - started
+            metrics.set("plc_lag_seconds", max(0, elapsed - config.interval), plc=line.device_id)
+            await asyncio.sleep(max(0, config.interval - elapsed))
+    finally:
+        await connection.close()
+        if line.writer.pending():
+            await sync_to_async(line.writer.flush)()
+
+
+def load_line_configs():
+    configs = {}
+    for plc in PLC.objects.exclude(ip_address__isnull=True).exclude(ip_address=""):
+        config = LineConfig(plc)
+        if not config.enabled:
+            continue
+        if not config.thermal_api_url:
+            print(f"[{plc.device_id}] skipped: setting.poller.thermal_api_url is not set")
+            continue
+        configs[plc.id] = config
+    if not configs:
+        print("No PLC to poll: run manage.py configure_poller_line for each line")
+    return configs
+
+
+async def main():
+    """Start one polling task per configured PLC and follow changes to the PLC table"""
+    tasks = {}
+    partitions_checked = None
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = await serve_metrics(METRICS_HOST, METRICS_PORT)
+        print(f"Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    try:
+        while True:
+            now = asyncio.get_running_loop().time()
+            if partitions_checked is None or now - partitions_checked >= PARTITION_INTERVAL:
+                try:
+                    await sync_to_async(ensure_partitions)()
+                    partitions_checked = now
+                except Exception as e:
+                    print(f"Partition error: {e}")
+            try:
+                configs = await sync_to_async(load_line_configs)()
+            except Exception as e:
+                print(f"Poller error: {e}")
+                configs = None
+
+            if configs is not None:
+                for plc_id in list(tasks):
+                    task, key = tasks[plc_id]
+                    if plc_id not in configs or configs[plc_id].key() != key or task.done():
+                        task.cancel()
+                        del tasks[plc_id]
+                for plc_id, config in configs.items():
+                    if plc_id not in tasks:
+                        tasks[plc_id] = (asyncio.create_task(poll_line(config)), config.key())
+
+            await asyncio.sleep(RELOAD_INTERVAL)
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+            await metrics_server.wait_closed()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nShutting down PLC poller...")
@@ -122,6 +122,8 @@ function updateSettings(data) {
     }
     
     for (const [key, value] of Object.entries(data.setting)) {
+        // poller connection options, not a PLC value
+        if (key === 'poller') continue;
         let card = grid.querySelector(`.setting-card[data-key="${key}"]`);
         const displayValue = formatDisplayValue(key, value);
         
@@ -6,6 +6,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 django.setup()
 
 from PLC_Monitoring.models import PLC,PLC_Logs
+from PLC_Monitoring.events import LOGS_CHANNEL, notify
 
 s = socket.socket()
 s.bind(("0.0.0.0", 6009))
@@ -30,7 +31,8 @@ try:
             plc = PLC(device_id=values["device_id"])
             plc.save()
 
-        PLC_Logs.objects.create(plc=plc, data=values)
+        log = PLC_Logs.objects.create(plc=plc, data=values)
+        notify([(LOGS_CHANNEL, {"new": log.id})])
 
         conn.send(b"OK")
         conn.close()
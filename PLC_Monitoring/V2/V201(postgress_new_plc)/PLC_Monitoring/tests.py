@@ -1,3 +1,78 @@
-from django.test import TestCase
+import asyncio
+import struct
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+
+import tcp_server
+from .models import PLC, PLC_Keys, PLC_Logs
+
+
+def frame(*words):
+    return struct.pack(f">{len(words)}H", *words)
+
+
+class RecordingFrames(tcp_server.FrameWriter):
+    def __init__(self):
+        super().__init__()
+        self.added = []
+
+    def add(self, words):
+        self.added.append(words)
+
+
+@mock.patch.object(tcp_server, "FRAME_GAP", 0.05)
+class FramingTests(SimpleTestCase):
+
+    def exchange(self, frames, *sends):
+        """Send every bytes of sends after the replies to the previous one; returns the replies"""
+
+        async def run():
+            server = await asyncio.start_server(lambda r, w: tcp_server.handle_plc(r, w, frames), "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            replies = []
+            for data, expected in sends:
+                writer.write(data)
+                await writer.drain()
+                replies.append(await asyncio.wait_for(reader.readexactly(2 * expected), 2))
+            writer.close()
+            await writer.wait_closed()
+            server.close()
+            await server.wait_closed()
+            return replies
+
+        return asyncio.run(run())
+
+    def test_frame_size_is_learned_from_a_lone_frame(self):
+        frames = RecordingFrames()
+        replies = self.exchange(frames, (frame(1, 2, 3), 1), (frame(4, 5, 6) + frame(7, 8, 9), 2))
+
+        self.assertEqual(replies, [b"OK", b"OKOK"])
+        self.assertEqual(frames.added, [(1, 2, 3), (4, 5, 6), (7, 8, 9)])
+        self.assertEqual(frames.frame_sizes, {"127.0.0.1": 6})
+
+    def test_configured_word_count(self):
+        frames = RecordingFrames()
+        with mock.patch.object(tcp_server, "FRAME_WORDS", 2):
+            replies = self.exchange(frames, (frame(1, 2, 3, 4), 2))
+
+        self.assertEqual(replies, [b"OKOK"])
+        self.assertEqual(frames.added, [(1, 2), (3, 4)])
+
+
+class FrameWriterTests(TestCase):
+
+    def test_words_are_matched_to_the_keys_by_position(self):
+        for key in ("sp", "t1"):
+            PLC_Keys.objects.create(key=key)
+        PLC.objects.create(device_id="plc_1")
+        frames = tcp_server.FrameWriter()
+        frames.add((100, 200, 300))
+        frames.add((110,))
+
+        frames.write(frames.take())
+
+        self.assertEqual(list(PLC_Logs.objects.order_by("id").values_list("json_data", flat=True)),
+                         [{"sp": 100, "t1": 200}, {"sp": 110}])
+        self.assertEqual(PLC.objects.get().setting, {"sp": 110, "t1": 200})
@@ -1,81 +1,190 @@
-import os, time
+import os, time, asyncio
 import django
-import socket
 import struct
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 django.setup()
 
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
 from PLC_Monitoring.models import *
-plc_key_names = ["1","2","3","4","5","6","7","8","9","10","11","12","13","14","15","16","17","18","19","20"]
-s = socket.socket()
-s.bind(("0.0.0.0", 2000))
-s.listen(5)
-s.settimeout(1.0)
 
-print("PLC TCP server started")
+HOST = "0.0.0.0"
+PORT = 2000
+FRAME_WORDS = 0             # 16-bit big-endian registers per frame; 0 = learned per PLC host from its first frame
+FRAME_GAP = 0.2             # seconds of silence that end a frame (and a burst of frames)
+IDLE_TIMEOUT = 60           # seconds before an idle connection is dropped
+FLUSH_INTERVAL = 0.5        # seconds between batched inserts
+BATCH_SIZE = 500            # frames that trigger an early flush
+KEYS_CHECK_INTERVAL = 5     # seconds between PLC_Keys change checks
 
-try:
-    while True:
+
+class KeyMap:
+    """PLC_Keys in CreationDateTime order, reloaded only when the table changes"""
+
+    def __init__(self):
+        self.keys = []
+        self.fingerprint = None
+        self.checked_at = 0
+
+    def get(self):
+        now = time.monotonic()
+        if self.fingerprint is None or now - self.checked_at >= KEYS_CHECK_INTERVAL:
+            self.checked_at = now
+            fingerprint = PLC_Keys.objects.aggregate(count=Count("id"), max_id=Max("id"), last=Max("LastUpdate"))
+            if fingerprint != self.fingerprint:
+                self.keys = list(PLC_Keys.objects.order_by("CreationDateTime").values_list("key", flat=True))
+                self.fingerprint = fingerprint
+        return self.keys
+
+
+class FrameWriter:
+    """Queues decoded frames and inserts them in batches"""
+
+    def __init__(self):
+        self.queue = []
+        self.key_map = KeyMap()
+        self.plc = None
+        self.wakeup = asyncio.Event()
+        self.frame_sizes = {}   # PLC host -> bytes per frame learned from the stream
+
+    def add(self, words):
+        self.queue.append((timezone.now(), words))
+        if len(self.queue) >= BATCH_SIZE:
+            self.wakeup.set()
+
+    def take(self):
+        frames, self.queue = self.queue, []
+        self.wakeup.clear()
+        return frames
+
+    def get_plc(self):
+        if self.plc is None:
+            self.plc = PLC.objects.first()
+            if not self.plc:
+                self.plc = PLC(device_id="plc_1",
+                               setting={})
+                self.plc.save()
+        if not self.plc.setting:
+            self.plc.setting = {}
+        return self.plc
+
+    def write(self, frames):
+        keys = self.key_map.get()
+        plc = self.get_plc()
+        logs = []
+        for created, words in frames:
+            data_dict = dict(zip(keys, words))
+            logs.append(PLC_Logs(plc=plc,
+                                 data=str(words),
+                                 json_data=data_dict,
+                                 CreationDateTime=created,
+                                 LastUpdate=created))
+            plc.setting.update(data_dict)
+        with transaction.atomic():
+            PLC_Logs.objects.bulk_create(logs)
+            plc.save(update_fields=["setting", "LastUpdate"])
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        frames = self.take()
+        if not frames:
+            return
         try:
-            conn, addr = s.accept()
-        except socket.timeout:
-            continue
-
-        #data = conn.recv(1024).decode().strip()
-        data = conn.recv(1024)
-        #words = struct.unpack(f'<{len(data)//2}H', data)
-        #print(f"================== {words} ===================")
-        #words = struct.unpack(f'!{len(data)//2}H', data)
-        #print(f"================== {words} ===================")
-        data = struct.unpack(f'>{len(data)//2}H', data)
-        #print(f"================== {data} ===================")
-        #floats = struct.unpack('<f', data[4:8])
-        #print(f"================== {floats} ===================")
-        # print(type(data))
-        print(f"=============== {data} =================")
-        # for k in plc_key_names:
-        #     get_or_creat_plc_key, created = PLC.objects.get_or_create(key=k)
-        PLC_KEYS = PLC_Keys.objects.all().order_by("CreationDateTime")
-        plc = PLC.objects.first()
-        if not plc:
-            plc = PLC(device_id="plc_1",
-                      setting={})
-            plc.save()
-        if not plc.setting:
-            plc.setting = {}
-        data_dict = {}
-        i =0
-        for x in PLC_KEYS:
-            print(x.key)
+            await sync_to_async(self.write)(frames)
+        except Exception as ex:
+            self.plc = None
+            print(f"Write error ({len(frames)} frames dropped): {ex}")
+
+
+def decode(frame):
+    return struct.unpack(f'>{len(frame)//2}H', frame)
+
+
+async def handle_plc(reader, writer, frames):
+    """Split the stream of a PLC into frames of its word count and reply OK per frame.
+
+    The word count is FRAME_WORDS or, when that is 0, the length of the first frame the PLC host sent
+    alone (ended by FRAME_GAP of silence or by the end of its connection). The words are matched to
+    PLC_Keys by position when written, so a frame may carry more or fewer words than there are keys.
+    """
+    addr = writer.get_extra_info("peername")
+    host = addr[0] if addr else None
+    print(f"PLC connected: {addr}")
+    buffer = bytearray()
+    burst = 0   # bytes received since the last silence
+    try:
+        while True:
             try:
-                data_dict[x.key] = data[i]
-                i += 1
-            except Exception as ex:
-                print(ex)
-                break
+                chunk = await asyncio.wait_for(reader.read(4096), FRAME_GAP if buffer else IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if not buffer:
+                    break
+                chunk = None
+
+            closed = chunk == b""
+            if chunk:
+                buffer.extend(chunk)
+                burst += len(chunk)
 
-        plc_log = PLC_Logs(plc=plc,
-                           data=data,
-                           json_data=data_dict)
-        plc_log.save()
-        plc.setting.update(data_dict)
-        plc.save()
-        # values = dict(x.split("=") for x in data.split(";"))
+            frame_size = FRAME_WORDS * 2 or frames.frame_sizes.get(host)
+            replies = 0
+            while frame_size and len(buffer) >= frame_size:
+                frames.add(decode(buffer[:frame_size]))
+                del buffer[:frame_size]
+                replies += 1
+            if chunk is None or closed:
+                if len(buffer) >= 2:
+                    if burst == len(buffer) and not FRAME_WORDS:
+                        # a frame sent alone: the word count of this PLC (again, if it changed)
+                        frames.frame_sizes[host] = len(buffer) - len(buffer) % 2
+                    elif frame_size:
+                        print(f"PLC {addr}: frame of {len(buffer)} bytes after frames of {frame_size}")
+                    frames.add(decode(buffer[:len(buffer) - len(buffer) % 2]))
+                    replies += 1
+                buffer.clear()
+                burst = 0
 
-        # plc = PLC.objects.filter(device_id=values["device_id"]).last()
-        # if not plc:
-        #     plc = PLC(device_id=values["device_id"])
-        #     plc.save()
+            if replies and not closed:
+                writer.write(b"OK" * replies)
+                await writer.drain()
+            if closed:
+                break
+    except (ConnectionError, OSError) as ex:
+        print(f"PLC {addr} connection error: {ex}")
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+        print(f"PLC disconnected: {addr}")
 
-        # PLC_Logs.objects.create(plc=plc, data=values)
 
-        conn.send(b"OK")
-        conn.close()
+async def main():
+    frames = FrameWriter()
+    flusher = asyncio.create_task(frames.run())
+    server = await asyncio.start_server(lambda r, w: handle_plc(r, w, frames), HOST, PORT)
+    print("PLC TCP server started")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        flusher.cancel()
+        await frames.flush()
 
-except KeyboardInterrupt:
-    print("\nShutting down PLC TCP server...")
-    s.close()
-finally:
-    s.close()
 
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nShutting down PLC TCP server...")
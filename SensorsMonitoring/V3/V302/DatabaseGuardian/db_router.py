@@ -4,7 +4,7 @@ class SensorDataRouter:
     """روتر برای هدایت کوئری‌های save_logs به دیتابیس مناسب"""
     
     # All save_logs models that should use the current rotated database
-    sensor_models = {'device', 'device_sensor', 'sensorlogs'}
+    sensor_models = {'device', 'device_sensor', 'sensorlogs', 'sensorvalue'}
     guardian_models = {'databaseconfig', 'databaseregistry', 'globaldatabaseselection'}
     
     def db_for_read(self, model, **hints):
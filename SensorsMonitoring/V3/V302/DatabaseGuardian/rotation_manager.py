@@ -168,7 +168,10 @@ class RotationManager:
     
     def _copy_master_data(self, source_db, target_db, keep_logs_count):
         """کپی داده‌های Device و Device_Sensor به دیتابیس جدید"""
-        from save_logs.models import Device, Device_Sensor, SensorLogs
+        from save_logs.models import Device, Device_Sensor, SensorLogs, SensorValue
+        from save_logs.values import sensor_values
+        from save_logs.pruning import recount_sensors
+        from save_logs.latest import fill_latest
         
         # Copy devices
         devices = Device.objects.using(source_db).all()
@@ -200,12 +203,20 @@ class RotationManager:
                         sensor_type=old_sensor_type
                     )
                     
+                    copied = []
                     for log in recent_logs:
                         log.pk = None
                         log.sensor = new_sensor
+                        log.values_parsed = True
                         log.save(using=target_db)
+                        copied.append(log)
+                    SensorValue.objects.using(target_db).bulk_create(sensor_values(copied))
             except Exception as e:
                 print(f"Error copying sensor {sensor}: {e}")
+        
+        # the copied sensors still carry the counters and latest reading of the source database
+        recount_sensors(using=target_db)
+        fill_latest(using=target_db)
     
     def update_db_stats(self, db_name=None):
         """بروزرسانی آمار دیتابیس"""
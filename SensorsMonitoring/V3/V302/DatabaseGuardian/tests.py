@@ -0,0 +1,46 @@
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.test import TestCase, override_settings
+
+from save_logs.models import Device, Device_Sensor, SensorLogs, SensorValue
+from .models import DatabaseConfig
+from .rotation_manager import RotationManager, _current_db_cache
+
+
+class RotationTests(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir, ignore_errors=True)
+        self.addCleanup(_current_db_cache.update, {'name': 'default', 'loaded': False})
+
+    def forget(self, db_name):
+        connections[db_name].close()
+        del connections[db_name]
+        del settings.DATABASES[db_name]
+
+    def test_copied_sensors_are_counted_in_the_new_database(self):
+        config = DatabaseConfig.get_config()
+        config.keep_logs_count = 2
+        config.save()
+        sensor = Device_Sensor.objects.create(device=Device.objects.create(device_id="D1"), sensor_type="th")
+        start = time.time() - 1000
+        for index in range(5):
+            log = SensorLogs.objects.create(sensor=sensor, data=f'{{"temp": {20 + index}}}')
+            SensorLogs.objects.filter(id=log.id).update(CreationDateTime=start + index, LastUpdate=start + index)
+        Device_Sensor.objects.filter(id=sensor.id).update(logs_count=5, first_log_time=start,
+                                                           last_log_time=start + 4, last_data='{"temp": 24}')
+
+        with override_settings(BASE_DIR=self.base_dir):
+            registry, status = RotationManager().create_new_database()
+        self.addCleanup(self.forget, registry.name)
+
+        self.assertEqual(status, "success")
+        copied = Device_Sensor.objects.using(registry.name).get(device__device_id="D1", sensor_type="th")
+        self.assertEqual((copied.logs_count, copied.first_log_time, copied.last_log_time, copied.last_data),
+                         (2, start + 3, start + 4, '{"temp": 24}'))
+        self.assertEqual(SensorValue.objects.using(registry.name).filter(sensor=copied).count(), 2)
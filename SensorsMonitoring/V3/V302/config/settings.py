@@ -57,7 +57,6 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'save_logs.middleware.check_fake_data',
     'DatabaseGuardian.middleware.DatabaseSelectionMiddleware',
 ]
 
@@ -170,6 +169,7 @@ MULTI_DB_MODELS = [
     'save_logs.Device',
     'save_logs.Device_Sensor',
     'save_logs.SensorLogs',
+    'save_logs.SensorValue',
 ]
 
 # Business keys for deduplication and cross-DB FK lookups
@@ -177,5 +177,10 @@ MULTI_DB_MODELS = [
 MULTI_DB_BUSINESS_KEYS = {
     'save_logs.Device': ['device_id'],
     'save_logs.Device_Sensor': ['device__device_id', 'sensor_type'],
-    # SensorLogs: no dedup needed - all records are unique
+    # SensorLogs, SensorValue: no dedup needed - all records are unique
 }
+
+# Single-writer ingestion queue of save_logs (see save_logs/writer.py)
+SENSOR_WRITE_QUEUE_SIZE = 10000   # readings waiting to be written before post_data answers 503
+SENSOR_WRITE_BATCH_SIZE = 500     # readings committed per transaction
+SENSOR_WRITE_MAX_LATENCY = 0.5    # seconds a reading may wait for its batch to fill
@@ -1,3 +1,81 @@
-from django.test import TestCase
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from save_logs.models import Device, Device_Sensor, SensorLogs, SensorValue
+from save_logs.values import convert_logs
+from .timeseries import EXPORT_FORMATS, Labels, bounds_mask, build_series, resample
+
+START = 1700000000.0
+
+
+def reference_resample(times, keep, offset):
+    """The row by row loop the charts were built with"""
+    points = []
+    last = times[0]
+    for index in range(1, len(times)):
+        if last + offset >= times[index]:
+            continue
+        difference = times[index] - last
+        if difference >= offset * 2:
+            for _ in range(1, int(difference / offset)):
+                last += offset
+                points.append((None, last))
+        if keep[index]:
+            points.append((index, times[index]))
+            last = times[index]
+    return points
+
+
+class ResampleTests(SimpleTestCase):
+
+    def setUp(self):
+        random = np.random.default_rng(3)
+        # readings every few minutes with a few outages of several hours
+        steps = random.exponential(600, 2000)
+        steps[random.choice(2000, 15, replace=False)] += random.uniform(7200, 30000, 15)
+        self.times = START + np.cumsum(steps)
+        self.values = random.normal(25, 4, 2000)
+
+    def test_matches_the_row_by_row_loop(self):
+        for bounds in (None, {"min_value": "20", "max_value": "30"}, {"min_value": "", "max_value": "22"}):
+            keep = bounds_mask(self.values, bounds)
+            self.assertEqual(resample(self.times, keep, 3600), reference_resample(self.times, keep, 3600))
+
+    def test_series_without_offset_keeps_the_filtered_rows(self):
+        series = build_series("temp", self.times, self.values, False, {"min_value": "20", "max_value": "30"},
+                              EXPORT_FORMATS, Labels())
+
+        inside = (self.values[1:] >= 20) & (self.values[1:] <= 30)
+        self.assertEqual(series["data"], [float(self.values[0])] + [float(f"{value:.2f}") for value in self.values[1:][inside]])
+        self.assertEqual(series["s"], [float(self.times[0])] + self.times[1:][inside].tolist())
+        self.assertEqual(len(series["timestamps"]), len(series["data"]))
+
+
+class DeviceInfoJsonTests(TestCase):
+
+    def setUp(self):
+        device = Device.objects.create(device_id="D1")
+        self.sensor = Device_Sensor.objects.create(device=device, sensor_type="th")
+
+    def log(self, minutes, data):
+        created = START + minutes * 60
+        log = SensorLogs.objects.create(sensor=self.sensor, data=data)
+        SensorLogs.objects.filter(id=log.id).update(CreationDateTime=created, LastUpdate=created)
+
+    def test_hourly_points_after_the_first_reading(self):
+        for minutes in range(0, 300, 20):
+            self.log(minutes, str({"temp": f"{20 + minutes / 100:.3f}", "mode": "auto", "timestamp": START}))
+        # the older logs are converted to SensorValue, the newer ones are parsed on the fly
+        convert_logs("default")
+        SensorLogs.objects.filter(CreationDateTime__gte=START + 200 * 60).update(values_parsed=None)
+        SensorValue.objects.filter(CreationDateTime__gte=START + 200 * 60).delete()
+
+        response = self.client.get(reverse("device_info_json", args=[self.sensor.id]))
+
+        self.assertEqual(response.json(), [{
+            "type": "temp",
+            "data": [20.8, 21.6, 22.4],
+            "timestamps": [START + 80 * 60, START + 160 * 60, START + 240 * 60],
+            "time": START + 240 * 60,
+        }])
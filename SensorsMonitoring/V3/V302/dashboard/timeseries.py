@@ -0,0 +1,245 @@
+"""Time-series engine behind chart_info_json and export_data.
+
+The numeric values of a sensor are read once per request from SensorValue (parsed at ingestion,
+see save_logs/values.py) and split into one NumPy (times, values) pair per metric; logs that are
+not converted yet are parsed on the fly. Resampling, gap filling, min/max filtering and the AI
+alignment then work on those arrays: the hourly resampling jumps from one kept point to the next
+with searchsorted instead of visiting every row, and the min/max filter is one boolean mask.
+
+The output keeps the shape the templates expect: one dict per metric with "type", "data",
+"ai_data", "timestamps", "time" and "s".
+"""
+import datetime
+
+import jdatetime
+import numpy as np
+
+from save_logs.models import SensorLogs, SensorValue
+from save_logs.values import parse_values
+
+MIN_POINTS = 10     # series with this many points or fewer are not shown
+AI_MATCH = 3600     # seconds a reading may be ahead of the AI point it is compared with
+
+# label formats: the first point, resampled points and gap fillers, raw points, trailing AI points
+CHART_FORMATS = {"first": " %d %b - %H:%M", "resampled": " %d %b - %H:%M", "raw": " %d %b %H:%M:%S", "ai": " %d %b %H:%M:%S"}
+EXPORT_FORMATS = dict.fromkeys(("first", "resampled", "raw", "ai"), "%Y-%m-%d %H:%M:%S")
+
+
+def sensor_querysets(model, sensor, **filters):
+    """Querysets of model rows of the sensor, one per selected database"""
+    from DatabaseGuardian.managers import is_multi_db_mode, get_multi_db_context
+
+    if not is_multi_db_mode():
+        return [model.objects.filter(sensor=sensor, **filters)]
+    # sensor ids differ between the rotated databases, match by device and sensor type
+    _, databases = get_multi_db_context()
+    return [
+        model.objects.using(db).filter(sensor__device__device_id=sensor.device.device_id,
+                                       sensor__sensor_type=sensor.sensor_type, **filters)
+        for db in databases
+    ]
+
+
+def value_rows(sensor, start=None, end=None):
+    """(metric, CreationDateTime, value) of the sensor in [start, end], from every selected database"""
+    filters = {}
+    if start is not None:
+        filters["CreationDateTime__gte"] = start
+    if end is not None:
+        filters["CreationDateTime__lte"] = end
+    for queryset in sensor_querysets(SensorValue, sensor, **filters):
+        try:
+            yield from queryset.order_by("CreationDateTime", "id").values_list("metric", "CreationDateTime", "value").iterator(chunk_size=5000)
+        except Exception as e:
+            print(f"[MultiDB] Error querying {queryset.db}: {e}")
+    # logs of a database convert_sensor_values has not reached yet
+    for queryset in sensor_querysets(SensorLogs, sensor, values_parsed__isnull=True, **filters):
+        try:
+            for created, data in queryset.values_list("CreationDateTime", "data").iterator(chunk_size=5000):
+                for metric, value in parse_values(data):
+                    yield metric, created, value
+        except Exception as e:
+            print(f"[MultiDB] Error querying {queryset.db}: {e}")
+
+
+def load_series(sensor, start=None, end=None):
+    """{metric: (times, values)} of the sensor sorted by time, metrics in order of appearance"""
+    columns = {}
+    for metric, created, value in value_rows(sensor, start, end):
+        column = columns.get(metric)
+        if column is None:
+            column = columns[metric] = ([], [])
+        column[0].append(created)
+        column[1].append(value)
+
+    series = {}
+    for key, (times, values) in columns.items():
+        times = np.asarray(times, dtype=float)
+        order = np.argsort(times, kind="stable")
+        series[key] = (times[order], np.asarray(values, dtype=float)[order])
+    return dict(sorted(series.items(), key=lambda item: item[1][0][0]))
+
+
+def bounds_mask(values, bounds):
+    """Values inside the min/max filter of a metric; an empty (or zero) bound is not applied"""
+    keep = np.ones(len(values), dtype=bool)
+    if bounds:
+        if bounds.get("min_value"):
+            keep &= values >= float(bounds["min_value"])
+        if bounds.get("max_value"):
+            keep &= values <= float(bounds["max_value"])
+    return keep
+
+
+def resample(times, keep, offset):
+    """Hourly offset resampling of the rows after the first one.
+
+    A row is taken when it is more than offset seconds after the last taken point (and passes the
+    filter); a gap of two offsets or more is filled with one empty point per offset. Returns the
+    taken row indices and the filler times in output order as [(index or None, time)].
+    """
+    kept = np.flatnonzero(keep)
+    points = []
+    last = times[0]
+    position = 1
+    while True:
+        candidate = max(position, int(np.searchsorted(times, last + offset, side="right")))
+        if candidate >= len(times):
+            break
+        # rejected rows in between only extend the fillers, which the next kept row does as well
+        following = np.searchsorted(kept, candidate)
+        index = int(kept[following]) if following < len(kept) else len(times) - 1
+        difference = times[index] - last
+        if difference >= offset * 2:
+            for _ in range(1, int(difference / offset)):
+                last += offset
+                points.append((None, last))
+        if not keep[index]:
+            break
+        points.append((index, times[index]))
+        last = times[index]
+        position = index + 1
+    return points
+
+
+def round2(value):
+    # as the templates always showed it: the shortest float of the 2-decimal text, not np.round
+    return float(f"{value:.2f}")
+
+
+class Labels:
+    """Jalali labels of unix times, formatted once per minute"""
+
+    def __init__(self):
+        self.minutes = {}
+
+    def __call__(self, timestamp, format):
+        with_seconds = format.endswith(":%S")
+        prefix = format[:-3] if with_seconds else format
+        minute = int(timestamp // 60)
+        label = self.minutes.get((minute, prefix))
+        if label is None:
+            label = self.minutes[(minute, prefix)] = jdatetime.datetime.fromgregorian(
+                datetime=datetime.datetime.fromtimestamp(minute * 60)).strftime(prefix)
+        return f"{label}:{int(timestamp) % 60:02d}" if with_seconds else label
+
+
+def build_series(key, times, values, offset, bounds, formats, labels):
+    """Chart series of one metric: the first row as is, the rest resampled (offset) or filtered"""
+    keep = bounds_mask(values, bounds)
+    data = [float(values[0])]
+    stamps = [times[0]]
+    formats_used = [formats["first"]]
+    if offset:
+        points = resample(times, keep, offset)
+        data += [round2(values[index]) if index is not None else None for index, when in points]
+        stamps += [when for index, when in points]
+        formats_used += [formats["resampled"]] * len(points)
+        last = stamps[-1]
+    else:
+        keep[0] = False
+        data += [round2(value) for value in values[keep]]
+        stamps += times[keep].tolist()
+        formats_used += [formats["raw"]] * int(keep.sum())
+        last = times[0]
+    return {
+        "type": key,
+        "data": data,
+        "ai_data": [],
+        "timestamps": [labels(when, format) for when, format in zip(stamps, formats_used)],
+        "time": float(last),
+        "s": [float(when) for when in stamps],
+    }
+
+
+def local_hours(times):
+    """Local hour number of each unix time, vectorized when the UTC offset is constant over the range"""
+    times = np.asarray(times, dtype=float)
+    if not len(times):
+        return np.empty(0, dtype=np.int64)
+
+    def utc_offset(timestamp):
+        return datetime.datetime.fromtimestamp(timestamp).astimezone().utcoffset().total_seconds()
+
+    samples = np.append(np.arange(times.min(), times.max(), 86400), times.max())
+    offsets = {utc_offset(timestamp) for timestamp in samples}
+    if len(offsets) == 1:
+        return np.floor((times + offsets.pop()) / 3600).astype(np.int64)
+    return np.array([
+        (lambda local: local.toordinal() * 24 + local.hour)(datetime.datetime.fromtimestamp(timestamp))
+        for timestamp in times
+    ], dtype=np.int64)
+
+
+def align_ai(series, ai_series, formats, labels):
+    """Fill series["ai_data"] with the AI prediction of the same local hour (or the latest one the
+    reading has passed), then append the predictions beyond the last reading"""
+    ai_times, ai_values = ai_series.get(series["type"], (np.empty(0), np.empty(0)))
+    ai_values = [float(value) for value in ai_values]
+    count = len(ai_times)
+    if not count:
+        return series
+    stamps = series["s"]
+    reading_hours = local_hours(stamps)
+    ai_hours = local_hours(ai_times)
+    ai_data = series["ai_data"]
+    current = 0
+    for index, when in enumerate(stamps):
+        if current >= count:
+            break
+        if when - ai_times[current] > AI_MATCH:
+            current += 1
+            if current >= count:
+                break
+        same_hour = reading_hours[index] == ai_hours[current] or (
+            current + 1 < count and reading_hours[index] == ai_hours[current + 1])
+        if same_hour or when > ai_times[current]:
+            ai_data.append(ai_values[current])
+            current += 1
+        else:
+            ai_data.append(None)
+
+    later = np.flatnonzero(ai_times[current:] >= stamps[-1]) + current
+    for index in later:
+        series["data"].append(None)
+        ai_data.append(ai_values[index])
+        series["timestamps"].append(labels(ai_times[index], formats["ai"]))
+    return series
+
+
+def chart_series(sensor, start, end, offset, filters, formats, ai_sensor=None, ai_start=None, ai_end=None):
+    """Series of every metric of the sensor with more than MIN_POINTS points; the AI predictions of
+    ai_sensor in [ai_start, ai_end] are aligned to the first one"""
+    labels = Labels()
+    filters = {item["type"]: item for item in filters or []}
+    result = []
+    if sensor.sensor_type != "status":
+        for key, (times, values) in load_series(sensor, start, end).items():
+            series = build_series(key, times, values, offset, filters.get(key), formats, labels)
+            if len(series["data"]) > MIN_POINTS:
+                result.append(series)
+    if ai_sensor is not None and result:
+        align_ai(result[0], load_series(ai_sensor, ai_start, ai_end), formats, labels)
+    for series in result:
+        series["target_filter_data"] = filters.get(series["type"], []) if filters else []
+    return result
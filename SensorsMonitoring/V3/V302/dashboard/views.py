@@ -2,12 +2,17 @@ from django.shortcuts import render
 from save_logs.models import *
 from django.views.decorators.csrf import csrf_exempt
 from django.http import StreamingHttpResponse,JsonResponse,HttpResponse
-import time, json, jdatetime, datetime, platform, locale, os
+from django.core.handlers.asgi import ASGIRequest
+import time, json, jdatetime, datetime, platform, locale, os, asyncio
 from django.db.models import Q
 from django.core.paginator import Paginator
 from django.conf import settings
 import csv
 from io import BytesIO
+from .timeseries import chart_series, load_series, resample, bounds_mask, round2, CHART_FORMATS, EXPORT_FORMATS
+from save_logs.latest import latest_readings
+from save_logs.cache import device_cache
+from save_logs.hub import reading_hub
 try:
     from openpyxl import Workbook
     from openpyxl.styles import Font, PatternFill, Alignment
@@ -15,13 +20,18 @@ try:
 except ImportError:
     OPENPYXL_AVAILABLE = False
 
+SSE_KEEPALIVE = 15   # seconds between keep-alive messages of an idle live stream
+
 def dashboard(request):
     all_devices = Device.objects.all()
+    # one query for the sensors of every device; the status comes from their last_log_time / logs_count
+    sensors_by_device = {}
+    for sensor in Device_Sensor.objects.select_related('device').order_by('id'):
+        sensors_by_device.setdefault(sensor.device.device_id, []).append(sensor)
     data = []
     for device in all_devices:
         response = {'device':device}
-        sensors = Device_Sensor.objects.filter(device=device)
-        response["sensors"] = sensors
+        response["sensors"] = sensors_by_device.get(device.device_id, [])
         data.append(response)
     #print(data)
     context = {
@@ -32,54 +42,23 @@ def dashboard(request):
     return render(request, 'dashboard/dashboard.html', context)
 
 def device_info_json(request,sensor_id):
+    """Every metric of the sensor, one point per hour after its first reading, from SensorValue"""
     sensor = Device_Sensor.objects.get(id=sensor_id)
-    data = SensorLogs.objects.filter(sensor=sensor)
 
-    now = time.time()
     offset = 60*60
     chart_data = []
-    #average_data = []
-    for x in data:
-        index = 0
-        if not x.sensor.sensor_type == "status":
-            try:
-                target_data = json.loads(x.data.replace("'",'"')).items()
-            except:
-                print(x.data)
-                continue
-            for key, value in target_data:
-                try:
-                    value = float(value)
-                except:
-                    value = None
-                if not key == "timestamp" and not key == "type" and value != "" and value is not None:
-                    if key not in [x["type"] for x in chart_data]:
-                        #average_data.append({"type":key,"average":value,"index":1})
-                        chart_data.append({"type":key,"data":[],"timestamps":[],"time":float(x.LastUpdate)})
-                    else:
-                        if offset:
-                            if chart_data[index]["time"] + offset < float(x.LastUpdate): 
-                            #avg = (average_data[index]["average"] / average_data[index]["index"])
-                                chart_data[index]["data"].append(float(f'{value:.2f}'))
-                                chart_data[index]["timestamps"].append(float(x.CreationDateTime))
-                                chart_data[index]["time"] = float(x.LastUpdate)
-                        else:
-                            chart_data[index]["data"].append(float(f'{value:.2f}'))
-                            chart_data[index]["timestamps"].append(float(x.CreationDateTime))
-
-                        # average_data[index]["average"] = valuez
-                        # average_data[index]["index"] = 1
-                            # print(average_data[index]["type"],value,average_data[index]["average"],average_data[index]["index"],average_data[index]["average"] / average_data[index]["index"])
-                        # else:
-                        #     # print(average_data[index]["type"],value,average_data[index]["average"],average_data[index]["index"],average_data[index]["average"] / average_data[index]["index"])
-                        #     # open("average_data.txt","a").write(f"{average_data[index]['type']} {value} {average_data[index]['average']} {average_data[index]['index']} {average_data[index]['average'] / average_data[index]['index']}\n")
-                        #     average_data[index]["average"] += value
-                        #     average_data[index]["index"] += 1
-                    index += 1
-                #time.sleep(0.01)
-    chart_data = [x for x in chart_data if x["data"]]
-    return JsonResponse(list(chart_data),safe=False)
-    return JsonResponse(list(data.values()),safe=False)
+    if not sensor.sensor_type == "status":
+        for key, (times, values) in load_series(sensor).items():
+            # the first reading only starts the clock, gaps get no empty points here
+            points = [(index, when) for index, when in resample(times, bounds_mask(values, None), offset) if index is not None]
+            if points:
+                chart_data.append({
+                    "type": key,
+                    "data": [round2(values[index]) for index, when in points],
+                    "timestamps": [float(when) for index, when in points],
+                    "time": float(points[-1][1]),
+                })
+    return JsonResponse(chart_data,safe=False)
 
 def device_info(request,device_id,sensor_id):
     device = Device.objects.get(id=device_id)
@@ -108,266 +87,101 @@ def device_info(request,device_id,sensor_id):
     }
     return render(request, 'dashboard/device_info.html', context)
 
+def chart_options(request, sensor):
+    """Filters and time range of a chart/export request, shared by chart_info_json and export_data"""
+    filter_by_week = True if "week" in request.GET else False
+    filter_by_month = True if "month" in request.GET else False
+    filter_by_daily = True if "daily" in request.GET else False
+
+    # Parse JSON data from request body
+    request_data = json.loads(request.body.decode('utf-8'))
+    filter_data = request_data.get('filter_data') or []
+    date_range_start = request_data.get('date_range_start')
+    date_range_end = request_data.get('date_range_end')
+    time_choices = request_data.get('time_choices')
+    ranges = [name for name, selected in (('week', filter_by_week), ('month', filter_by_month), ('daily', filter_by_daily)) if selected] or ['hourly']
+    target_filter_data = [item for name in ranges for item in filter_data if item['range'] == name]
+
+    now = time.time()
+    filter_time = 60*60*24*7 if filter_by_week else 60*60*24*30 if filter_by_month else 60*60*24 if filter_by_daily else 60*60
+    offset = False if filter_time == 3600 or "ai" in (sensor.device.name).lower() else 60*60
+    start, end = now - filter_time, None
+    if date_range_start and date_range_end:
+        start = int(time.mktime(jdatetime.date(*map(int, date_range_start.split("-")[:3])).togregorian().timetuple()))
+        end = int(time.mktime(jdatetime.date(*map(int, date_range_end.split("-")[:3])).togregorian().timetuple()))
+        if time_choices == "hourly":
+            offset = 3600
+        elif time_choices == "minute":
+            offset = False
+    return {
+        'filter_data': target_filter_data,
+        'filter_time': filter_time,
+        'offset': offset,
+        'start': start,
+        'end': end,
+        'now': now,
+        'time_range_name': "Weekly" if filter_by_week else "Monthly" if filter_by_month else "Daily" if filter_by_daily else "Hourly",
+    }
+
+
+def ai_sensor_of(sensor):
+    ai_sensor = Device_Sensor.objects.filter(AI_Target=sensor.id).first()
+    return ai_sensor if ai_sensor and ai_sensor.Is_AI else None
+
+
 # Chart info JSON "device_info.html"
 @csrf_exempt
 def chart_info_json(request,sensor_id):
     if request.method == 'POST':
         sensor = Device_Sensor.objects.get(id=sensor_id)
-        ai_sensor = Device_Sensor.objects.filter(AI_Target=sensor.id)
-        has_ai = False
-        if ai_sensor.first() and ai_sensor.first().Is_AI:
-            ai_sensor = ai_sensor.first()
-            has_ai = True
-        data = SensorLogs.objects.filter(sensor=sensor)
-        if has_ai:
-            ai_data = SensorLogs.objects.filter(sensor=ai_sensor)
-
-        filter_by_week = True if "week" in request.GET else False
-        filter_by_month = True if "month" in request.GET else False
-        filter_by_daily = True if "daily" in request.GET else False
-        
-        # Parse JSON data from request body
-        request_data = json.loads(request.body.decode('utf-8'))
-        filter_data = request_data.get('filter_data')
-        date_range_start = request_data.get('date_range_start')
-        date_range_end = request_data.get('date_range_end')
-        time_choices = request_data.get('time_choices')
-        target_filter_data = []
-        if filter_by_week:
-            for item in filter_data:
-                if item['range'] == 'week':
-                    min_value = item['min_value']
-                    max_value = item['max_value']
-                    filter_type = item['type']
-                    target_filter_data.append(item)
-        if filter_by_month:
-            for item in filter_data:
-                if item['range'] == 'month':
-                    min_value = item['min_value']
-                    max_value = item['max_value']
-                    filter_type = item['type']
-                    target_filter_data.append(item)
-        if filter_by_daily:
-            for item in filter_data:
-                if item['range'] == 'daily':
-                    min_value = item['min_value']
-                    max_value = item['max_value']
-                    filter_type = item['type']
-                    target_filter_data.append(item)
-        if not filter_by_week and not filter_by_month and not filter_by_daily:
-            for item in filter_data:
-                if item['range'] == 'hourly':
-                    min_value = item['min_value']
-                    max_value = item['max_value']
-                    filter_type = item['type']
-                    target_filter_data.append(item)
-        now = time.time()
-        filter_time = 60*60*24*7 if filter_by_week else 60*60*24*30 if filter_by_month else 60*60*24 if filter_by_daily else 60*60
-        offset = False if filter_time == 3600 or "ai" in (sensor.device.name).lower() else 60*60
-        
-        if date_range_start and date_range_end:
-            date_range_start = int(time.mktime(jdatetime.date(int(date_range_start.split("-")[0]), int(date_range_start.split("-")[1]), int(date_range_start.split("-")[2])).togregorian().timetuple()))
-            date_range_end = int(time.mktime(jdatetime.date(int(date_range_end.split("-")[0]), int(date_range_end.split("-")[1]), int(date_range_end.split("-")[2])).togregorian().timetuple()))
-            data = data.filter(CreationDateTime__gte=date_range_start, CreationDateTime__lte=date_range_end)
-            if time_choices == "hourly":
-                offset = 3600
-            elif time_choices == "minute":
-                offset = False
-        else:
-            data = data.filter(CreationDateTime__gte=now - filter_time)
-
-        if has_ai:
-            ai_data = ai_data.filter(CreationDateTime__gte=now - filter_time)
-
-        chart_data = []
-        min_set = False
-        max_set = False
-        for x in data:
-            ai_index = 0
-            index = 0
-            if not x.sensor.sensor_type == "status":
-                try:
-                    target_data = json.loads(x.data.replace("'",'"')).items()
-                except:
-                    print(x.data)
-                    continue
-                for key, value in target_data:
-                    try:
-                        value = float(value)
-                    except:
-                        value = None
-                    if not key == "timestamp" and not key == "type" and value != "" and value is not None:
+        options = chart_options(request, sensor)
+        # no AI line on the hourly chart
+        ai_sensor = ai_sensor_of(sensor) if options['filter_time'] != 3600 else None
+        chart_data = chart_series(
+            sensor, options['start'], options['end'], options['offset'], options['filter_data'], CHART_FORMATS,
+            ai_sensor=ai_sensor, ai_start=options['now'] - options['filter_time'],
+        )
+        return JsonResponse(chart_data,safe=False)
+    return JsonResponse({'status': 'error'})
 
-                        if key not in [x["type"] for x in chart_data]:
-                            chart_data.append({"type":key,"data":[value],"ai_data":[],"timestamps":[str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(x.CreationDateTime))).strftime(" %d %b - %H:%M"))],"time":float(x.CreationDateTime),"s":[float(x.CreationDateTime)]})
-                        else:
-                            min_value = False
-                            max_value = False
-                            if target_filter_data:
-                                for item in target_filter_data:
-                                    if item['type'] == key:
-                                        min_value = item['min_value']
-                                        max_value = item['max_value']
-                                        break
-                            if offset:
-                                diff = float(x.CreationDateTime) - chart_data[index]["time"]
-                                if chart_data[index]["time"] + offset < float(x.CreationDateTime):
-                                    if not diff >= offset*2:
-                                        if min_value or max_value:
-                                            if not min_value:
-                                                min_value = float(value)
-                                                min_set = True
-                                            if not max_value:
-                                                max_set = True
-                                                max_value = float(value)
-                                            if float(value) >= float(min_value) and float(value) <= float(max_value):
-                                                chart_data[index]["data"].append(float(f'{value:.2f}'))
-                                                chart_data[index]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(x.CreationDateTime))).strftime(" %d %b - %H:%M")))
-                                                chart_data[index]["time"] = float(x.CreationDateTime)
-                                                chart_data[index]["s"].append(float(x.CreationDateTime))
+def reading_message(event):
+    resp = dict(event)
+    resp["CreationDateTime"] = str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(event["CreationDateTime"]))).strftime("%a, %d %b %Y %H:%M:%S"))
+    return 'data: %s\n\n' % json.dumps(resp)
 
-                                        else:
-                                            chart_data[index]["data"].append(float(f'{value:.2f}'))
-                                            chart_data[index]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(x.CreationDateTime))).strftime(" %d %b - %H:%M")))
-                                            chart_data[index]["time"] = float(x.CreationDateTime)
-                                            chart_data[index]["s"].append(float(x.CreationDateTime))
-                                    else:
-                                        for i in range(1,int(diff/offset)):
-                                            chart_data[index]["data"].append(None)
-                                            chart_data[index]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(chart_data[index]["time"] + offset))).strftime(" %d %b - %H:%M")))
-                                            chart_data[index]["time"] = float(chart_data[index]["time"] + offset)
-                                            chart_data[index]["s"].append(float(chart_data[index]["time"]))
-                                        if min_value or max_value:
-                                            if not min_value:
-                                                min_value = float(value)
-                                                min_set = True
-                                            if not max_value:
-                                                max_set = True
-                                                max_value = float(value)
-                                            if float(value) >= float(min_value) and float(value) <= float(max_value):
-                                                chart_data[index]["data"].append(float(f'{value:.2f}'))
-                                                chart_data[index]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(x.CreationDateTime))).strftime(" %d %b - %H:%M")))
-                                                chart_data[index]["time"] = float(x.CreationDateTime)
-                                                chart_data[index]["s"].append(float(x.CreationDateTime))
-                                        else:
-                                            chart_data[index]["data"].append(float(f'{value:.2f}'))
-                                            chart_data[index]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(x.CreationDateTime))).strftime(" %d %b - %H:%M")))
-                                            chart_data[index]["time"] = float(x.CreationDateTime)
-                                            chart_data[index]["s"].append(float(x.CreationDateTime))
-                            else:
-                                if min_value or max_value:
-                                    if not min_value:
-                                        min_value = float(value)
-                                        min_set = True
-                                    if not max_value:
-                                        max_set = True
-                                        max_value = float(value)
-                                    if float(value) >= float(min_value) and float(value) <= float(max_value):
-                                        chart_data[index]["data"].append(float(f'{value:.2f}'))
-                                        chart_data[index]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(x.CreationDateTime))).strftime(" %d %b %H:%M:%S")))
-                                        chart_data[index]["s"].append(float(x.CreationDateTime))
-                                else:
-                                    chart_data[index]["data"].append(float(f'{value:.2f}'))
-                                    chart_data[index]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(x.CreationDateTime))).strftime(" %d %b %H:%M:%S")))
-                                    chart_data[index]["s"].append(float(x.CreationDateTime))
-                            if min_value or max_value:
-                                if min_set:
-                                    min_value = False
-                                    min_set = False
-                                if max_set:
-                                    max_value = False
-                                    max_set = False
-                        index += 1
-        chart_data = [x for x in chart_data if x["data"] and len(x["data"]) > 10]
-        if has_ai and chart_data and not filter_time == 3600:
-            index=0
-            ai_index=0
-            for x in chart_data[0]["data"]:
-                if ai_index < ai_data.count():
-                    difference = chart_data[0]["s"][index] - ai_data[ai_index].CreationDateTime
-                    if difference > 3600:
-                        ai_index += 1
-                    t1 = datetime.datetime.fromtimestamp(chart_data[0]["s"][index])
-                    t2 = datetime.datetime.fromtimestamp(ai_data[ai_index].CreationDateTime)
-                    # Same logic applies:
-                    IS_SAME = (
-                        t1.year == t2.year and
-                        t1.month == t2.month and
-                        t1.day == t2.day and
-                        t1.hour == t2.hour
-                    )
-                    if not IS_SAME:
-                        try:
-                            t2 = datetime.datetime.fromtimestamp(ai_data[ai_index+1].CreationDateTime)
-                            IS_SAME_2 = (
-                                t1.year == t2.year and
-                                t1.month == t2.month and
-                                t1.day == t2.day and
-                                t1.hour == t2.hour
-                            )
-                            if IS_SAME_2:
-                                IS_SAME = True
-                            else:
-                                IS_SAME = False
-                        except:
-                            IS_SAME = False
-                        
-                    check_index = index
-                    if IS_SAME or chart_data[0]["s"][index] > ai_data[ai_index].CreationDateTime: #(difference <= 1800 and difference >= 0) or (difference >= -1800 and difference <= 0):
-                        ai_target_data = json.loads(ai_data[ai_index].data.replace("'",'"'))
-                        chart_data[0]["ai_data"].append(float(ai_target_data[chart_data[0]["type"]]))
-                        ai_index += 1
-                    else:
-                        chart_data[0]["ai_data"].append(None)
-                    index += 1
-            if ai_index < ai_data.count():
-                for x in range(ai_data.count()-(ai_index)):
-                    if not ai_data[ai_index].CreationDateTime < chart_data[0]["s"][-1]:
-                        ai_target_data = json.loads(ai_data[ai_index].data.replace("'",'"'))
-                        chart_data[0]["data"].append(None)
-                        chart_data[0]["ai_data"].append(float(ai_target_data[chart_data[0]["type"]]))
-                        chart_data[0]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(ai_data[ai_index].CreationDateTime))).strftime(" %d %b %H:%M:%S")))
-                    ai_index += 1
-        for x in chart_data:
-            if target_filter_data:
-                for item in target_filter_data:
-                    if x["type"] == item["type"]:
-                        x["target_filter_data"] = item
-                        break
-            else:
-                x["target_filter_data"] = []
-        return JsonResponse(list(chart_data),safe=False)
-    return JsonResponse({'status': 'error'})
+def reading_stream(device_id, sensor_type):
+    subscription = reading_hub.subscribe(device_id, sensor_type)
+    try:
+        yield 'data: {}\n\n'
+        while True:
+            event = subscription.get(SSE_KEEPALIVE)
+            # an empty message keeps the connection (and the disconnect check) alive
+            yield reading_message(event) if event else 'data: {}\n\n'
+    finally:
+        subscription.close()
 
-@csrf_exempt
-def ask_for_device(request):
-    def event_stream():
-        LAST_DATA_TIME = float(SensorLogs.objects.all().last().CreationDateTime)
+async def async_reading_stream(device_id, sensor_type):
+    subscription = reading_hub.subscribe(device_id, sensor_type, loop=asyncio.get_running_loop())
+    try:
+        yield 'data: {}\n\n'
         while True:
-            time.sleep(1)
-            target = SensorLogs.objects.all().last()
-            if target:
-                if float(target.CreationDateTime) > LAST_DATA_TIME:
-                    print("some data recived")
-                    resp = {
-                        "device_id": target.sensor.device.device_id,
-                        "ip_address": target.sensor.device.ip_address,
-                        "Is_Known": target.sensor.device.Is_Known,
-                        "sensor_type": target.sensor.sensor_type,
-                        "location": target.sensor.device.location,
-                        "name": target.sensor.device.name,
-                        "data": target.data,
-                        "CreationDateTime": str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(target.CreationDateTime))).strftime("%a, %d %b %Y %H:%M:%S")),
-                    }
-                    LAST_DATA_TIME = float(target.CreationDateTime)
-                    yield 'data: %s\n\n' % json.dumps(resp)
-                yield 'data: {}\n\n'
-            else:
-                # Send keep-alive to maintain connection
-                yield 'data: {}\n\n'
-            time.sleep(1)
+            event = await subscription.aget(SSE_KEEPALIVE)
+            yield reading_message(event) if event else 'data: {}\n\n'
+    finally:
+        subscription.close()
 
-    return StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+def ask_for_device(request):
+    """Live stream (SSE) of every stored reading, or only those of ?device_id= / ?sensor_type=.
+    Waits on the reading hub: a coroutine under ASGI, a worker thread per stream under WSGI."""
+    device_id = request.GET.get('device_id') or None
+    sensor_type = request.GET.get('sensor_type') or None
+    if isinstance(request, ASGIRequest):
+        stream = async_reading_stream(device_id, sensor_type)
+    else:
+        stream = reading_stream(device_id, sensor_type)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
 
 @csrf_exempt
 def add_device(request):
@@ -382,12 +196,24 @@ def add_device(request):
             target.location = location
             target.Is_Known = True
             target.save()
+            # the writer's cached device still says unknown
+            device_cache.clear()
             print("device added successfully | now we now the device name and location")
             return JsonResponse({'status': 'ok'})
         else:
             return JsonResponse({'status': 'error'})
     return JsonResponse({'status': 'error'})
 
+def latest_sensor_times():
+    """{sensor_id: (sensor_type, last_log_time)} from the in-memory mirror of the current database,
+    or with one query on the sensor table when other databases are selected"""
+    from DatabaseGuardian.managers import is_multi_db_mode, get_single_selected_db, get_current_write_db
+    database = get_current_write_db()
+    if not is_multi_db_mode() and get_single_selected_db() in (None, database):
+        return {sensor_id: entry[:2] for sensor_id, entry in latest_readings.snapshot(database).items()}
+    sensors = Device_Sensor.objects.only('id', 'sensor_type', 'last_log_time').order_by('id')
+    return {sensor.id: (sensor.sensor_type, sensor.last_log_time) for sensor in sensors}
+
 @csrf_exempt
 def get_sensor_status(request):
     """API endpoint to get sensor status data for real-time updates"""
@@ -396,25 +222,13 @@ def get_sensor_status(request):
         current_time = time.time()
         two_minutes_ago = current_time - 120
         
-        # Get all sensors with their latest log
-        sensors = Device_Sensor.objects.all()
-        
-        for sensor in sensors:
-            if sensor.sensor_type != "status":
-                last_log = sensor.sensor_logs.last()
-                if last_log:
-                    is_online = last_log.CreationDateTime > two_minutes_ago
-                    sensors_status.append({
-                        'sensor_id': sensor.id,
-                        'last_update': last_log.CreationDateTime,
-                        'is_online': is_online
-                    })
-                else:
-                    sensors_status.append({
-                        'sensor_id': sensor.id,
-                        'last_update': None,
-                        'is_online': False
-                    })
+        for sensor_id, (sensor_type, last_update) in latest_sensor_times().items():
+            if sensor_type != "status":
+                sensors_status.append({
+                    'sensor_id': sensor_id,
+                    'last_update': last_update,
+                    'is_online': last_update is not None and last_update > two_minutes_ago
+                })
         
         return JsonResponse({
             'status': 'success',
@@ -550,6 +364,7 @@ def update_device(request):
                 device.description = request.POST.get('description', '').strip() or None
             
             device.save()
+            device_cache.clear()
             
             return JsonResponse({'status': 'success', 'message': 'Device updated successfully'})
         except Device.DoesNotExist:
@@ -581,6 +396,7 @@ def update_sensor(request):
                 sensor.description = request.POST.get('description', '').strip() or None
             
             sensor.save()
+            latest_readings.clear()
             
             return JsonResponse({'status': 'success', 'message': 'Sensor updated successfully'})
         except Device_Sensor.DoesNotExist:
@@ -594,227 +410,18 @@ def update_sensor(request):
 def export_data(request, sensor_id):
     """Export chart data as Excel file with separate sheets for each data type"""
     try:
-        print("_______________export_data_______________")
         sensor = Device_Sensor.objects.get(id=sensor_id)
-        ai_sensor = Device_Sensor.objects.filter(AI_Target=sensor.id)
-        has_ai = False
-        if ai_sensor.first() and ai_sensor.first().Is_AI:
-            ai_sensor = ai_sensor.first()
-            has_ai = True
-        data = SensorLogs.objects.filter(sensor=sensor)
-        if has_ai:
-            ai_data = SensorLogs.objects.filter(sensor=ai_sensor)
-
-        filter_by_week = True if "week" in request.GET else False
-        filter_by_month = True if "month" in request.GET else False
-        filter_by_daily = True if "daily" in request.GET else False
-        
-        # Parse JSON data from request body
-        request_data = json.loads(request.body.decode('utf-8'))
-        filter_data = request_data.get('filter_data')
-        date_range_start = request_data.get('date_range_start')
-        date_range_end = request_data.get('date_range_end')
-        time_choices = request_data.get('time_choices')
-        export_choices = request.POST.get('export_choices', '1')
-        print("date_range_start",date_range_start)
-        print("date_range_end",date_range_end)
-        print("time_choices",time_choices)
-        print("export_choices",export_choices)
-        target_filter_data = []
-        time_range_name = "Hourly"
-        if filter_by_week:
-            time_range_name = "Weekly"
-            for item in filter_data:
-                if item['range'] == 'week':
-                    min_value = item['min_value']
-                    max_value = item['max_value']
-                    filter_type = item['type']
-                    target_filter_data.append(item)
-        if filter_by_month:
-            time_range_name = "Monthly"
-            for item in filter_data:
-                if item['range'] == 'month':
-                    min_value = item['min_value']
-                    max_value = item['max_value']
-                    filter_type = item['type']
-                    target_filter_data.append(item)
-        if filter_by_daily:
-            time_range_name = "Daily"
-            for item in filter_data:
-                if item['range'] == 'daily':
-                    min_value = item['min_value']
-                    max_value = item['max_value']
-                    filter_type = item['type']
-                    target_filter_data.append(item)
-        if not filter_by_week and not filter_by_month and not filter_by_daily:
-            time_range_name = "Hourly"
-            for item in filter_data:
-                if item['range'] == 'hourly':
-                    min_value = item['min_value']
-                    max_value = item['max_value']
-                    filter_type = item['type']
-                    target_filter_data.append(item)
-
-        now = time.time()
-        filter_time = 60*60*24*7 if filter_by_week else 60*60*24*30 if filter_by_month else 60*60*24 if filter_by_daily else 60*60
-        offset = False if filter_time == 3600 or "ai" in (sensor.device.name).lower() else 60*60
-        if not export_choices == "1":
+        options = chart_options(request, sensor)
+        time_range_name = options['time_range_name']
+        offset = options['offset']
+        if not request.POST.get('export_choices', '1') == "1":
             offset = False
-        if date_range_start and date_range_end:
-            date_range_start = int(time.mktime(jdatetime.date(int(date_range_start.split("-")[0]), int(date_range_start.split("-")[1]), int(date_range_start.split("-")[2])).togregorian().timetuple()))
-            date_range_end = int(time.mktime(jdatetime.date(int(date_range_end.split("-")[0]), int(date_range_end.split("-")[1]), int(date_range_end.split("-")[2])).togregorian().timetuple()))
-            data = data.filter(CreationDateTime__gte=date_range_start, CreationDateTime__lte=date_range_end)
-            if has_ai:
-                ai_data = ai_data.filter(CreationDateTime__gte=date_range_start, CreationDateTime__lte=date_range_end)
-            if time_choices == "hourly":
-                offset = 3600
-            elif time_choices == "minute":
-                offset = False
-        else:
-            data = data.filter(CreationDateTime__gte=now - filter_time)
-
-            if has_ai:
-                ai_data = ai_data.filter(CreationDateTime__gte=now - filter_time)
-
-        chart_data = []
-        min_set = False
-        max_set = False
-        for x in data:
-            ai_index = 0
-            index = 0
-            if not x.sensor.sensor_type == "status":
-                for key, value in json.loads(x.data.replace("'",'"')).items():
-                    try:
-                        value = float(value)
-                    except:
-                        value = None
-                    if not key == "timestamp" and not key == "type" and value != "" and value is not None:
-                        if key not in [x["type"] for x in chart_data]:
-                            chart_data.append({"type":key,"data":[value],"ai_data":[],"timestamps":[str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(x.CreationDateTime))).strftime("%Y-%m-%d %H:%M:%S"))],"time":float(x.CreationDateTime),"s":[float(x.CreationDateTime)]})
-                        else:
-                            min_value = False
-                            max_value = False
-                            if target_filter_data:
-                                for item in target_filter_data:
-                                    if item['type'] == key:
-                                        min_value = item['min_value']
-                                        max_value = item['max_value']
-                                        break
-                            if offset:
-                                diff = float(x.CreationDateTime) - chart_data[index]["time"]
-                                if chart_data[index]["time"] + offset < float(x.CreationDateTime):
-                                    if not diff > offset:
-                                        if min_value or max_value:
-                                            if not min_value:
-                                                min_value = float(value)
-                                                min_set = True
-                                            if not max_value:
-                                                max_set = True
-                                                max_value = float(value)
-                                            if float(value) >= float(min_value) and float(value) <= float(max_value):
-                                                chart_data[index]["data"].append(float(f'{value:.2f}'))
-                                                chart_data[index]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(x.CreationDateTime))).strftime("%Y-%m-%d %H:%M:%S")))
-                                                chart_data[index]["time"] = float(x.CreationDateTime)
-                                                chart_data[index]["s"].append(float(x.CreationDateTime))
-
-                                            else:
-                                                chart_data[index]["data"].append(float(f'{value:.2f}'))
-                                                chart_data[index]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(x.CreationDateTime))).strftime("%Y-%m-%d %H:%M:%S")))
-                                                chart_data[index]["time"] = float(x.CreationDateTime)
-                                                chart_data[index]["s"].append(float(x.CreationDateTime))
-                                    else:
-                                        for i in range(1,int(diff/offset)):
-                                            chart_data[index]["data"].append(None)
-                                            chart_data[index]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(chart_data[index]["time"] + offset))).strftime("%Y-%m-%d %H:%M:%S")))
-                                            chart_data[index]["time"] = float(chart_data[index]["time"] + offset)
-                                            chart_data[index]["s"].append(float(chart_data[index]["time"] + offset))
-
-                                        chart_data[index]["data"].append(float(f'{value:.2f}'))
-                                        chart_data[index]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(x.CreationDateTime))).strftime("%Y-%m-%d %H:%M:%S")))
-                                        chart_data[index]["time"] = float(x.CreationDateTime)
-                                        chart_data[index]["s"].append(float(x.CreationDateTime))
-                            else:
-                                if min_value or max_value:
-                                    if not min_value:
-                                        min_value = float(value)
-                                        min_set = True
-                                    if not max_value:
-                                        max_set = True
-                                        max_value = float(value)
-                                    if float(value) >= float(min_value) and float(value) <= float(max_value):
-                                        chart_data[index]["data"].append(float(f'{value:.2f}'))
-                                        chart_data[index]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(x.CreationDateTime))).strftime("%Y-%m-%d %H:%M:%S")))
-                                        chart_data[index]["s"].append(float(x.CreationDateTime))
-                                else:
-                                    chart_data[index]["data"].append(float(f'{value:.2f}'))
-                                    chart_data[index]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(x.CreationDateTime))).strftime("%Y-%m-%d %H:%M:%S")))
-                                    chart_data[index]["s"].append(float(x.CreationDateTime))
-                            if min_value or max_value:
-                                if min_set:
-                                    min_value = False
-                                    min_set = False
-                                if max_set:
-                                    max_value = False
-                                    max_set = False
-                        index += 1
-        chart_data = [x for x in chart_data if x["data"] and len(x["data"]) > 10]
-        if has_ai and chart_data and not filter_time == 3600:
-            index=0
-            ai_index=0
-            for x in chart_data[0]["data"]:
-                if ai_index < ai_data.count():
-                    difference = chart_data[0]["s"][index] - ai_data[ai_index].CreationDateTime
-                    if difference > 3600:
-                        ai_index += 1
-                    t1 = datetime.datetime.fromtimestamp(chart_data[0]["s"][index])
-                    t2 = datetime.datetime.fromtimestamp(ai_data[ai_index].CreationDateTime)
-                    # Same logic applies:
-                    IS_SAME = (
-                        t1.year == t2.year and
-                        t1.month == t2.month and
-                        t1.day == t2.day and
-                        t1.hour == t2.hour
-                    )
-                    if not IS_SAME:
-                        try:
-                            t2 = datetime.datetime.fromtimestamp(ai_data[ai_index+1].CreationDateTime)
-                            IS_SAME_2 = (
-                                t1.year == t2.year and
-                                t1.month == t2.month and
-                                t1.day == t2.day and
-                                t1.hour == t2.hour
-                            )
-                            if IS_SAME_2:
-                                IS_SAME = True
-                            else:
-                                IS_SAME = False
-                        except:
-                            IS_SAME = False
-                        
-                    check_index = index
-                    if IS_SAME or chart_data[0]["s"][index] > ai_data[ai_index].CreationDateTime: #(difference <= 1800 and difference >= 0) or (difference >= -1800 and difference <= 0):
-                        ai_target_data = json.loads(ai_data[ai_index].data.replace("'",'"'))
-                        chart_data[0]["ai_data"].append(float(ai_target_data[chart_data[0]["type"]]))
-                        ai_index += 1
-                    else:
-                        chart_data[0]["ai_data"].append(None)
-                    index += 1
-            if ai_index < ai_data.count():
-                for x in range(ai_data.count()-(ai_index)):
-                    if not ai_data[ai_index].CreationDateTime < chart_data[0]["s"][-1]:
-                        ai_target_data = json.loads(ai_data[ai_index].data.replace("'",'"'))
-                        chart_data[0]["data"].append(None)
-                        chart_data[0]["ai_data"].append(float(ai_target_data[chart_data[0]["type"]]))
-                        chart_data[0]["timestamps"].append(str(jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromtimestamp(float(ai_data[ai_index].CreationDateTime))).strftime("%Y-%m-%d %H:%M:%S")))
-                    ai_index += 1
-        for x in chart_data:
-            if target_filter_data:
-                for item in target_filter_data:
-                    if x["type"] == item["type"]:
-                        x["target_filter_data"] = item
-                        break
-            else:
-                x["target_filter_data"] = []
+        # the export reads the AI predictions of the same range as the readings
+        ai_sensor = ai_sensor_of(sensor) if options['filter_time'] != 3600 else None
+        chart_data = chart_series(
+            sensor, options['start'], options['end'], offset, options['filter_data'], EXPORT_FORMATS,
+            ai_sensor=ai_sensor, ai_start=options['start'], ai_end=options['end'],
+        )
         if not chart_data:
             return JsonResponse({'status': 'error', 'message': 'دیتا وجود ندارد'})
         
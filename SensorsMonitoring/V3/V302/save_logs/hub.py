@@ -0,0 +1,124 @@
+"""In-process broadcast of the stored readings to live subscribers.
+
+The ingestion writer publishes every log it commits; each subscriber (one per open live view, see
+dashboard ask_for_device) gets the events matching its optional device_id / sensor_type filter in
+its own bounded queue. Subscribers are either threads (WSGI: blocking get()) or coroutines of an
+event loop (ASGI: await aget()), so an idle live view waits on its queue instead of polling the
+database, and publishing costs nothing while nobody is subscribed.
+"""
+import asyncio
+import queue
+from threading import Lock
+
+QUEUE_SIZE = 1000   # events a slow subscriber may fall behind before the oldest are dropped
+
+
+class Subscription:
+    """Queue of the events of one subscriber; close() it when the subscriber goes away"""
+
+    def __init__(self, hub, device_id=None, sensor_type=None, loop=None):
+        self.hub = hub
+        self.device_id = device_id
+        self.sensor_type = sensor_type
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE) if loop else queue.Queue(QUEUE_SIZE)
+        self.dropped = 0
+
+    def matches(self, event):
+        return (self.device_id is None or event['device_id'] == self.device_id) and (
+            self.sensor_type is None or event['sensor_type'] == self.sensor_type)
+
+    def deliver(self, event):
+        """Called from the publishing thread"""
+        if self.loop is None:
+            self._put(event)
+        else:
+            self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except (queue.Full, asyncio.QueueFull):
+                # keep the newest readings
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except (queue.Empty, asyncio.QueueEmpty):
+                    pass
+
+    def get(self, timeout=None):
+        """Next event, or None after timeout seconds (thread subscribers)"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def aget(self, timeout=None):
+        """Next event, or None after timeout seconds (event loop subscribers)"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class ReadingHub:
+    def __init__(self):
+        self._subscriptions = []
+        self._lock = Lock()
+
+    def subscribe(self, device_id=None, sensor_type=None, loop=None):
+        """New subscription; pass the running event loop for an async subscriber"""
+        subscription = Subscription(self, device_id, sensor_type, loop)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def publish(self, events):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            for event in events:
+                if not subscription.matches(event):
+                    continue
+                try:
+                    subscription.deliver(event)
+                except RuntimeError:
+                    # its event loop is closed
+                    self.unsubscribe(subscription)
+                    break
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscriptions), 'dropped': sum(s.dropped for s in self._subscriptions)}
+
+
+def reading_event(log):
+    """Event of a committed SensorLogs row (its sensor and device are already loaded by the writer)"""
+    device = log.sensor.device
+    return {
+        'device_id': device.device_id,
+        'ip_address': device.ip_address,
+        'Is_Known': device.Is_Known,
+        'sensor_type': log.sensor.sensor_type,
+        'location': device.location,
+        'name': device.name,
+        'data': log.data,
+        'CreationDateTime': log.CreationDateTime,
+    }
+
+
+# Global hub instance
+reading_hub = ReadingHub()
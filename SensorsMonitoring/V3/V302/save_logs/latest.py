@@ -0,0 +1,81 @@
+"""Latest reading of every sensor.
+
+The ingestion writer keeps Device_Sensor.last_log_time / last_data up to date in the transaction that
+writes the logs, so the dashboard reads the newest reading of each sensor from the small sensor table
+instead of the logs. latest_readings mirrors those columns in memory for the current write database:
+it is loaded with one query on first use (and again every RELOAD_INTERVAL seconds, to pick up sensors
+edited or deleted elsewhere) and updated by the writer after each commit, so get_sensor_status
+answers without touching the database.
+"""
+import time
+from threading import Lock
+
+from django.db.models import OuterRef, Subquery
+
+from .models import Device_Sensor, SensorLogs
+
+RELOAD_INTERVAL = 60    # seconds before the mirror is reloaded from the database
+
+
+def fill_latest(sensor_model=Device_Sensor, logs_model=SensorLogs, using='default'):
+    """Set last_log_time / last_data of every sensor from its newest log, in one UPDATE"""
+    newest = logs_model.objects.using(using).filter(sensor=OuterRef('pk')).order_by('-CreationDateTime')
+    return sensor_model.objects.using(using).update(
+        last_log_time=Subquery(newest.values('CreationDateTime')[:1]),
+        last_data=Subquery(newest.values('data')[:1]),
+    )
+
+
+def newest_logs(logs):
+    """{sensor_id: newest log} of a list of logs"""
+    newest = {}
+    for log in logs:
+        current = newest.get(log.sensor_id)
+        if current is None or log.CreationDateTime >= current.CreationDateTime:
+            newest[log.sensor_id] = log
+    return newest
+
+
+class LatestReadings:
+    """Thread-safe {sensor_id: [sensor_type, last_log_time, last_data]} per database"""
+
+    def __init__(self):
+        self._sensors = {}      # {db_name: {sensor_id: [sensor_type, last_log_time, last_data]}}
+        self._loaded_at = {}    # {db_name: monotonic time of the last load}
+        self._lock = Lock()
+
+    def _load(self, db_name):
+        rows = Device_Sensor.objects.using(db_name).values_list('id', 'sensor_type', 'last_log_time', 'last_data')
+        # under the lock, so a commit the query missed is applied by update() right after
+        self._sensors[db_name] = {sensor_id: [sensor_type, last_time, data] for sensor_id, sensor_type, last_time, data in rows}
+        self._loaded_at[db_name] = time.monotonic()
+
+    def snapshot(self, db_name):
+        """Copy of the sensors of db_name, loading them when the mirror is empty or old"""
+        with self._lock:
+            loaded_at = self._loaded_at.get(db_name)
+            if loaded_at is None or time.monotonic() - loaded_at > RELOAD_INTERVAL:
+                self._load(db_name)
+            return {sensor_id: tuple(entry) for sensor_id, entry in self._sensors[db_name].items()}
+
+    def update(self, db_name, logs):
+        """Apply committed logs (with their sensor objects) to the mirror of db_name"""
+        with self._lock:
+            sensors = self._sensors.get(db_name)
+            if sensors is None:
+                return
+            for sensor_id, log in newest_logs(logs).items():
+                entry = sensors.get(sensor_id)
+                if entry is None:
+                    sensors[sensor_id] = [log.sensor.sensor_type, log.CreationDateTime, log.data]
+                elif entry[1] is None or log.CreationDateTime >= entry[1]:
+                    entry[1:] = [log.CreationDateTime, log.data]
+
+    def clear(self):
+        with self._lock:
+            self._sensors.clear()
+            self._loaded_at.clear()
+
+
+# Global mirror instance
+latest_readings = LatestReadings()
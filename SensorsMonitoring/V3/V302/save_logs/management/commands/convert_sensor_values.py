@@ -0,0 +1,30 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from save_logs.values import CONVERT_BATCH_SIZE, convert_logs
+
+
+class Command(BaseCommand):
+    help = "Migrate the sensor databases (default and every rotated one) and fill SensorValue for the logs written before it existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", action="append", help="Database alias to convert (repeatable, default: all sensor databases)")
+        parser.add_argument("--batch-size", type=int, default=CONVERT_BATCH_SIZE, help="Logs converted per transaction")
+        parser.add_argument("--skip-migrate", action="store_true", help="Do not run migrate on the databases first")
+
+    def handle(self, *args, **options):
+        from DatabaseGuardian.rotation_manager import RotationManager
+
+        RotationManager().load_all_databases()
+        databases = options["database"] or list(settings.DATABASES)
+        for database in databases:
+            if database not in settings.DATABASES:
+                raise CommandError(f"Unknown database {database!r}")
+
+        for database in databases:
+            if not options["skip_migrate"]:
+                # rotated databases were migrated once, when they were created
+                call_command("migrate", "save_logs", database=database, verbosity=0)
+            count = convert_logs(database, options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(f"Converted {count} logs in {database}"))
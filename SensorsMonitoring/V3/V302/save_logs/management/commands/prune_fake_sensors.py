@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from save_logs.latest import fill_latest
+from save_logs.pruning import fake_sensors, prune_fake_sensors, recount_sensors
+
+
+class Command(BaseCommand):
+    help = "Remove fake sensors (few logs, first log older than 30 minutes); --recount rebuilds the per-sensor log counters and latest readings first."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", help="Database alias (default: the current write database)")
+        parser.add_argument("--recount", action="store_true", help="Rebuild logs_count / first_log_time / last_log_time / last_data from the logs")
+        parser.add_argument("--dry-run", action="store_true", help="Only list the sensors that would be removed")
+
+    def handle(self, *args, **options):
+        from DatabaseGuardian.managers import get_current_write_db
+        from DatabaseGuardian.rotation_manager import RotationManager
+
+        RotationManager().load_all_databases()
+        database = options["database"] or get_current_write_db()
+        if database not in settings.DATABASES:
+            raise CommandError(f"Unknown database {database!r}")
+
+        if options["recount"]:
+            count = recount_sensors(using=database)
+            fill_latest(using=database)
+            self.stdout.write(f"Recounted {count} sensors in {database}")
+
+        if options["dry_run"]:
+            for sensor in fake_sensors(database).select_related("device"):
+                self.stdout.write(f"{sensor.device.device_id}/{sensor.sensor_type}: {sensor.logs_count} logs")
+            return
+
+        removed = prune_fake_sensors(database)
+        self.stdout.write(self.style.SUCCESS(f"Removed {len(removed)} fake sensors from {database}"))
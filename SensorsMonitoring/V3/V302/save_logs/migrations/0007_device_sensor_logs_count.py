@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+def fill_counters(apps, schema_editor):
+    from save_logs.pruning import recount_sensors
+    recount_sensors(
+        apps.get_model('save_logs', 'Device_Sensor'),
+        apps.get_model('save_logs', 'SensorLogs'),
+        using=schema_editor.connection.alias,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('save_logs', '0006_alter_device_creationdatetime_alter_device_device_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device_sensor',
+            name='first_log_time',
+            field=models.FloatField(blank=True, null=True, verbose_name='زمان اولین لاگ'),
+        ),
+        migrations.AddField(
+            model_name='device_sensor',
+            name='logs_count',
+            field=models.IntegerField(default=0, verbose_name='تعداد لاگ'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('save_logs', '0007_device_sensor_logs_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensorlogs',
+            name='values_parsed',
+            field=models.BooleanField(blank=True, null=True, verbose_name='مقادیر عددی'),
+        ),
+        migrations.CreateModel(
+            name='SensorValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=50)),
+                ('value', models.FloatField()),
+                ('CreationDateTime', models.FloatField(verbose_name='زمان ساخت')),
+                ('log', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='values', to='save_logs.sensorlogs')),
+                ('sensor', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='sensor_values', to='save_logs.device_sensor')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['sensor', 'metric', 'CreationDateTime'], name='save_logs_s_sensor__3264b6_idx')],
+            },
+        ),
+    ]
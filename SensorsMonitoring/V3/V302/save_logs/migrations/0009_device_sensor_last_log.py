@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:29
+
+from django.db import migrations, models
+
+
+def fill_last_log(apps, schema_editor):
+    from save_logs.latest import fill_latest
+    fill_latest(
+        apps.get_model('save_logs', 'Device_Sensor'),
+        apps.get_model('save_logs', 'SensorLogs'),
+        using=schema_editor.connection.alias,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('save_logs', '0008_sensorvalue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device_sensor',
+            name='last_data',
+            field=models.TextField(blank=True, null=True, verbose_name='آخرین داده'),
+        ),
+        migrations.AddField(
+            model_name='device_sensor',
+            name='last_log_time',
+            field=models.FloatField(blank=True, null=True, verbose_name='زمان آخرین لاگ'),
+        ),
+        migrations.RunPython(fill_last_log, migrations.RunPython.noop),
+    ]
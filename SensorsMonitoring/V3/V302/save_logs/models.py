@@ -32,6 +32,12 @@ class Device_Sensor(models.Model):
     Is_AI = models.BooleanField(default=False)
     AI_Target = models.CharField(max_length=50,blank=True,null=True)
     description = models.TextField(blank=True,null=True)
+    # maintained by the ingestion writer, so the fake-sensor pruning needs no COUNT over the logs
+    logs_count = models.IntegerField(default=0,verbose_name="تعداد لاگ")
+    first_log_time = models.FloatField(verbose_name="زمان اولین لاگ",null=True,blank=True)
+    # newest log of the sensor, for the status indicators without reading the logs
+    last_log_time = models.FloatField(verbose_name="زمان آخرین لاگ",null=True,blank=True)
+    last_data = models.TextField(verbose_name="آخرین داده",null=True,blank=True)
     CreationDateTime = models.FloatField(max_length=50,verbose_name="زمان ساخت",null=True,blank=True,db_index=True)
     LastUpdate = models.FloatField(max_length=50,verbose_name="آخرین آپدیت",null=True,blank=True)
 
@@ -50,6 +56,9 @@ class Device_Sensor(models.Model):
 class SensorLogs(models.Model):
     sensor = models.ForeignKey(Device_Sensor,on_delete=models.CASCADE,related_name="sensor_logs",db_index=True)
     data = models.TextField()
+    # True once the numeric fields of data are in SensorValue; null (not False) so adding the column
+    # to a large rotated database does not rebuild the table
+    values_parsed = models.BooleanField(verbose_name="مقادیر عددی",null=True,blank=True)
     CreationDateTime = models.FloatField(verbose_name="زمان ساخت",null=True,blank=True,db_index=True)
     LastUpdate = models.FloatField(max_length=50,verbose_name="آخرین آپدیت",null=True,blank=True)
 
@@ -63,4 +72,19 @@ class SensorLogs(models.Model):
         if not self.CreationDateTime:
             self.CreationDateTime = time.time()
         self.LastUpdate = time.time()
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+class SensorValue(models.Model):
+    """One numeric field of a SensorLogs row, parsed once at ingestion so charts read plain numbers"""
+    log = models.ForeignKey(SensorLogs,on_delete=models.CASCADE,related_name="values",db_index=True)
+    # covered by the (sensor, metric, CreationDateTime) index
+    sensor = models.ForeignKey(Device_Sensor,on_delete=models.CASCADE,related_name="sensor_values",db_index=False)
+    metric = models.CharField(max_length=50)
+    value = models.FloatField()
+    CreationDateTime = models.FloatField(verbose_name="زمان ساخت")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sensor', 'metric', 'CreationDateTime']),
+        ]
@@ -0,0 +1,64 @@
+"""Periodic removal of fake sensors.
+
+A sensor is fake when it got fewer than FAKE_MIN_LOGS logs and its first log is older than
+FAKE_MIN_AGE seconds (a device that announced itself once and never reported again, or a typo in
+a sensor_type); AI sensors are never removed. The check reads the logs_count / first_log_time
+counters the ingestion writer keeps on Device_Sensor, so it is one query on the (small) sensor
+table and never scans the logs. It runs on the writer thread every PRUNE_INTERVAL seconds and
+from the prune_fake_sensors command.
+"""
+import time
+
+from django.db import transaction
+from django.db.models import Count, Min
+
+from .models import Device_Sensor, SensorLogs
+from .cache import device_cache
+from .latest import latest_readings
+
+FAKE_MIN_LOGS = 10       # sensors with fewer logs than this ...
+FAKE_MIN_AGE = 60 * 30   # ... whose first log is older than this many seconds are removed
+PRUNE_INTERVAL = 60      # seconds between runs on the writer thread
+
+
+def fake_sensors(using=None, now=None):
+    now = now or time.time()
+    sensors = Device_Sensor.objects.using(using) if using else Device_Sensor.objects
+    return sensors.filter(
+        Is_AI=False,
+        logs_count__lt=FAKE_MIN_LOGS,
+        first_log_time__lt=now - FAKE_MIN_AGE,
+    )
+
+
+def prune_fake_sensors(using=None):
+    """Delete the fake sensors (and their logs), returns [(device_id, sensor_type)] of the removed ones"""
+    if using is None:
+        from DatabaseGuardian.managers import get_current_write_db
+        using = get_current_write_db()
+    with transaction.atomic(using=using):
+        targets = list(fake_sensors(using).select_related('device'))
+        for sensor in targets:
+            print(f"Fake data detected for sensor {sensor.sensor_type} with device: {sensor.device}")
+        if targets:
+            Device_Sensor.objects.using(using).filter(pk__in=[sensor.pk for sensor in targets]).delete()
+    if targets:
+        # the cached sensor rows are gone
+        device_cache.clear()
+        latest_readings.clear()
+    return [(sensor.device.device_id, sensor.sensor_type) for sensor in targets]
+
+
+def recount_sensors(sensor_model=Device_Sensor, logs_model=SensorLogs, using='default'):
+    """Rebuild logs_count / first_log_time of every sensor with one grouped query over the logs"""
+    counters = {
+        row['sensor_id']: row
+        for row in logs_model.objects.using(using).values('sensor_id').annotate(count=Count('id'), first=Min('CreationDateTime'))
+    }
+    sensors = list(sensor_model.objects.using(using).all())
+    for sensor in sensors:
+        row = counters.get(sensor.pk, {'count': 0, 'first': None})
+        sensor.logs_count = row['count']
+        sensor.first_log_time = row['first']
+    sensor_model.objects.using(using).bulk_update(sensors, ['logs_count', 'first_log_time'], batch_size=500)
+    return len(sensors)
@@ -1,3 +1,280 @@
-from django.test import TestCase
+import asyncio
+import json
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .cache import device_cache
+from .hub import QUEUE_SIZE, ReadingHub, reading_hub
+from .latest import fill_latest, latest_readings
+from .models import Device, Device_Sensor, SensorLogs, SensorValue
+from .pruning import FAKE_MIN_AGE, FAKE_MIN_LOGS, prune_fake_sensors, recount_sensors
+from . import views
+from .values import convert_logs, parse_values
+from .views import store_readings
+from .writer import IngestWriter, QueueFull
+
+
+def reading(device_id="D1", sensor_type="th", offset=0, **data):
+    return {"device_id": device_id, "sensor_type": sensor_type, "ip": "10.0.0.5",
+            "timestamp": time.time() - 100 + offset, "data": data}
+
+
+class StoreReadingsTests(TestCase):
+
+    def setUp(self):
+        device_cache.clear()
+
+    def test_values_point_at_their_logs_without_returning_bulk_insert(self):
+        # SQLite before 3.35 cannot return the ids of a bulk insert
+        with mock.patch.object(type(connection.features), "can_return_rows_from_bulk_insert",
+                               new_callable=mock.PropertyMock, return_value=False):
+            store_readings([reading(temp="21.5"), reading(offset=1, temp="22.5", hum=40), reading("D2", offset=2, temp="5")])
+
+        values = SensorValue.objects.order_by("log_id", "metric").values_list("log__data", "metric", "value")
+        self.assertEqual(
+            [(SensorLogs.objects.get(data=data).sensor.device.device_id, metric, value) for data, metric, value in values],
+            [("D1", "temp", 21.5), ("D1", "hum", 40.0), ("D1", "temp", 22.5), ("D2", "temp", 5.0)],
+        )
+        for log in SensorLogs.objects.all():
+            self.assertEqual({value.CreationDateTime for value in log.values.all()}, {log.CreationDateTime})
+
+
+class ValuesTests(TestCase):
+
+    def test_only_finite_numbers_are_values(self):
+        self.assertEqual(parse_values("{'temp': '21.5', 'hum': 40, 'mode': 'auto', 'timestamp': 1700000000, 'err': 'nan'}"),
+                         [("temp", 21.5), ("hum", 40.0)])
+        self.assertEqual(parse_values({"temp": None, "co2": "1e3"}), [("co2", 1000.0)])
+        self.assertEqual(parse_values("21.5"), [])
+        self.assertEqual(parse_values("not json"), [])
+
+    def test_convert_logs_fills_in_the_old_logs_once(self):
+        sensor = Device_Sensor.objects.create(device=Device.objects.create(device_id="D1"), sensor_type="th")
+        for index in range(5):
+            SensorLogs.objects.create(sensor=sensor, data=str({"temp": 20 + index, "mode": "auto"}), CreationDateTime=100.0 + index)
+        parsed = SensorLogs.objects.create(sensor=sensor, data='{"temp": 30}', CreationDateTime=200.0, values_parsed=True)
+
+        self.assertEqual(convert_logs("default", batch_size=2), 5)
+        self.assertEqual(convert_logs("default", batch_size=2), 0)
+
+        self.assertFalse(SensorLogs.objects.filter(values_parsed__isnull=True).exists())
+        self.assertFalse(SensorValue.objects.filter(log=parsed).exists())
+        self.assertEqual(list(SensorValue.objects.order_by("CreationDateTime").values_list("metric", "value", "CreationDateTime")),
+                         [("temp", 20.0 + index, 100.0 + index) for index in range(5)])
+
+
+class SensorCountersTests(TestCase):
+
+    def setUp(self):
+        device_cache.clear()
+
+    def sensor(self, device_id, logs_count, age, is_ai=False):
+        device = Device.objects.create(device_id=device_id)
+        return Device_Sensor.objects.create(device=device, sensor_type="th", Is_AI=is_ai, logs_count=logs_count,
+                                            first_log_time=time.time() - age)
+
+    def test_counters_follow_the_stored_readings(self):
+        store_readings([reading(offset=0, temp=20), reading(offset=2, temp=22)])
+        # a backfilled reading is counted but does not replace the newest one
+        store_readings([reading(offset=-50, temp=15), reading(offset=1, temp=21)])
+
+        sensor = Device_Sensor.objects.get()
+        first = SensorLogs.objects.order_by("CreationDateTime").first().CreationDateTime
+        last = SensorLogs.objects.order_by("CreationDateTime").last()
+        self.assertEqual((sensor.logs_count, sensor.first_log_time, sensor.last_log_time, sensor.last_data),
+                         (4, first, last.CreationDateTime, '{"temp": 22}'))
+
+    def test_only_old_sparse_sensors_are_pruned(self):
+        self.sensor("fake", FAKE_MIN_LOGS - 1, FAKE_MIN_AGE + 60)
+        self.sensor("new", 1, 60)
+        self.sensor("busy", FAKE_MIN_LOGS, FAKE_MIN_AGE + 60)
+        self.sensor("ai", 1, FAKE_MIN_AGE + 60, is_ai=True)
+
+        self.assertEqual(prune_fake_sensors("default"), [("fake", "th")])
+        self.assertEqual(sorted(Device_Sensor.objects.values_list("device__device_id", flat=True)), ["ai", "busy", "new"])
+
+    def test_recount_rebuilds_the_counters_from_the_logs(self):
+        sensor = self.sensor("D1", 0, 0)
+        empty = self.sensor("D2", 7, 0)
+        for created in (300.0, 100.0, 200.0):
+            SensorLogs.objects.create(sensor=sensor, data="{}", CreationDateTime=created)
+
+        self.assertEqual(recount_sensors(), 2)
+
+        sensor.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual((sensor.logs_count, sensor.first_log_time), (3, 100.0))
+        self.assertEqual((empty.logs_count, empty.first_log_time), (0, None))
+
+
+class LatestReadingsTests(TestCase):
+
+    def setUp(self):
+        device_cache.clear()
+        latest_readings.clear()
+        self.addCleanup(latest_readings.clear)
+
+    def test_mirror_follows_the_writer_without_queries(self):
+        store_readings([reading(temp=20)])
+        [(sensor_id, entry)] = latest_readings.snapshot("default").items()
+
+        store_readings([reading(offset=5, temp=21), reading("D2", offset=1, temp=5)])
+        # a backfilled reading does not replace the newest one
+        store_readings([reading(offset=-50, temp=15)])
+        with self.assertNumQueries(0):
+            snapshot = latest_readings.snapshot("default")
+
+        sensors = {sensor.device.device_id: sensor for sensor in Device_Sensor.objects.select_related("device")}
+        self.assertEqual(snapshot, {
+            sensor.id: ("th", sensor.last_log_time, sensor.last_data) for sensor in sensors.values()
+        })
+        self.assertEqual(snapshot[sensor_id][2], '{"temp": 21}')
+
+    def test_fill_latest_sets_the_newest_log_of_every_sensor(self):
+        sensor = Device_Sensor.objects.create(device=Device.objects.create(device_id="D1"), sensor_type="th")
+        Device_Sensor.objects.create(device=Device.objects.create(device_id="D2"), sensor_type="th")
+        for created, data in ((300.0, '{"temp": 3}'), (100.0, '{"temp": 1}')):
+            SensorLogs.objects.create(sensor=sensor, data=data, CreationDateTime=created)
+
+        fill_latest()
+
+        self.assertEqual(sorted(Device_Sensor.objects.values_list("device__device_id", "last_log_time", "last_data")),
+                         [("D1", 300.0, '{"temp": 3}'), ("D2", None, None)])
+
+
+class ReadingHubTests(TestCase):
+
+    def setUp(self):
+        device_cache.clear()
+
+    def drain(self, subscription):
+        events = []
+        while (event := subscription.get(0)) is not None:
+            events.append(event)
+        return events
+
+    def test_stored_readings_reach_the_matching_subscribers(self):
+        everything = reading_hub.subscribe()
+        d1 = reading_hub.subscribe(device_id="D1")
+        status = reading_hub.subscribe(device_id="D1", sensor_type="status")
+        closed = reading_hub.subscribe()
+        for subscription in (everything, d1, status):
+            self.addCleanup(subscription.close)
+        closed.close()
+
+        store_readings([reading(temp=20), reading("D2", offset=1, temp=5), reading(sensor_type="status", offset=2, on=1)])
+
+        self.assertEqual([(event["device_id"], event["sensor_type"]) for event in self.drain(everything)],
+                         [("D1", "th"), ("D2", "th"), ("D1", "status")])
+        self.assertEqual([event["data"] for event in self.drain(d1)], ['{"temp": 20}', '{"on": 1}'])
+        self.assertEqual([event["sensor_type"] for event in self.drain(status)], ["status"])
+        self.assertEqual(self.drain(closed), [])
+
+    def test_slow_subscriber_keeps_the_newest_events(self):
+        hub = ReadingHub()
+        subscription = hub.subscribe()
+        hub.publish([{"device_id": "D1", "sensor_type": "th", "n": n} for n in range(QUEUE_SIZE + 5)])
+
+        self.assertEqual([event["n"] for event in self.drain(subscription)], list(range(5, QUEUE_SIZE + 5)))
+        self.assertEqual(hub.stats(), {"subscribers": 1, "dropped": 5})
+
+    def test_event_loop_subscriber(self):
+        hub = ReadingHub()
+
+        async def listen():
+            subscription = hub.subscribe(sensor_type="th", loop=asyncio.get_running_loop())
+            hub.publish([{"device_id": "D1", "sensor_type": "status"}, {"device_id": "D1", "sensor_type": "th"}])
+            return await subscription.aget(1), await subscription.aget(0.05)
+
+        self.assertEqual(asyncio.run(listen()), ({"device_id": "D1", "sensor_type": "th"}, None))
+        # the loop is closed now: the next publish drops its subscriber
+        hub.publish([{"device_id": "D1", "sensor_type": "th"}])
+        self.assertFalse(hub.has_subscribers())
+
+
+class PostBatchTests(TestCase):
+
+    def post(self, payload):
+        with mock.patch.object(views.ingest_writer, "put") as put:
+            response = self.client.post("/batch/", payload if isinstance(payload, str) else json.dumps(payload),
+                                        content_type="application/json", REMOTE_ADDR="10.0.0.9")
+        self.queued = put.call_args[0][0] if put.called else []
+        return response
+
+    def test_invalid_readings_are_reported_by_index(self):
+        now = time.time()
+        response = self.post({"device_id": "D1", "sensor_type": "th", "readings": [
+            {"data": {"temp": 21}, "timestamp": now - 60},
+            {"sensor_type": "", "data": {"temp": 22}},
+            {"data": {"temp": 23}, "timestamp": now + 3600},
+            {"device_id": "D2", "data": {"temp": 24}},
+            "21.5",
+            {"data": {"temp": 25}, "timestamp": True},
+        ]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["accepted"], 2)
+        self.assertEqual([(rejected["index"], rejected["message"]) for rejected in response.json()["rejected"]], [
+            (1, "sensor_type is required"),
+            (2, "timestamp is out of range"),
+            (4, "reading must be an object"),
+            (5, "timestamp must be unix seconds"),
+        ])
+        self.assertEqual([(reading["device_id"], reading["ip"]) for reading in self.queued], [("D1", "10.0.0.9"), ("D2", "10.0.0.9")])
+        self.assertEqual(self.queued[0]["timestamp"], now - 60)
+        self.assertAlmostEqual(self.queued[1]["timestamp"], now, delta=5)
+
+    def test_rejected_requests(self):
+        self.assertEqual(self.post("{").status_code, 400)
+        self.assertEqual(self.post({"readings": []}).status_code, 400)
+        response = self.post([{"device_id": "D1", "sensor_type": "th", "is_ai": True, "data": {"temp": 21}}])
+        self.assertEqual((response.status_code, response.json()["rejected"][0]["index"]), (400, 0))
+        with mock.patch.object(views, "MAX_BATCH_READINGS", 2):
+            self.assertEqual(self.post([reading(temp=1), reading(temp=2), reading(temp=3)]).status_code, 413)
+        self.assertEqual(self.queued, [])
+
+
+@override_settings(SENSOR_WRITE_QUEUE_SIZE=3, SENSOR_WRITE_BATCH_SIZE=100, SENSOR_WRITE_MAX_LATENCY=60)
+class IngestWriterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.writer = IngestWriter(self.store)
+        self.addCleanup(self.writer.stop, 5)
+
+    def store(self, readings):
+        if any(reading["device_id"] == "bad" for reading in readings):
+            raise ValueError("bad reading")
+        self.batches.append([reading["device_id"] for reading in readings])
+
+    def put(self, *device_ids):
+        self.writer.put([{"device_id": device_id, "sensor_type": "th"} for device_id in device_ids])
+
+    def test_full_queue_refuses_the_whole_request_and_stop_flushes(self):
+        self.put("a", "b")
+        with self.assertRaises(QueueFull):
+            self.put("c", "d")
+        self.put("c")
+
+        # the batch is still waiting for max_latency, stop writes it right away
+        self.writer.stop(5)
+
+        self.assertEqual(self.batches, [["a", "b", "c"]])
+        with self.assertRaises(QueueFull):
+            self.put("e")
+
+    def test_failed_batch_keeps_its_good_readings(self):
+        self.put("a", "bad", "b")
+        self.writer.stop(5)
+
+        self.assertEqual(self.batches, [["a"], ["b"]])
+        self.assertEqual(self.writer.stats(), {"queued": 0, "written": 2, "failed": 1})
+
+    def test_full_queue_is_answered_with_retry_after(self):
+        with mock.patch.object(views.ingest_writer, "put", side_effect=QueueFull("write queue is full")):
+            response = self.client.post("/batch/", json.dumps([reading(temp=1)]), content_type="application/json")
+
+        self.assertEqual((response.status_code, response["Retry-After"]), (503, "1"))
@@ -4,4 +4,5 @@ from . import views
 
 urlpatterns = [
     path("",views.post_data),
+    path("batch/",views.post_batch),
 ]
@@ -0,0 +1,64 @@
+"""Typed copy of the numeric fields of SensorLogs.data.
+
+SensorLogs.data keeps the reading as the device sent it (a JSON text, sometimes with single quotes).
+The ingestion writer also stores every numeric field of it as one SensorValue row (metric, value,
+CreationDateTime), so the charts and exports query numbers instead of parsing JSON per row.
+Logs written before SensorValue existed have values_parsed = NULL; convert_logs() (and the
+convert_sensor_values command) fills them in, and readers parse such logs on the fly meanwhile.
+"""
+import json
+import math
+
+from django.db import transaction
+
+from .models import SensorLogs, SensorValue
+
+SKIP_KEYS = {"timestamp", "type"}
+CONVERT_BATCH_SIZE = 2000   # logs converted per transaction
+
+
+def parse_values(data):
+    """[(metric, float)] of the numeric fields of a reading (dict or JSON text); anything else is skipped"""
+    if not isinstance(data, dict):
+        try:
+            data = json.loads(data.replace("'", '"'))
+        except (ValueError, AttributeError):
+            return []
+        if not isinstance(data, dict):
+            return []
+    values = []
+    for key, value in data.items():
+        if key in SKIP_KEYS:
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        if math.isfinite(value):
+            values.append((key, value))
+    return values
+
+
+def sensor_values(logs):
+    """Unsaved SensorValue rows of saved logs"""
+    return [
+        SensorValue(log_id=log.pk, sensor_id=log.sensor_id, metric=metric, value=value, CreationDateTime=log.CreationDateTime)
+        for log in logs
+        for metric, value in parse_values(log.data)
+    ]
+
+
+def convert_logs(using, batch_size=CONVERT_BATCH_SIZE):
+    """Write the SensorValue rows of the logs of database using that have none yet; returns the number of logs"""
+    pending = SensorLogs.objects.using(using).filter(values_parsed__isnull=True)
+    converted = 0
+    last_id = 0
+    while True:
+        batch = list(pending.filter(id__gt=last_id).order_by("id").only("id", "sensor_id", "data", "CreationDateTime")[:batch_size])
+        if not batch:
+            return converted
+        with transaction.atomic(using=using):
+            SensorValue.objects.using(using).bulk_create(sensor_values(batch))
+            pending.filter(id__gte=batch[0].id, id__lte=batch[-1].id).update(values_parsed=True)
+        last_id = batch[-1].id
+        converted += len(batch)
@@ -1,13 +1,23 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.db import transaction
+from django.db import connections, transaction
+from django.db.models import F, Q, Value, Case, When, TextField
+from django.db.models.functions import Coalesce, Least
 from .models import *
 from .cache import device_cache
-import json
+from .writer import IngestWriter, QueueFull
+from .pruning import PRUNE_INTERVAL, prune_fake_sensors
+from .values import sensor_values
+from .latest import latest_readings, newest_logs
+from .hub import reading_hub, reading_event
+import json, math
 
 latest_data = None
 request_counter = 0
 CHECK_ROTATION_EVERY = 1000
+MAX_BATCH_READINGS = 5000   # readings accepted by one post_batch request
+MAX_CLOCK_SKEW = 300        # seconds a reading timestamp may be ahead of the server clock
+RETRY_AFTER = 1             # seconds a client should wait when the write queue is full
 
 def check_database_rotation():
     """Check if database rotation is needed"""
@@ -27,110 +37,263 @@ def check_database_rotation():
         print(f"Rotation check error: {e}")
     return False
 
+def get_client_ip(request):
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    return x_forwarded_for.split(',')[0] if x_forwarded_for else request.META.get('REMOTE_ADDR')
+
+def count_requests(amount=1):
+    """Check rotation every CHECK_ROTATION_EVERY readings"""
+    global request_counter
+    request_counter += amount
+    if request_counter >= CHECK_ROTATION_EVERY:
+        request_counter = 0
+        check_database_rotation()
+
+def get_sensor(device_id, sensor_type, ip, reading):
+    """Device_Sensor of a reading from the cache, creating the device and sensor on first sight.
+    Call inside the writing transaction, and clear device_cache when it rolls back."""
+    is_ai = reading.get("is_ai", False)
+
+    # Check cache first
+    device = device_cache.get_device(device_id)
+
+    if not device:
+        device = Device.objects.filter(device_id=device_id).first()
+
+    if not device:
+        device = Device(
+            device_id=device_id,
+            Is_AI=is_ai,
+            AI_Target=reading.get("target_device_id") if is_ai else None,
+            ip_address=ip
+        )
+        device.save()
+        device_cache.set_device(device_id, device)
+
+        sensor = Device_Sensor(
+            device=device,
+            sensor_type=sensor_type,
+            Is_AI=is_ai,
+            AI_Target=reading.get("sensor_target") if is_ai else None
+        )
+        sensor.save()
+        device_cache.set_sensor(device_id, sensor_type, sensor)
+        return sensor
+
+    # Update IP only if changed
+    if device.ip_address != ip:
+        device.ip_address = ip
+        device.save(update_fields=['ip_address', 'LastUpdate'])
+        device_cache.set_device(device_id, device)
+
+    # Check sensor cache
+    sensor = device_cache.get_sensor(device_id, sensor_type)
+
+    if not sensor:
+        sensor = Device_Sensor.objects.filter(device=device, sensor_type=sensor_type).first()
+
+    if not sensor:
+        sensor = Device_Sensor(
+            device=device,
+            sensor_type=sensor_type,
+            Is_AI=is_ai,
+            AI_Target=reading.get("sensor_target") if is_ai else None
+        )
+        sensor.save()
+
+    device_cache.set_sensor(device_id, sensor_type, sensor)
+    return sensor
+
+def ai_logs(sensor, data, now, pending=()):
+    """Hourly SensorLogs of an AI prediction, unless the sensor already has one from the last 55 minutes
+    (in the database or among the pending, not yet created logs)"""
+    last_log = SensorLogs.objects.filter(sensor=sensor).order_by('-CreationDateTime').first()
+    times = [log.CreationDateTime for log in pending if log.sensor is sensor]
+    if last_log:
+        times.append(last_log.CreationDateTime)
+    last_time = max(times, default=None)
+
+    logs_to_create = []
+    for key, value in data.items():
+        target_values = value[:3]
+        creation_time = now + 3600
+
+        if last_time is None or (creation_time - last_time >= 3300):
+            for x in target_values:
+                logs_to_create.append(SensorLogs(
+                    sensor=sensor,
+                    CreationDateTime=creation_time,
+                    LastUpdate=creation_time,
+                    data=json.dumps({"temperature": x}),
+                    values_parsed=True
+                ))
+                last_time = creation_time
+                creation_time += 3600
+    return logs_to_create
+
+def encode_data(data):
+    return json.dumps(data) if isinstance(data, dict) else data
+
+def store_readings(readings):
+    """Write validated readings (with their "ip") and their numeric values in one transaction; runs in the writer thread"""
+    from DatabaseGuardian.managers import get_current_write_db
+
+    now = time.time()
+    # the sensor tables live in the current rotated database
+    database = get_current_write_db()
+    try:
+        with transaction.atomic(using=database):
+            sensors = {}
+            logs_to_create = []
+            for reading in sorted(readings, key=lambda reading: reading["timestamp"]):
+                key = (reading["device_id"], reading["sensor_type"])
+                if key not in sensors:
+                    sensors[key] = get_sensor(reading["device_id"], reading["sensor_type"], reading["ip"], reading)
+                if reading.get("is_ai", False):
+                    logs_to_create += ai_logs(sensors[key], reading["data"], reading["timestamp"], logs_to_create)
+                else:
+                    logs_to_create.append(SensorLogs(
+                        sensor=sensors[key],
+                        data=encode_data(reading["data"]),
+                        CreationDateTime=reading["timestamp"],
+                        LastUpdate=now,
+                        values_parsed=True
+                    ))
+            SensorLogs.objects.bulk_create(logs_to_create)
+            if logs_to_create and not connections[database].features.can_return_rows_from_bulk_insert:
+                assign_ids(logs_to_create, database)
+            SensorValue.objects.bulk_create(sensor_values(logs_to_create))
+            update_counters(logs_to_create)
+    except Exception:
+        # get_sensor cached the devices and sensors of the rolled-back transaction
+        device_cache.clear()
+        raise
+    latest_readings.update(database, logs_to_create)
+    if reading_hub.has_subscribers():
+        reading_hub.publish([reading_event(log) for log in logs_to_create])
+    count_requests(len(readings))
+
+def assign_ids(logs, database):
+    """Set the pks bulk_create could not return (SQLite before 3.35). The logs are the newest rows of the
+    table: their ids were allocated in order while this transaction holds the write lock."""
+    ids = list(SensorLogs.objects.using(database).order_by('-id').values_list('id', flat=True)[:len(logs)])
+    for log, pk in zip(logs, reversed(ids)):
+        log.pk = pk
+
+def update_counters(logs):
+    """Add the new logs to logs_count / first_log_time / last_log_time / last_data of their sensors"""
+    counters = {}
+    for log in logs:
+        count, first = counters.get(log.sensor_id, (0, log.CreationDateTime))
+        counters[log.sensor_id] = (count + 1, min(first, log.CreationDateTime))
+    newest = newest_logs(logs)
+    for sensor_id, (count, first) in counters.items():
+        last = newest[sensor_id]
+        # a late (backfilled) reading does not replace a newer one
+        is_newer = Q(last_log_time__isnull=True) | Q(last_log_time__lte=last.CreationDateTime)
+        Device_Sensor.objects.filter(pk=sensor_id).update(
+            logs_count=F('logs_count') + count,
+            first_log_time=Coalesce(Least('first_log_time', Value(first)), Value(first)),
+            last_log_time=Case(When(is_newer, then=Value(last.CreationDateTime)), default=F('last_log_time')),
+            last_data=Case(When(is_newer, then=Value(last.data)), default=F('last_data'), output_field=TextField()),
+        )
+
+ingest_writer = IngestWriter(store_readings)
+ingest_writer.every(PRUNE_INTERVAL, prune_fake_sensors)
+
+def queue_full_response(e):
+    response = JsonResponse({'status': 'error', 'message': str(e)}, status=503)
+    response['Retry-After'] = str(RETRY_AFTER)
+    return response
+
+def validate_reading(reading, defaults, now):
+    """Normalized copy of one reading; raises ValueError with the reason it is rejected"""
+    if not isinstance(reading, dict):
+        raise ValueError("reading must be an object")
+    reading = {**defaults, **reading}
+    for field in ("device_id", "sensor_type"):
+        if not isinstance(reading.get(field), str) or not reading[field].strip():
+            raise ValueError(f"{field} is required")
+    if "data" not in reading or not isinstance(reading["data"], (dict, str)):
+        raise ValueError("data must be an object or a string")
+    if reading.get("is_ai", False):
+        if not isinstance(reading["data"], dict) or not all(isinstance(value, list) for value in reading["data"].values()):
+            raise ValueError("AI data must map each key to a list of predictions")
+        # predictions are placed relative to the time they arrive
+        reading["timestamp"] = now
+        return reading
+    timestamp = reading.get("timestamp", now)
+    if isinstance(timestamp, bool) or not isinstance(timestamp, (int, float)) or not math.isfinite(timestamp):
+        raise ValueError("timestamp must be unix seconds")
+    if timestamp > now + MAX_CLOCK_SKEW or timestamp <= 0:
+        raise ValueError("timestamp is out of range")
+    reading["timestamp"] = float(timestamp)
+    return reading
+
 @csrf_exempt
 def post_data(request):
-    """Optimized sensor data endpoint with caching and single transaction"""
-    global latest_data, request_counter
+    """Sensor data endpoint: validates the reading and queues it for the writer thread"""
+    global latest_data
     if request.method != "POST":
         return JsonResponse({'status': 'error', 'message': 'Only POST allowed'}, status=405)
-    
-    # Check rotation every N requests
-    request_counter += 1
-    if request_counter >= CHECK_ROTATION_EVERY:
-        request_counter = 0
-        check_database_rotation()
-    
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    ip = x_forwarded_for.split(',')[0] if x_forwarded_for else request.META.get('REMOTE_ADDR')
-            
+
     try:
         raw = request.body.decode('utf-8')
         latest_data = json.loads(raw)
-        
-        IS_AI = latest_data.get("is_ai", False)
-        device_id = latest_data["device_id"]
-        sensor_type = latest_data["sensor_type"]
-        
-        with transaction.atomic():
-            # Check cache first
-            device = device_cache.get_device(device_id)
-            
-            if not device:
-                device = Device.objects.filter(device_id=device_id).first()
-                
-            if not device:
-                device = Device(
-                    device_id=device_id,
-                    Is_AI=IS_AI,
-                    AI_Target=latest_data.get("target_device_id") if IS_AI else None,
-                    ip_address=ip
-                )
-                device.save()
-                device_cache.set_device(device_id, device)
-                
-                sensor = Device_Sensor(
-                    device=device,
-                    sensor_type=sensor_type,
-                    Is_AI=IS_AI,
-                    AI_Target=latest_data.get("sensor_target") if IS_AI else None
-                )
-                sensor.save()
-                device_cache.set_sensor(device_id, sensor_type, sensor)
-            else:
-                # Update IP only if changed
-                if device.ip_address != ip:
-                    device.ip_address = ip
-                    device.save(update_fields=['ip_address', 'LastUpdate'])
-                    device_cache.set_device(device_id, device)
-                
-                # Check sensor cache
-                sensor = device_cache.get_sensor(device_id, sensor_type)
-                
-                if not sensor:
-                    sensor = Device_Sensor.objects.filter(device=device, sensor_type=sensor_type).first()
-                    
-                if not sensor:
-                    sensor = Device_Sensor(
-                        device=device,
-                        sensor_type=sensor_type,
-                        Is_AI=IS_AI,
-                        AI_Target=latest_data.get("sensor_target") if IS_AI else None
-                    )
-                    sensor.save()
-                    
-                device_cache.set_sensor(device_id, sensor_type, sensor)
-
-            # Save logs
-            now = time.time()
-
-            if IS_AI:
-                for key, value in latest_data["data"].items():
-                    target_values = value[:3]
-                    creation_time = now + 3600
-                    
-                    last_log = SensorLogs.objects.filter(sensor=sensor).order_by('-CreationDateTime').first()
-                    
-                    if not last_log or (creation_time - last_log.CreationDateTime >= 3300):
-                        logs_to_create = []
-                        for x in target_values:
-                            logs_to_create.append(SensorLogs(
-                                sensor=sensor,
-                                CreationDateTime=creation_time,
-                                LastUpdate=creation_time,
-                                data=json.dumps({"temperature": x})
-                            ))
-                            creation_time += 3600
-                        SensorLogs.objects.bulk_create(logs_to_create)
-            else:
-                SensorLogs.objects.create(
-                    sensor=sensor,
-                    data=json.dumps(latest_data["data"]) if isinstance(latest_data["data"], dict) else latest_data["data"],
-                    CreationDateTime=now,
-                    LastUpdate=now
-                )
-        
-            return JsonResponse({'status': 'ok'})
-        
+        # a single reading is always stored with its arrival time
+        reading = validate_reading({**latest_data, "timestamp": time.time()}, {}, time.time())
+        reading["ip"] = get_client_ip(request)
+        ingest_writer.put([reading])
+        return JsonResponse({'status': 'ok'})
+    except QueueFull as e:
+        return queue_full_response(e)
     except Exception as e:
         print("Error:", str(e))
-        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
\ No newline at end of file
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+@csrf_exempt
+def post_batch(request):
+    """Many readings in one request, e.g. the backlog a gateway buffered during a network outage.
+
+    Body: {"readings": [{"device_id", "sensor_type", "data", "timestamp"?, "is_ai"?, ...}, ...]} or a bare
+    list; fields set next to "readings" apply to every reading that does not set them. Readings without a
+    timestamp (unix seconds) get the arrival time. Invalid readings are reported by index and skipped, the
+    valid ones are queued together and written by the writer thread with one bulk_create.
+    """
+    if request.method != "POST":
+        return JsonResponse({'status': 'error', 'message': 'Only POST allowed'}, status=405)
+
+    try:
+        payload = json.loads(request.body.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError) as e:
+        return JsonResponse({'status': 'error', 'message': f'Invalid JSON: {e}'}, status=400)
+
+    defaults = {}
+    if isinstance(payload, dict):
+        defaults = {key: value for key, value in payload.items() if key != "readings"}
+        payload = payload.get("readings")
+    if not isinstance(payload, list) or not payload:
+        return JsonResponse({'status': 'error', 'message': 'readings must be a non-empty list'}, status=400)
+    if len(payload) > MAX_BATCH_READINGS:
+        return JsonResponse({'status': 'error', 'message': f'At most {MAX_BATCH_READINGS} readings per request'}, status=413)
+
+    now = time.time()
+    ip = get_client_ip(request)
+    readings = []
+    rejected = []
+    for index, reading in enumerate(payload):
+        try:
+            reading = validate_reading(reading, defaults, now)
+        except ValueError as e:
+            rejected.append({'index': index, 'message': str(e)})
+            continue
+        reading["ip"] = ip
+        readings.append(reading)
+    if not readings:
+        return JsonResponse({'status': 'error', 'message': 'No valid readings', 'rejected': rejected}, status=400)
+
+    try:
+        ingest_writer.put(readings)
+    except QueueFull as e:
+        return queue_full_response(e)
+    return JsonResponse({'status': 'ok', 'accepted': len(readings), 'rejected': rejected})
@@ -0,0 +1,137 @@
+"""Single-writer ingestion queue for the sensor readings.
+
+Request threads only validate a reading and append it to a bounded in-memory queue; one writer
+thread drains the queue and commits the readings in batched transactions, so SQLite sees one
+writer and one fsync per batch instead of one per request. A full queue is reported back to the
+caller (backpressure) instead of blocking the request, and the queue is flushed at shutdown.
+Periodic maintenance jobs registered with every() run on the same thread between batches.
+
+Settings: SENSOR_WRITE_QUEUE_SIZE, SENSOR_WRITE_BATCH_SIZE, SENSOR_WRITE_MAX_LATENCY.
+"""
+import atexit
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+
+QUEUE_SIZE = 10000      # readings waiting to be written before new ones are refused
+BATCH_SIZE = 500        # readings committed per transaction
+MAX_LATENCY = 0.5       # seconds a reading may wait for its batch to fill
+STOP_TIMEOUT = 30       # seconds the shutdown waits for the queue to drain
+
+
+class QueueFull(Exception):
+    pass
+
+
+class IngestWriter:
+    """Bounded queue of readings with one thread that passes them to store(readings) in batches"""
+
+    def __init__(self, store):
+        self.store = store
+        self.queue_size = getattr(settings, 'SENSOR_WRITE_QUEUE_SIZE', QUEUE_SIZE)
+        self.batch_size = getattr(settings, 'SENSOR_WRITE_BATCH_SIZE', BATCH_SIZE)
+        self.max_latency = getattr(settings, 'SENSOR_WRITE_MAX_LATENCY', MAX_LATENCY)
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopping = False
+        self.jobs = []          # [interval, job, next run (monotonic)]
+        self.written = 0
+        self.failed = 0
+
+    def put(self, readings):
+        """Queue all readings or none of them; raises QueueFull when they do not fit"""
+        with self.condition:
+            if self.stopping:
+                raise QueueFull("writer is shutting down")
+            if len(self.queue) + len(readings) > self.queue_size:
+                raise QueueFull(f"write queue is full ({len(self.queue)} readings waiting)")
+            self.queue.extend(readings)
+            self._start()
+            self.condition.notify()
+
+    def every(self, interval, job):
+        """Run job() on the writer thread every interval seconds"""
+        self.jobs.append([interval, job, time.monotonic() + interval])
+
+    def _start(self):
+        # started on the first reading, so management commands never run a writer
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="sensor-writer", daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+
+    def _next_batch(self):
+        """Wait until a batch is full, its oldest reading is max_latency old or the writer stops"""
+        with self.condition:
+            while not self.queue and not self.stopping:
+                if not self.condition.wait(self._until_next_job()):
+                    return []
+            deadline = time.monotonic() + self.max_latency
+            while len(self.queue) < self.batch_size and not self.stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            count = min(len(self.queue), self.batch_size)
+            return [self.queue.popleft() for _ in range(count)]
+
+    def _until_next_job(self):
+        if not self.jobs:
+            return None
+        return max(0, min(entry[2] for entry in self.jobs) - time.monotonic())
+
+    def _run_jobs(self):
+        now = time.monotonic()
+        for entry in self.jobs:
+            interval, job, due = entry
+            if now < due:
+                continue
+            entry[2] = now + interval
+            try:
+                job()
+            except Exception as e:
+                print(f"Writer job error: {e}")
+                close_old_connections()
+
+    def _run(self):
+        while True:
+            self._run_jobs()
+            batch = self._next_batch()
+            if not batch:
+                if self.stopping:
+                    break
+                continue
+            self._write(batch)
+        close_old_connections()
+
+    def _write(self, batch):
+        try:
+            self.store(batch)
+            self.written += len(batch)
+        except Exception as e:
+            print(f"Writer batch error: {e}")
+            close_old_connections()
+            # keep the good readings of a failed batch
+            for reading in batch:
+                try:
+                    self.store([reading])
+                    self.written += 1
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Writer dropped reading of {reading.get('device_id')}/{reading.get('sensor_type')}: {e}")
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Write what is queued and stop the thread"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def stats(self):
+        with self.condition:
+            return {'queued': len(self.queue), 'written': self.written, 'failed': self.failed}